@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import asyncio
+from datetime import datetime
+
+import numpy as np
+import psycopg2
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "scripts"))
+
+from setup_database import create_database, apply_schema
+from catalog_query import CATALOG_TABLES, query_point
+from async_query import AsyncCatalog, POOL_SIZE
+from generate_data import generate_catalog_rows
+from run_benchmarks import get_latency_stats, get_run_info
+
+# Default number of rows loaded into the two catalog tables together
+DEFAULT_ROWS = 100000
+
+# Number of timed point lookups per run
+POINT_QUERIES = 2000
+
+# Number of lookups with a new connection per lookup (much slower, so fewer)
+CONNECT_QUERIES = 100
+
+# Numbers of lookups in flight at the same time
+CONCURRENCY = [1, 10, 100]
+
+# Number of points whose results are compared between the sync and the async query
+CHECKED_POINTS = 200
+
+# Function to draw random points inside the area covered by generate_catalog_rows
+def get_points(num_points, seed=0):
+    rng = np.random.default_rng(seed)
+    return list(zip(rng.uniform(-180.0, 179.0, num_points).tolist(), rng.uniform(-60.0, -10.0, num_points).tolist()))
+
+def bench_sync(cursor, points):
+    """Time query_point one after the other on one open connection."""
+    latencies = []
+    start_time = time.perf_counter()
+    for longitude, latitude in points:
+        query_start = time.perf_counter()
+        query_point(cursor, longitude, latitude)
+        latencies.append(time.perf_counter() - query_start)
+    elapsed = time.perf_counter() - start_time
+    return {**get_latency_stats(latencies), "queries_per_s": len(points) / elapsed}
+
+def bench_connect_per_call(config, points):
+    """Time query_point with a new connection per lookup, as query_point.py does."""
+    latencies = []
+    start_time = time.perf_counter()
+    for longitude, latitude in points:
+        query_start = time.perf_counter()
+        conn = psycopg2.connect(**config)
+        cursor = conn.cursor()
+        query_point(cursor, longitude, latitude)
+        cursor.close()
+        conn.close()
+        latencies.append(time.perf_counter() - query_start)
+    elapsed = time.perf_counter() - start_time
+    return {**get_latency_stats(latencies), "queries_per_s": len(points) / elapsed}
+
+async def bench_async(connect_kwargs, points, concurrency):
+    """Time AsyncCatalog.query_point with at most concurrency lookups in flight; latencies include waiting for a slot."""
+    async with AsyncCatalog(pool_size=min(concurrency, POOL_SIZE), **connect_kwargs) as catalog:
+        await asyncio.gather(*(catalog.query_point(*point) for point in points[:concurrency]))  # Open the pooled connections
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def lookup(longitude, latitude):
+            query_start = time.perf_counter()
+            async with semaphore:
+                await catalog.query_point(longitude, latitude)
+            latencies.append(time.perf_counter() - query_start)
+
+        start_time = time.perf_counter()
+        await asyncio.gather(*(lookup(*point) for point in points))
+        elapsed = time.perf_counter() - start_time
+    return {**get_latency_stats(latencies), "queries_per_s": len(points) / elapsed, "pool_size": min(concurrency, POOL_SIZE)}
+
+async def get_async_results(connect_kwargs, points):
+    async with AsyncCatalog(**connect_kwargs) as catalog:
+        return await asyncio.gather(*(catalog.query_point(*point) for point in points))
+
+def check_results(cursor, connect_kwargs, points):
+    """Return the points for which AsyncCatalog.query_point and query_point return different rows."""
+    async_results = asyncio.run(get_async_results(connect_kwargs, points))
+    return [point for point, rows in zip(points, async_results) if rows != [tuple(row) for row in query_point(cursor, *point)]]
+
+def main():
+    dbname = input("Enter the benchmark database name (default: bmdata_bench): ") or "bmdata_bench"
+    user = input("Enter the database username: ")
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+    num_rows = int(input(f"Enter the number of catalog rows (default: {DEFAULT_ROWS}): ") or DEFAULT_ROWS)
+    if input(f"All rows of {' and '.join(CATALOG_TABLES)} in '{dbname}' will be deleted. Continue? (y/N): ").strip().lower() != 'y':
+        return
+    default_output = os.path.join(REPO_DIR, "benchmarks", "results", f"async_{datetime.now():%Y%m%d_%H%M%S}.json")
+    output_json = input(f"Enter the output JSON file (default: {default_output}): ").strip() or default_output
+
+    config = {"dbname": "postgres", "user": user, "password": password, "host": host, "port": port}
+    create_database(config, dbname)
+    apply_schema(config, dbname)
+    db_config = {**config, "dbname": dbname}
+    connect_kwargs = {"database": dbname, "user": user, "password": password, "host": host, "port": int(port)}
+    conn = psycopg2.connect(**db_config)
+    cursor = conn.cursor()
+
+    print(f"Loading {num_rows} rows...")
+    cursor.execute(f"TRUNCATE {', '.join(CATALOG_TABLES)}")
+    for seed, table_name in enumerate(CATALOG_TABLES):
+        generate_catalog_rows(cursor, table_name, num_rows // len(CATALOG_TABLES), seed)
+    conn.commit()
+    for table_name in CATALOG_TABLES:
+        cursor.execute(f"ANALYZE {table_name}")
+    conn.commit()
+
+    points = get_points(POINT_QUERIES)
+    mismatches = check_results(cursor, connect_kwargs, points[:CHECKED_POINTS])
+    report = {"run": get_run_info(), "rows": num_rows, "mismatches": mismatches, "results": {}}
+    print(f"Async and sync results differ for {len(mismatches)} of {CHECKED_POINTS} points")
+
+    report["results"]["sync"] = bench_sync(cursor, points)
+    report["results"]["sync_connect_per_call"] = bench_connect_per_call(db_config, points[:CONNECT_QUERIES])
+    for concurrency in CONCURRENCY:
+        report["results"][f"async_{concurrency}"] = asyncio.run(bench_async(connect_kwargs, points, concurrency))
+    cursor.close()
+    conn.close()
+
+    for name, result in report["results"].items():
+        print(f"{name}: {result['queries_per_s']:.0f} queries/s, p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_json)), exist_ok=True)
+    with open(output_json, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote results to {output_json}")
+    if mismatches:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
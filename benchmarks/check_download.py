@@ -0,0 +1,165 @@
+import os
+import sys
+import random
+import hashlib
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "scripts"))
+
+from download_AGB_China import create_session, download_file, download_all
+
+# Size of the served test files
+FILE_SIZE = 3 * 1024 * 1024 + 123
+
+# Local stand-in for the AGB China server: serves FILES by their fileName query parameter
+# with HEAD and single Range requests, and records the Range header of every GET
+class RangeHandler(BaseHTTPRequestHandler):
+    files = {}
+    ranges = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def get_file(self):
+        names = parse_qs(urlparse(self.path).query).get("fileName")
+        data = self.files.get(names[0]) if names else None
+        if data is None:
+            self.send_error(404)
+        return data
+
+    def do_HEAD(self):
+        data = self.get_file()
+        if data is None:
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        data = self.get_file()
+        if data is None:
+            return
+        range_header = self.headers.get("Range")
+        RangeHandler.ranges.append(range_header)
+        if not range_header:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        start, _, end = range_header[len("bytes="):].partition("-")
+        start = int(start)
+        end = int(end) if end else len(data) - 1
+        if start >= len(data):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(data)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = data[start:end + 1]
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{start + len(body) - 1}/{len(data)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Function to start the stand-in server in a background thread
+def start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def get_url(server, filename, year=2020):
+    return f"http://127.0.0.1:{server.server_address[1]}/V1/{year}/download?fileName={filename}"
+
+def read_file(path):
+    with open(path, "rb") as file:
+        return file.read()
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(data)
+
+def check_resume(server, session, work_dir, data):
+    """A half-written .part file is resumed with a Range request."""
+    filepath = os.path.join(work_dir, "resume.tif")
+    write_file(filepath + ".part", data[:len(data) // 2])
+    RangeHandler.ranges.clear()
+    status = download_file(session, get_url(server, "data.tif"), filepath)
+    assert status == "downloaded", status
+    assert RangeHandler.ranges == [f"bytes={len(data) // 2}-"], RangeHandler.ranges
+    assert read_file(filepath) == data, "resumed file differs from the served file"
+    assert not os.path.exists(filepath + ".part")
+
+def check_complete_part(server, session, work_dir, data):
+    """A .part file that already holds the whole file gets a 416 and is moved into place."""
+    filepath = os.path.join(work_dir, "complete_part.tif")
+    write_file(filepath + ".part", data)
+    RangeHandler.ranges.clear()
+    status = download_file(session, get_url(server, "data.tif"), filepath, hashlib.sha256(data).hexdigest())
+    assert status == "downloaded", status
+    assert RangeHandler.ranges == [f"bytes={len(data)}-"], RangeHandler.ranges
+    assert read_file(filepath) == data
+
+def check_checksum_mismatch(server, session, work_dir, data):
+    """A download that does not match its checksum is deleted and reported."""
+    filepath = os.path.join(work_dir, "mismatch.tif")
+    try:
+        download_file(session, get_url(server, "data.tif"), filepath, "0" * 64)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("checksum mismatch was not reported")
+    assert not os.path.exists(filepath) and not os.path.exists(filepath + ".part")
+
+def check_existing_files(server, session, work_dir, data):
+    """Existing final files are only skipped if their size and checksum match the server, and are reported as complete."""
+    base_dir = os.path.join(work_dir, "existing")
+    checksums = {name: hashlib.sha256(data).hexdigest() for name in ["truncated.tif", "corrupt.tif", "good.tif"]}
+    RangeHandler.files.update({name: data for name in checksums})
+    write_file(os.path.join(base_dir, "2020", "truncated.tif"), data[:1000])
+    write_file(os.path.join(base_dir, "2020", "corrupt.tif"), bytes(len(data)))
+    write_file(os.path.join(base_dir, "2020", "good.tif"), data)
+
+    completed = []
+    RangeHandler.ranges.clear()
+    failures = download_all(
+        [get_url(server, name) for name in checksums], base_dir, 2, checksums,
+        session=session, on_complete=completed.append
+    )
+    assert not failures, failures
+    for name in checksums:
+        assert read_file(os.path.join(base_dir, "2020", name)) == data, f"{name} differs from the served file"
+    assert sorted(os.path.basename(path) for path in completed) == ["corrupt.tif", "good.tif", "truncated.tif"], completed
+    assert sorted(RangeHandler.ranges, key=str) == sorted([None, "bytes=1000-"], key=str), RangeHandler.ranges
+
+def main():
+    data = random.Random(0).randbytes(FILE_SIZE)
+    RangeHandler.files["data.tif"] = data
+    server = start_server()
+    session = create_session(2)
+    failed = False
+    try:
+        for check in [check_resume, check_complete_part, check_checksum_mismatch, check_existing_files]:
+            with tempfile.TemporaryDirectory() as work_dir:
+                try:
+                    check(server, session, work_dir, data)
+                except Exception as e:
+                    failed = True
+                    print(f"{check.__name__}: FAIL ({type(e).__name__}: {e})")
+                else:
+                    print(f"{check.__name__}: ok")
+    finally:
+        server.shutdown()
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import json
+
+# Metrics that are compared, by the ending of their name. Everything else (AOI fractions,
+# tile, row and chip counts, pool sizes, budgets, ...) describes the run and is skipped.
+HIGHER_IS_BETTER = ("_per_s", "_per_sec")
+LOWER_IS_BETTER = ("seconds", "_ms")
+
+# Fields with a metric ending that are settings rather than measurements
+NOT_COMPARED = {"budget_ms"}
+
+# Function to tell the direction of a metric from its name
+def get_direction(metric):
+    """Return 1 if a larger value is better, -1 if a smaller value is better and None for fields that are not compared."""
+    name = metric.rsplit(".", 1)[-1]
+    if name in NOT_COMPARED:
+        return None
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return None
+
+# Function to flatten the nested results of a run into "path: value" pairs
+def flatten(results, prefix=""):
+    values = {}
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        # Extraction runs are identified by their AOI size
+        items = ((f"aoi_{item.get('aoi_fraction', i)}", item) for i, item in enumerate(results))
+    else:
+        return {prefix: results} if isinstance(results, (int, float)) and not isinstance(results, bool) else {}
+    for key, value in items:
+        values.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    return values
+
+def compare_runs(old_report, new_report):
+    """
+    Return (metric, old, new, change in percent, better) for every metric present in both runs.
+
+    Only throughput (HIGHER_IS_BETTER) and time (LOWER_IS_BETTER) metrics are compared.
+    """
+    old_values = flatten(old_report["scenarios"])
+    new_values = flatten(new_report["scenarios"])
+    rows = []
+    for metric in sorted(old_values.keys() & new_values.keys()):
+        direction = get_direction(metric)
+        if direction is None:
+            continue
+        old, new = old_values[metric], new_values[metric]
+        change = (new - old) / old * 100 if old else float("nan")
+        better = (new - old) * direction > 0
+        rows.append((metric, old, new, change, better))
+    return rows
+
+def main():
+    old_json = input("Enter the JSON file of the baseline run: ").strip()
+    new_json = input("Enter the JSON file of the new run: ").strip()
+    threshold = float(input("Only show changes larger than this many percent (default: 5): ") or 5)
+    with open(old_json) as file:
+        old_report = json.load(file)
+    with open(new_json) as file:
+        new_report = json.load(file)
+
+    print(f"Baseline: {old_report['run']['commit']} ({old_report['run']['timestamp']})")
+    print(f"New:      {new_report['run']['commit']} ({new_report['run']['timestamp']})")
+    for metric, old, new, change, better in compare_runs(old_report, new_report):
+        if abs(change) >= threshold:
+            print(f"{'+' if better else '-'} {metric}: {old:.4g} -> {new:.4g} ({change:+.1f}%)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import os
+import sys
+import json
+import time
+from datetime import datetime
+
+import psycopg2
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "scripts"))
+
+from setup_database import create_database, apply_schema
+from catalog_query import CATALOG_TABLES, build_catalog_query, PreparedCatalogQuery
+from generate_data import generate_catalog_rows
+from run_benchmarks import get_run_info
+
+# Default number of rows loaded into the two catalog tables together
+DEFAULT_ROWS = 1000000
+
+# Number of timed executions per case for the prepared/unprepared comparison
+REPEATS = 50
+
+# Query cases inside the area covered by generate_catalog_rows (60°S to 10°S)
+CASES = [
+    {"name": "point", "geom": "POINT(20.5 -35.5)"},
+    {"name": "bbox_1deg", "geom": "POLYGON((20 -36, 21 -36, 21 -35, 20 -35, 20 -36))"},
+    {"name": "bbox_10deg", "geom": "POLYGON((20 -40, 30 -40, 30 -30, 20 -30, 20 -40))"},
+    {"name": "bbox_1deg_year", "geom": "POLYGON((20 -36, 21 -36, 21 -35, 20 -35, 20 -36))", "filters": {"years": (2020, 2020)}},
+    {"name": "bbox_1deg_source", "geom": "POLYGON((20 -36, 21 -36, 21 -35, 20 -35, 20 -36))", "filters": {"sources": ["background"]}},
+    {"name": "bbox_1deg_one_table", "geom": "POLYGON((20 -36, 21 -36, 21 -35, 20 -35, 20 -36))", "filters": {"tables": ["biomass_data"]}},
+    {"name": "bbox_1deg_latest", "geom": "POLYGON((20 -36, 21 -36, 21 -35, 20 -35, 20 -36))", "filters": {"policy": "latest_per_source"}},
+]
+
+# Function to list all nodes of an EXPLAIN (FORMAT JSON) plan
+def iter_plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_plan_nodes(child)
+
+# Function to check that a plan uses the spatial indexes and does not deduplicate rows
+def check_plan(plan):
+    """Return a list of problems: sequential scans of the catalog tables or a Unique/HashAggregate step."""
+    problems = []
+    for node in iter_plan_nodes(plan["Plan"]):
+        relation = node.get("Relation Name", "")
+        if node["Node Type"] == "Seq Scan" and relation.startswith(tuple(CATALOG_TABLES)):
+            problems.append(f"sequential scan on {relation}")
+        if node["Node Type"] in ("Unique", "HashAggregate"):
+            problems.append(f"{node['Node Type']} step (duplicate elimination)")
+    return problems
+
+def explain_case(cursor, case):
+    """Run EXPLAIN ANALYZE for a case and time it unprepared and prepared."""
+    filters = case.get("filters", {})
+    query, params = build_catalog_query(**filters)
+    params["geom"] = case["geom"]
+    cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+    plan = cursor.fetchone()[0][0]
+
+    start_time = time.perf_counter()
+    for _ in range(REPEATS):
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    unprepared_ms = (time.perf_counter() - start_time) / REPEATS * 1000
+
+    prepared_query = PreparedCatalogQuery(cursor, name=f"explain_{case['name']}", **filters)
+    start_time = time.perf_counter()
+    for _ in range(REPEATS):
+        prepared_query.execute(case["geom"])
+    prepared_ms = (time.perf_counter() - start_time) / REPEATS * 1000
+    prepared_query.close()
+
+    index_names = sorted({node["Index Name"] for node in iter_plan_nodes(plan["Plan"]) if "Index Name" in node})
+    return {
+        "rows": len(rows),
+        "planning_ms": plan["Planning Time"],
+        "execution_ms": plan["Execution Time"],
+        "indexes": index_names,
+        "unprepared_ms": unprepared_ms,
+        "prepared_ms": prepared_ms,
+        "problems": check_plan(plan),
+        "plan": plan["Plan"],
+    }
+
+def main():
+    dbname = input("Enter the benchmark database name (default: bmdata_bench): ") or "bmdata_bench"
+    user = input("Enter the database username: ")
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+    num_rows = int(input(f"Enter the number of catalog rows (default: {DEFAULT_ROWS}): ") or DEFAULT_ROWS)
+    if input(f"All rows of {' and '.join(CATALOG_TABLES)} in '{dbname}' will be deleted. Continue? (y/N): ").strip().lower() != 'y':
+        return
+    default_output = os.path.join(REPO_DIR, "benchmarks", "results", f"explain_{datetime.now():%Y%m%d_%H%M%S}.json")
+    output_json = input(f"Enter the output JSON file (default: {default_output}): ").strip() or default_output
+
+    config = {"dbname": "postgres", "user": user, "password": password, "host": host, "port": port}
+    create_database(config, dbname)
+    apply_schema(config, dbname)
+    conn = psycopg2.connect(**{**config, "dbname": dbname})
+    cursor = conn.cursor()
+
+    print(f"Loading {num_rows} rows...")
+    cursor.execute(f"TRUNCATE {', '.join(CATALOG_TABLES)}")
+    for seed, table_name in enumerate(CATALOG_TABLES):
+        generate_catalog_rows(cursor, table_name, num_rows // len(CATALOG_TABLES), seed)
+    conn.commit()
+    for table_name in CATALOG_TABLES:
+        cursor.execute(f"ANALYZE {table_name}")
+    conn.commit()
+
+    report = {"run": get_run_info(), "rows": num_rows, "cases": {}}
+    failed = False
+    for case in CASES:
+        result = explain_case(cursor, case)
+        report["cases"][case["name"]] = result
+        status = "FAIL: " + "; ".join(result["problems"]) if result["problems"] else "ok"
+        failed = failed or bool(result["problems"])
+        print(
+            f"{case['name']}: {result['rows']} rows, execution {result['execution_ms']:.2f} ms, "
+            f"unprepared {result['unprepared_ms']:.2f} ms, prepared {result['prepared_ms']:.2f} ms ({status})"
+        )
+    cursor.close()
+    conn.close()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_json)), exist_ok=True)
+    with open(output_json, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote results to {output_json}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
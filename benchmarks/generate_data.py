@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+from psycopg2.extras import execute_values
+from osgeo import gdal, osr
+
+# Synthetic tile sets in the CRSs of the real datasets: geographic (AGB China),
+# UTM (Open-Canopy style) and CONUS Albers (LANDFIRE)
+SCENARIOS = [
+    {"name": "geographic_small", "crs": "EPSG:4326", "origin": (10.0, 50.0), "resolution": 0.0001, "tile_px": 256, "tiles": (4, 4)},
+    {"name": "geographic_large", "crs": "EPSG:4326", "origin": (10.0, 50.0), "resolution": 0.0001, "tile_px": 1024, "tiles": (4, 4)},
+    {"name": "utm_small", "crs": "EPSG:32633", "origin": (500000.0, 5540000.0), "resolution": 10.0, "tile_px": 256, "tiles": (4, 4)},
+    {"name": "utm_large", "crs": "EPSG:32633", "origin": (500000.0, 5540000.0), "resolution": 10.0, "tile_px": 1024, "tiles": (4, 4)},
+    {"name": "albers_large", "crs": "EPSG:5070", "origin": (-1000000.0, 2000000.0), "resolution": 30.0, "tile_px": 1024, "tiles": (4, 4)},
+]
+
+# Value written to pixels without data
+NODATA = -9999.0
+
+# Share of pixels set to NODATA
+NODATA_FRACTION = 0.05
+
+# Function to write one synthetic tile
+def write_tile(output_tif, crs, geotransform, tile_px, rng):
+    """Write a single-band float32 GeoTIFF with biomass-like values and some no-data pixels."""
+    data = rng.gamma(2.0, 50.0, size=(tile_px, tile_px)).astype(np.float32)
+    data[rng.random((tile_px, tile_px)) < NODATA_FRACTION] = NODATA
+
+    srs = osr.SpatialReference()
+    srs.SetFromUserInput(crs)
+    output_ds = gdal.GetDriverByName("GTiff").Create(
+        output_tif, tile_px, tile_px, 1, gdal.GDT_Float32, ["COMPRESS=LZW", "TILED=YES"]
+    )
+    output_ds.SetGeoTransform(geotransform)
+    output_ds.SetProjection(srs.ExportToWkt())
+    band = output_ds.GetRasterBand(1)
+    band.SetNoDataValue(NODATA)
+    band.WriteArray(data)
+    output_ds = None
+
+def generate_tiles(scenario, output_dir, seed=0):
+    """
+    Write the tiles of a scenario as a regular grid of adjacent GeoTIFFs.
+
+    The same seed always produces the same files, so runs stay comparable.
+
+    Returns:
+        list: Paths of the written tiles.
+    """
+    rng = np.random.default_rng(seed)
+    scenario_dir = os.path.join(output_dir, scenario["name"])
+    os.makedirs(scenario_dir, exist_ok=True)
+    origin_x, origin_y = scenario["origin"]
+    tile_size = scenario["tile_px"] * scenario["resolution"]
+    tiles_x, tiles_y = scenario["tiles"]
+
+    paths = []
+    for ty in range(tiles_y):
+        for tx in range(tiles_x):
+            output_tif = os.path.join(scenario_dir, f"tile_{tx}_{ty}.tif")
+            geotransform = (
+                origin_x + tx * tile_size, scenario["resolution"], 0,
+                origin_y - ty * tile_size, 0, -scenario["resolution"]
+            )
+            write_tile(output_tif, scenario["crs"], geotransform, scenario["tile_px"], rng)
+            paths.append(output_tif)
+    return paths
+
+# Function to get the extent of a scenario in its own CRS
+def get_scenario_bounds(scenario):
+    """Return (minx, miny, maxx, maxy) covered by all tiles of a scenario."""
+    origin_x, origin_y = scenario["origin"]
+    tile_size = scenario["tile_px"] * scenario["resolution"]
+    tiles_x, tiles_y = scenario["tiles"]
+    return (origin_x, origin_y - tiles_y * tile_size, origin_x + tiles_x * tile_size, origin_y)
+
+# Function to fill the catalog with footprints that no benchmark query touches
+def generate_catalog_rows(cursor, table_name, num_rows, seed=0):
+    """
+    Insert num_rows small random footprints with fake file paths, so queries run against a
+    catalog of realistic size. They all lie between 60°S and 10°S, away from the scenarios.
+    """
+    rng = np.random.default_rng(seed)
+    lon = rng.uniform(-180.0, 179.0, num_rows)
+    lat = rng.uniform(-60.0, -11.0, num_rows)
+    size = rng.uniform(0.05, 1.0, num_rows)
+    records = [
+        (
+            f"POLYGON(({x} {y}, {x + s} {y}, {x + s} {y + s}, {x} {y + s}, {x} {y}))",
+            "background", "2020-01-01", f"/nonexistent/background_{i}.tif"
+        )
+        for i, (x, y, s) in enumerate(zip(lon, lat, size))
+    ]
+    execute_values(
+        cursor,
+        f"INSERT INTO {table_name} (location, source, acquisition_date, tif_file_path) VALUES %s",
+        records,
+        template="(ST_GeomFromText(%s, 4326), %s, %s, %s)",
+        page_size=10000
+    )
+
+def main():
+    output_dir = input("Enter the output directory for the synthetic tiles: ").strip()
+    seed = int(input("Enter the random seed (default: 0): ") or 0)
+    for scenario in SCENARIOS:
+        paths = generate_tiles(scenario, output_dir, seed)
+        print(f"Wrote {len(paths)} tiles for {scenario['name']} to {output_dir}")
+
+if __name__ == "__main__":
+    main()
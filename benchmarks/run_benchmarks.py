@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import tempfile
+from datetime import datetime
+
+import numpy as np
+import psycopg2
+from osgeo import gdal
+from pyproj import Transformer
+from shapely.geometry import box
+
+# The benchmarks call the scripts as a library
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "scripts"))
+
+from setup_database import create_database, apply_schema
+from load_data_general import insert_geotiff_data
+from catalog_query import query_database, query_point
+from query_geometry import create_multi_layer_tif, reproject_geometry
+from reproject_data import reproject_file
+from export_chips import export_chips
+from generate_data import SCENARIOS, generate_tiles, generate_catalog_rows, get_scenario_bounds
+
+TABLE_NAME = "biomass_data"
+
+# Rows outside the scenarios, so queries run against a catalog of realistic size
+BACKGROUND_ROWS = 100000
+
+# Number of timed point queries per scenario (after WARMUP_QUERIES untimed ones)
+POINT_QUERIES = 500
+WARMUP_QUERIES = 20
+
+# Side length of the extraction AOIs as share of the scenario extent
+AOI_FRACTIONS = [0.1, 0.25, 0.5, 1.0]
+
+# Number of tiles reprojected per scenario
+REPROJECT_TILES = 4
+
+# Chip size of the chip export benchmark, small enough for many chips per scenario
+BENCH_CHIP_SIZE = 64
+
+# Function to summarize latencies in seconds
+def get_latency_stats(latencies):
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "count": len(latencies),
+        "mean_ms": float(latencies_ms.mean()),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+    }
+
+def bench_ingest(conn, paths, source):
+    """Time insert_geotiff_data for all tiles of a scenario, including the commit."""
+    cursor = conn.cursor()
+    start_time = time.perf_counter()
+    for path in paths:
+        insert_geotiff_data(cursor, path, source, 2024, TABLE_NAME)
+    conn.commit()
+    elapsed = time.perf_counter() - start_time
+    cursor.execute(f"ANALYZE {TABLE_NAME}")
+    conn.commit()
+    cursor.close()
+    return {"rows": len(paths), "seconds": elapsed, "rows_per_sec": len(paths) / elapsed}
+
+def bench_point_queries(cursor, scenario, seed=0):
+    """Time query_point for random points inside the scenario."""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = get_scenario_bounds(scenario)
+    to_4326 = Transformer.from_crs(scenario["crs"], "EPSG:4326", always_xy=True)
+    lon, lat = to_4326.transform(
+        rng.uniform(minx, maxx, WARMUP_QUERIES + POINT_QUERIES),
+        rng.uniform(miny, maxy, WARMUP_QUERIES + POINT_QUERIES)
+    )
+
+    latencies = []
+    hits = 0
+    for i, (x, y) in enumerate(zip(lon, lat)):
+        start_time = time.perf_counter()
+        results = query_point(cursor, x, y)
+        elapsed = time.perf_counter() - start_time
+        if i >= WARMUP_QUERIES:
+            latencies.append(elapsed)
+            hits += len(results)
+    return {**get_latency_stats(latencies), "mean_hits": hits / POINT_QUERIES}
+
+def bench_extraction(cursor, scenario, work_dir):
+    """Time catalog query plus create_multi_layer_tif for centered square AOIs of growing size."""
+    minx, miny, maxx, maxy = get_scenario_bounds(scenario)
+    center_x, center_y = (minx + maxx) / 2, (miny + maxy) / 2
+    runs = []
+    for fraction in AOI_FRACTIONS:
+        half_x, half_y = (maxx - minx) * fraction / 2, (maxy - miny) * fraction / 2
+        aoi = box(center_x - half_x, center_y - half_y, center_x + half_x, center_y + half_y)
+
+        start_time = time.perf_counter()
+        results = query_database(cursor, reproject_geometry(aoi, scenario["crs"], "EPSG:4326").wkt, sources=[scenario["name"]])
+        query_seconds = time.perf_counter() - start_time
+        intersecting_files = [result[0] for result in results]
+
+        output_tif = os.path.join(work_dir, f"{scenario['name']}_{fraction}.tif")
+        start_time = time.perf_counter()
+        target_tif = create_multi_layer_tif(intersecting_files, output_tif, aoi, scenario["crs"], None, scenario["crs"])
+        extract_seconds = time.perf_counter() - start_time
+
+        output_ds = gdal.Open(target_tif)
+        band = output_ds.GetRasterBand(1)
+        output_bytes = output_ds.RasterXSize * output_ds.RasterYSize * output_ds.RasterCount * gdal.GetDataTypeSize(band.DataType) // 8
+        output_ds = None
+        runs.append({
+            "aoi_fraction": fraction,
+            "tiles": len(intersecting_files),
+            "output_mb": output_bytes / 1024 ** 2,
+            "query_ms": query_seconds * 1000,
+            "extract_seconds": extract_seconds,
+            "mb_per_sec": output_bytes / 1024 ** 2 / extract_seconds,
+        })
+    return runs
+
+def bench_reprojection(paths, scenario, work_dir):
+    """Time reproject_file on the first tiles of a scenario, into EPSG:4326 or (for geographic tiles) UTM 33N."""
+    target_crs = "EPSG:32633" if scenario["crs"] == "EPSG:4326" else "EPSG:4326"
+    pixels = 0
+    start_time = time.perf_counter()
+    for path in paths[:REPROJECT_TILES]:
+        reproject_file(path, os.path.join(work_dir, "reprojected_" + os.path.basename(path)), target_crs)
+        pixels += scenario["tile_px"] ** 2
+    elapsed = time.perf_counter() - start_time
+    return {"target_crs": target_crs, "tiles": min(REPROJECT_TILES, len(paths)), "seconds": elapsed, "megapixels_per_sec": pixels / 1e6 / elapsed}
+
+def bench_chips(conn, paths, scenario, work_dir):
+    """
+    Time export_chips over the whole scenario, with the tiles also catalogued as canopy height.
+
+    The chips are written on the grid of the tiles, so the benchmark measures reading and
+    writing rather than resampling. The canopy height rows are removed afterwards.
+    """
+    cursor = conn.cursor()
+    for path in paths:
+        insert_geotiff_data(cursor, path, scenario["name"], 2024, "canopy_height_data")
+    conn.commit()
+    try:
+        output_dir = os.path.join(work_dir, f"chips_{scenario['name']}")
+        start_time = time.perf_counter()
+        manifest = export_chips(
+            cursor, box(*get_scenario_bounds(scenario)), scenario["crs"], output_dir, scenario["crs"],
+            scenario["resolution"], BENCH_CHIP_SIZE, min_valid=0.0, filters={"sources": [scenario["name"]]}
+        )
+        elapsed = time.perf_counter() - start_time
+    finally:
+        cursor.execute("DELETE FROM canopy_height_data WHERE source = %s", (scenario["name"],))
+        conn.commit()
+        cursor.close()
+    return {
+        "chip_size": BENCH_CHIP_SIZE,
+        "chips": manifest["chips"],
+        "seconds": elapsed,
+        "chips_per_sec": manifest["chips"] / elapsed,
+    }
+
+# Function to describe the environment of a run
+def get_run_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "gdal": gdal.__version__,
+        "numpy": np.__version__,
+    }
+
+def run_benchmarks(conn, data_dir, work_dir, scenarios=SCENARIOS, seed=0):
+    """
+    Run all benchmarks against an empty benchmark database.
+
+    Returns:
+        dict: Run info and results per scenario, ready to be written as JSON.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"TRUNCATE {TABLE_NAME}")
+    start_time = time.perf_counter()
+    generate_catalog_rows(cursor, TABLE_NAME, BACKGROUND_ROWS, seed)
+    conn.commit()
+    background_seconds = time.perf_counter() - start_time
+
+    report = {
+        "run": get_run_info(),
+        "background": {"rows": BACKGROUND_ROWS, "seconds": background_seconds, "rows_per_sec": BACKGROUND_ROWS / background_seconds},
+        "scenarios": {},
+    }
+    for scenario in scenarios:
+        print(f"Running scenario {scenario['name']}...")
+        paths = generate_tiles(scenario, data_dir, seed)
+        report["scenarios"][scenario["name"]] = {
+            "crs": scenario["crs"],
+            "tile_px": scenario["tile_px"],
+            "tiles": len(paths),
+            "ingest": bench_ingest(conn, paths, scenario["name"]),
+            "point_query": bench_point_queries(cursor, scenario, seed),
+            "extraction": bench_extraction(cursor, scenario, work_dir),
+            "reprojection": bench_reprojection(paths, scenario, work_dir),
+            "chips": bench_chips(conn, paths, scenario, work_dir),
+        }
+        # Keep the scenarios independent of each other
+        cursor.execute(f"DELETE FROM {TABLE_NAME} WHERE source = %s", (scenario["name"],))
+        conn.commit()
+    cursor.close()
+    return report
+
+def main():
+    dbname = input("Enter the benchmark database name (default: bmdata_bench): ") or "bmdata_bench"
+    user = input("Enter the database username: ")
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+    if input(f"All rows of {TABLE_NAME} in '{dbname}' will be deleted. Continue? (y/N): ").strip().lower() != 'y':
+        return
+
+    data_dir = input("Enter the directory for the synthetic tiles (leave blank for a temporary directory): ").strip() or None
+    default_output = os.path.join(REPO_DIR, "benchmarks", "results", f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    output_json = input(f"Enter the output JSON file (default: {default_output}): ").strip() or default_output
+    seed = int(input("Enter the random seed (default: 0): ") or 0)
+
+    config = {"dbname": "postgres", "user": user, "password": password, "host": host, "port": port}
+    create_database(config, dbname)
+    apply_schema(config, dbname)
+    conn = psycopg2.connect(**{**config, "dbname": dbname})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report = run_benchmarks(conn, data_dir or os.path.join(tmp_dir, "data"), tmp_dir, SCENARIOS, seed)
+    conn.close()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_json)), exist_ok=True)
+    with open(output_json, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote results to {output_json}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(REPO_DIR, "scripts")
+
+# Import time budgets of the entry points in milliseconds, and the heavy modules they must
+# not load at import. Budgets are checked against the cumulative time reported by
+# python -X importtime, which does not include interpreter startup.
+ENTRY_POINTS = {
+    "query_point": {"budget_ms": 100, "forbidden": ["psycopg2", "osgeo", "numpy", "pyproj", "shapely", "geopandas"]},
+    "convert_sentinel_tile": {"budget_ms": 50, "forbidden": ["osgeo", "shapely", "geopandas", "pandas"]},
+    "stac_search": {"budget_ms": 300, "forbidden": ["psycopg2", "osgeo", "pyproj", "geopandas"]},
+    "query_geometry": {"budget_ms": 100, "forbidden": ["psycopg2", "osgeo", "numpy", "pyproj", "shapely", "geopandas", "xarray", "rasterio", "dask"]},
+    "zonal_stats": {"budget_ms": 100, "forbidden": ["psycopg2", "osgeo", "numpy", "pyproj", "shapely", "geopandas", "xarray", "rasterio", "dask"]},
+    # The workers of these two need GDAL, numpy and shapely right away; only the libraries
+    # of a single step (reading the AOI file, building the cubes) are deferred
+    "batch_extract": {"budget_ms": 1000, "forbidden": ["geopandas", "pandas", "xarray", "rasterio", "dask"]},
+    "extract_timeseries": {"budget_ms": 1000, "forbidden": ["geopandas", "xarray", "rasterio", "dask"]},
+}
+
+# Number of runs per entry point; the median is reported
+RUNS = 5
+
+# Function to parse the output of python -X importtime
+def parse_importtime(stderr):
+    """Return {module: (self µs, cumulative µs)} of all imports, keeping the first occurrence."""
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.setdefault(name.strip(), (int(self_us), int(cumulative_us)))
+    return imports
+
+# Function to import a module in a fresh interpreter
+def measure_import(module):
+    """
+    Import a module in a new process with -X importtime.
+
+    Returns:
+        tuple: (import time in ms, wall time of the process in ms, {module: (self µs, cumulative µs)}, loaded top-level packages).
+    """
+    code = f"import sys, json, {module}; print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}})))"
+    start_time = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SCRIPTS_DIR, capture_output=True, text=True, env={**os.environ, "PYTHONPATH": SCRIPTS_DIR}
+    )
+    wall_ms = (time.perf_counter() - start_time) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed: {process.stderr.strip().splitlines()[-1]}")
+    imports = parse_importtime(process.stderr)
+    return imports[module][1] / 1000, wall_ms, imports, json.loads(process.stdout.strip().splitlines()[-1])
+
+# Function to time an empty interpreter as baseline for the wall times
+def measure_baseline():
+    wall_times = []
+    for _ in range(RUNS):
+        start_time = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        wall_times.append((time.perf_counter() - start_time) * 1000)
+    return statistics.median(wall_times)
+
+def check_entry_point(module, budget_ms, forbidden):
+    """Import an entry point RUNS times and check the median import time and the loaded packages."""
+    import_times, wall_times = [], []
+    for _ in range(RUNS):
+        import_ms, wall_ms, imports, packages = measure_import(module)
+        import_times.append(import_ms)
+        wall_times.append(wall_ms)
+
+    # Slowest direct and indirect imports of the last run, by their own time
+    heaviest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:10]
+    problems = [f"loads {package}" for package in forbidden if package in packages]
+    import_ms = statistics.median(import_times)
+    if import_ms > budget_ms:
+        problems.append(f"import takes {import_ms:.1f} ms, budget {budget_ms} ms")
+    return {
+        "import_ms": import_ms,
+        "wall_ms": statistics.median(wall_times),
+        "budget_ms": budget_ms,
+        "heaviest": [{"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000} for name, (self_us, cumulative_us) in heaviest],
+        "problems": problems,
+    }
+
+def main():
+    default_output = os.path.join(REPO_DIR, "benchmarks", "results", f"startup_{datetime.now():%Y%m%d_%H%M%S}.json")
+    output_json = input(f"Enter the output JSON file (default: {default_output}): ").strip() or default_output
+
+    baseline_ms = measure_baseline()
+    report = {
+        "run": {"timestamp": datetime.now().isoformat(timespec="seconds"), "host": platform.node(), "python": platform.python_version()},
+        "interpreter_ms": baseline_ms,
+        "entry_points": {},
+    }
+    print(f"Empty interpreter: {baseline_ms:.1f} ms")
+    failed = False
+    for module, config in ENTRY_POINTS.items():
+        result = check_entry_point(module, **config)
+        report["entry_points"][module] = result
+        failed = failed or bool(result["problems"])
+        status = "FAIL: " + "; ".join(result["problems"]) if result["problems"] else "ok"
+        print(
+            f"{module}: import {result['import_ms']:.1f} ms (budget {result['budget_ms']} ms), "
+            f"process {result['wall_ms']:.1f} ms ({status})"
+        )
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_json)), exist_ok=True)
+    with open(output_json, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote results to {output_json}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# Asyncio variants of the catalog queries for servers that run many lookups at once.
+# Queries share an asyncpg connection pool; blocking GDAL reads run in a bounded thread
+# pool, so a burst of requests cannot start more reads than there are workers.
+# Spans are only opened in the read threads and around whole batches: the span stack is
+# kept per thread, so spans around awaits of interleaved coroutines would nest wrongly.
+
+import re
+import time
+import asyncio
+import logging
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncpg
+
+from catalog_query import build_catalog_query, prompt_filters
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+# Default number of pooled database connections
+POOL_SIZE = 10
+
+# Default number of raster reads running at the same time
+READ_WORKERS = 4
+
+# Function to convert a catalog query to the positional parameters of asyncpg
+def to_positional(query, params):
+    """
+    Replace the %(name)s placeholders of a psycopg2 query by $1, $2, ... and return (query, args).
+
+    A name used several times maps to the same position. Date strings are converted to
+    dates, since asyncpg types the parameter of '$n::date' as date.
+    """
+    positions = {}
+
+    def replace(match):
+        name = match.group(1)
+        if name not in positions:
+            positions[name] = len(positions) + 1
+        return f"${positions[name]}"
+
+    query = re.sub(r"%\((\w+)\)s", replace, query)
+    names = sorted(positions, key=positions.get)
+    args = [date.fromisoformat(params[name]) if name.endswith("_date") else params[name] for name in names]
+    return query, args
+
+class AsyncCatalog:
+    """
+    Catalog queries and geometry extraction for asyncio code.
+
+    Results are the same rows as catalog_query.query_database. asyncpg prepares and caches
+    every statement per connection, so repeated lookups with the same filters skip planning.
+
+    Example:
+        async with AsyncCatalog(database="bmdata", user="me") as catalog:
+            rows = await asyncio.gather(*(catalog.query_point(lon, lat) for lon, lat in points))
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, read_workers=READ_WORKERS, **connect_kwargs):
+        self.pool_size = pool_size
+        self.read_workers = read_workers
+        self.connect_kwargs = connect_kwargs
+        self.pool = None
+        self.executor = None
+
+    async def open(self):
+        self.pool = await asyncpg.create_pool(min_size=1, max_size=self.pool_size, **self.connect_kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=self.read_workers)
+        return self
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def query_database(self, geom_wkt, years=None, sources=None, tables=None, policy=None):
+        """Same as catalog_query.query_database."""
+        query, params = build_catalog_query(years, sources, tables, policy)
+        params["geom"] = geom_wkt
+        query, args = to_positional(query, params)
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(query, *args)
+        return [tuple(row) for row in rows]
+
+    async def query_point(self, longitude, latitude, years=None, sources=None, tables=None, policy=None):
+        """Same as catalog_query.query_point."""
+        return await self.query_database(f"POINT({longitude} {latitude})", years, sources, tables, policy)
+
+    async def run_read(self, func, *args):
+        """Run a blocking raster read in the bounded read pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def extract_geometry(self, input_geom, input_crs="EPSG:4326", resolution=None, target_crs="EPSG:4326", resolution_m=None, filters=None):
+        """
+        Query the files of a geometry and read them with query_geometry.extract_geometry.
+
+        Every request reads its files in one worker of the read pool.
+
+        Returns:
+            tuple: (catalog rows, result dict of extract_geometry or None without intersecting files).
+        """
+        from query_geometry import reproject_geometry, extract_geometry
+
+        results = await self.query_database(reproject_geometry(input_geom, input_crs, "EPSG:4326").wkt, **(filters or {}))
+        if not results:
+            return results, None
+        files = [row[0] for row in results]
+
+        def read():
+            with span("extract_geometry", files=len(files), target_crs=target_crs):
+                return extract_geometry(files, input_geom, input_crs, resolution, target_crs, resolution_m, num_threads=1)
+
+        return results, await self.run_read(read)
+
+# Function to look up many points concurrently
+async def query_points(catalog, points, concurrency=100, **filters):
+    """Return the rows of query_point for every (longitude, latitude), with at most concurrency lookups in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup(longitude, latitude):
+        async with semaphore:
+            return await catalog.query_point(longitude, latitude, **filters)
+
+    return await asyncio.gather(*(lookup(longitude, latitude) for longitude, latitude in points))
+
+async def run(connect_kwargs, points, concurrency, filters):
+    async with AsyncCatalog(pool_size=min(concurrency, POOL_SIZE), **connect_kwargs) as catalog:
+        return await query_points(catalog, points, concurrency, **filters)
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    points_file = input("Enter a file with one 'longitude,latitude' per line: ").strip()
+    concurrency = int(input("Enter the number of concurrent lookups (default: 100): ") or 100)
+    filters = prompt_filters()
+    with open(points_file, "r") as file:
+        points = [tuple(float(value) for value in line.split(',')[:2]) for line in file if line.strip()]
+
+    connect_kwargs = {"database": dbname, "user": user, "password": password, "host": host, "port": int(port)}
+    start_time = time.time()
+    with span("query_points", points=len(points), concurrency=concurrency):
+        results = asyncio.run(run(connect_kwargs, points, concurrency, filters))
+    elapsed = time.time() - start_time
+
+    for (longitude, latitude), rows in zip(points, results):
+        for file_path, _, _, table_name, source, acquisition_date in rows:
+            print(f"{longitude}, {latitude}: Table: {table_name}, Source: {source}, Year: {acquisition_date:%Y}, TIFF file path: {file_path}")
+    logger.info(f"Looked up {len(points)} points in {elapsed:.2f} seconds ({len(points) / max(elapsed, 1e-9):.0f} points/s).")
+
+if __name__ == "__main__":
+    setup_logging()
+    with profiling():
+        main()
@@ -0,0 +1,366 @@
+import os
+import re
+import math
+import time
+import logging
+from collections import defaultdict
+from multiprocessing import Pool
+
+import psycopg2
+from psycopg2.extras import execute_values
+from osgeo import gdal
+from shapely.wkb import loads as load_wkb
+from shapely.ops import transform
+from pyproj import Transformer
+
+from catalog_query import CATALOG_TABLES, POLICIES, prompt_filters
+from query_geometry import (
+    get_crs_wkt, get_finest_resolution, get_resolution_in_crs, get_warped_geotransform
+)
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+# AOIs are grouped into cells of this size (in degrees) so that the window read from
+# a source for one group stays small enough to be held in memory
+GROUP_CELL_DEG = 0.05
+
+# Function to resolve all AOIs against the catalog in one spatial join
+def find_intersecting_files(cursor, aois, years=None, sources=None, tables=None, policy=None):
+    """
+    Return the intersecting files of every AOI with a single spatial join.
+
+    The filters and the policy mean the same as in catalog_query.query_database and are
+    applied per AOI.
+
+    Args:
+        cursor: psycopg2 cursor.
+        aois (list): (aoi_id, geometry in EPSG:4326) tuples.
+
+    Returns:
+        dict: aoi_id to list of tif_file_path.
+    """
+    tables = tables or CATALOG_TABLES
+    invalid_tables = [table for table in tables if table not in CATALOG_TABLES]
+    if invalid_tables:
+        raise ValueError(f"Invalid table name(s): {', '.join(invalid_tables)}")
+    if policy not in POLICIES:
+        raise ValueError(f"Invalid policy: {policy}")
+
+    # Reused (and emptied) if an earlier call in the same transaction already created it
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS batch_aois (aoi_id TEXT, geom GEOMETRY(GEOMETRY, 4326)) ON COMMIT DROP")
+    cursor.execute("TRUNCATE batch_aois")
+    execute_values(
+        cursor, "INSERT INTO batch_aois (aoi_id, geom) VALUES %s",
+        [(aoi_id, geom.wkb_hex) for aoi_id, geom in aois],
+        template="(%s, ST_SetSRID(ST_GeomFromWKB(decode(%s, 'hex')), 4326))"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS batch_aois_geom_idx ON batch_aois USING GIST(geom)")
+    cursor.execute("ANALYZE batch_aois")
+
+    conditions = ["c.table_name = ANY(%(tables)s)"]
+    params = {"tables": list(tables)}
+    if years:
+        conditions.append("c.acquisition_date >= %(first_date)s::date AND c.acquisition_date < %(end_date)s::date")
+        params["first_date"] = f"{int(years[0])}-01-01"
+        params["end_date"] = f"{int(years[1]) + 1}-01-01"
+    if sources:
+        conditions.append("c.source = ANY(%(sources)s)")
+        params["sources"] = list(sources)
+
+    # Same policies as catalog_query.build_catalog_query, evaluated per AOI
+    if policy == 'latest_per_source':
+        selection = """
+        SELECT * FROM (
+            SELECT *, max(acquisition_date) OVER (PARTITION BY aoi_id, table_name, source) AS latest_date
+            FROM candidates
+        ) AS ranked
+        WHERE acquisition_date = latest_date
+        """
+    elif policy == 'latest_per_pixel':
+        selection = """
+        SELECT * FROM candidates c
+        WHERE NOT COALESCE(ST_Covers(
+            (SELECT ST_Union(n.location) FROM candidates n
+             WHERE n.aoi_id = c.aoi_id AND n.table_name = c.table_name AND n.source = c.source
+               AND n.acquisition_date > c.acquisition_date),
+            ST_Intersection(c.location, c.geom)
+        ), false)
+        """
+    else:
+        selection = "SELECT * FROM candidates"
+
+    with span("db.batch_join", aois=len(aois), policy=policy) as record:
+        cursor.execute(f"""
+            WITH candidates AS (
+                SELECT a.aoi_id, a.geom, c.table_name, c.tif_file_path, c.location, c.source, c.acquisition_date
+                FROM batch_aois a
+                JOIN catalog c ON c.location && a.geom AND ST_Intersects(c.location, a.geom)
+                WHERE {' AND '.join(conditions)}
+            )
+            SELECT aoi_id, tif_file_path
+            FROM ({selection}) AS selected
+            ORDER BY aoi_id, tif_file_path;
+        """, params)
+        rows = cursor.fetchall()
+        record["rows"] = len(rows)
+    files_by_aoi = defaultdict(list)
+    for aoi_id, file_path in rows:
+        files_by_aoi[aoi_id].append(file_path)
+    return files_by_aoi
+
+# Function to get the output resolution of every AOI from the finest of its files
+def get_aoi_resolutions(files_by_aoi, target_crs):
+    """Return {aoi_id: (resolution_x, resolution_y)} in units of target_crs; every file is opened once."""
+    raster_crs = get_crs_wkt(target_crs)
+    file_resolutions = {
+        file_path: get_finest_resolution([file_path], raster_crs)
+        for file_path in {file_path for files in files_by_aoi.values() for file_path in files}
+    }
+    return {
+        aoi_id: (min(file_resolutions[f][0] for f in files), min(file_resolutions[f][1] for f in files))
+        for aoi_id, files in files_by_aoi.items()
+    }
+
+# Function to group close AOIs so that every source file is read once for all of them
+def group_aois(aois, files_by_aoi, resolutions=None, cell_size=GROUP_CELL_DEG):
+    """
+    Group the AOIs of a coarse grid cell (by centroid) that are linked by shared source files.
+
+    Two AOIs of a cell end up in the same group if they touch a common file, also through
+    a chain of other AOIs and files. Each file of a group is then warped once over the union
+    window of the group's AOIs that touch it, and every AOI takes the bands of its own files.
+    AOIs with different output resolutions (resolutions, {aoi_id: resolution}) are kept apart.
+
+    Returns:
+        list: (files, [(aoi_id, wkb, files of the AOI), ...]) tuples.
+    """
+    cells = defaultdict(list)
+    for aoi_id, geom in aois:
+        files = files_by_aoi.get(aoi_id)
+        if not files:
+            continue
+        centroid = geom.centroid
+        cell = (math.floor(centroid.x / cell_size), math.floor(centroid.y / cell_size))
+        cells[(cell, resolutions.get(aoi_id) if resolutions else None)].append((aoi_id, geom, files))
+
+    groups = []
+    for members in cells.values():
+        # Union-find over the AOIs of the cell, linked through their files
+        parents = list(range(len(members)))
+
+        def find(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        first_aoi_of_file = {}
+        for i, (_, _, files) in enumerate(members):
+            for file_path in files:
+                if file_path in first_aoi_of_file:
+                    parents[find(i)] = find(first_aoi_of_file[file_path])
+                else:
+                    first_aoi_of_file[file_path] = i
+
+        clusters = defaultdict(list)
+        for i, (aoi_id, geom, files) in enumerate(members):
+            clusters[find(i)].append((aoi_id, geom.wkb, files))
+        for cluster in clusters.values():
+            groups.append((sorted({file_path for _, _, files in cluster for file_path in files}), cluster))
+    return groups
+
+# Function to compute the pixel window of a bounding box on a grid
+def get_pixel_window(bounds, origin_x, origin_y, resolution_x, resolution_y):
+    """Return (col_off, row_off, cols, rows) of the smallest grid window covering the bounds."""
+    minx, miny, maxx, maxy = bounds
+    col0 = math.floor((minx - origin_x) / resolution_x)
+    col1 = math.ceil((maxx - origin_x) / resolution_x)
+    row0 = math.floor((origin_y - maxy) / resolution_y)
+    row1 = math.ceil((origin_y - miny) / resolution_y)
+    return col0, row0, max(col1 - col0, 1), max(row1 - row0, 1)
+
+# Function to turn an AOI id into a file name
+def get_output_name(aoi_id):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(aoi_id)) + ".tif"
+
+# Worker: read every source of a group once and write one GeoTIFF per AOI
+def process_group(task):
+    """
+    Extract all AOIs of one group.
+
+    Args:
+        task (tuple): files, members [(aoi_id, wkb, files of the AOI)], target_crs,
+            resolution (in units of target_crs, or None to derive it from resolution_m),
+            resolution_m, output_dir.
+
+    Returns:
+        tuple: (number of written files, message).
+    """
+    files, members, target_crs, resolution, resolution_m, output_dir = task
+    try:
+        raster_crs = get_crs_wkt(target_crs)
+        transformer = Transformer.from_crs("EPSG:4326", target_crs, always_xy=True)
+        geoms = {aoi_id: transform(transformer.transform, load_wkb(wkb)) for aoi_id, wkb, _ in members}
+
+        if resolution is not None:
+            resolution_x, resolution_y = resolution
+        else:
+            latitude = load_wkb(members[0][1]).centroid.y
+            resolution_x, resolution_y = get_resolution_in_crs(resolution_m, raster_crs, latitude)
+
+        # All AOIs of the group are cut from one grid aligned to the first source
+        datasets = {file_path: gdal.Open(file_path) for file_path in files}
+        first_transform = get_warped_geotransform(datasets[files[0]], raster_crs)
+        origin_x, origin_y = first_transform[0], first_transform[3]
+
+        # Read each source once, over the union window of the AOIs that touch it
+        windows = {}
+        for file_path in files:
+            bounds = [geoms[aoi_id].bounds for aoi_id, _, aoi_files in members if file_path in aoi_files]
+            union_bounds = (
+                min(b[0] for b in bounds), min(b[1] for b in bounds),
+                max(b[2] for b in bounds), max(b[3] for b in bounds),
+            )
+            col0, row0, cols, rows = get_pixel_window(union_bounds, origin_x, origin_y, resolution_x, resolution_y)
+            window_minx = origin_x + col0 * resolution_x
+            window_maxy = origin_y - row0 * resolution_y
+            window_bounds = (window_minx, window_maxy - rows * resolution_y, window_minx + cols * resolution_x, window_maxy)
+
+            src_ds = datasets[file_path]
+            layers = []
+            with span("gdal.warp", file=file_path, aois=len(bounds), pixels=cols * rows * src_ds.RasterCount):
+                clipped_ds = gdal.Warp(
+                    '', src_ds, format='MEM', outputBounds=window_bounds,
+                    xRes=resolution_x, yRes=resolution_y, dstSRS=raster_crs,
+                    resampleAlg=gdal.GRA_NearestNeighbour
+                )
+                for band_idx in range(1, src_ds.RasterCount + 1):
+                    description = f"Source: {os.path.basename(file_path)}, Band: {band_idx}"
+                    layers.append((description, clipped_ds.GetRasterBand(band_idx).ReadAsArray()))
+            windows[file_path] = (col0, row0, layers)
+
+        # Fan the windows out to the AOIs, each with the bands of its own files
+        driver = gdal.GetDriverByName("GTiff")
+        for aoi_id, _, aoi_files in members:
+            aoi_col0, aoi_row0, aoi_cols, aoi_rows = get_pixel_window(
+                geoms[aoi_id].bounds, origin_x, origin_y, resolution_x, resolution_y
+            )
+            aoi_layers = []
+            for file_path in aoi_files:
+                col0, row0, layers = windows[file_path]
+                x_off, y_off = aoi_col0 - col0, aoi_row0 - row0
+                aoi_layers += [(description, data[y_off:y_off + aoi_rows, x_off:x_off + aoi_cols]) for description, data in layers]
+            data_type = datasets[aoi_files[0]].GetRasterBand(1).DataType
+
+            output_tif = os.path.join(output_dir, get_output_name(aoi_id))
+            with span("gdal.write", file=output_tif, bands=len(aoi_layers), pixels=aoi_cols * aoi_rows * len(aoi_layers)):
+                output_ds = driver.Create(output_tif, aoi_cols, aoi_rows, len(aoi_layers), data_type, ["COMPRESS=LZW", "BIGTIFF=YES"])
+                output_ds.SetGeoTransform((
+                    origin_x + aoi_col0 * resolution_x, resolution_x, 0,
+                    origin_y - aoi_row0 * resolution_y, 0, -resolution_y
+                ))
+                output_ds.SetProjection(raster_crs)
+                for band_idx, (description, data) in enumerate(aoi_layers, start=1):
+                    output_band = output_ds.GetRasterBand(band_idx)
+                    output_band.WriteArray(data)
+                    output_band.SetDescription(description)
+                output_ds = None
+
+        return len(members), f"Wrote {len(members)} AOIs from {len(files)} files"
+    except Exception as e:
+        return 0, f"Error processing group of {len(members)} AOIs ({members[0][0]}, ...): {e}"
+
+# Function to check that every AOI gets an output file of its own
+def check_aoi_ids(aois):
+    """
+    Raise a ValueError for AOI ids that occur more than once or map to the same output file.
+
+    Outputs are named after the AOI id, so such AOIs would overwrite each other.
+    """
+    ids_by_name = defaultdict(list)
+    for aoi_id, _ in aois:
+        ids_by_name[get_output_name(aoi_id)].append(aoi_id)
+    clashes = {name: ids for name, ids in ids_by_name.items() if len(ids) > 1}
+    if clashes:
+        examples = ", ".join(f"{name} ({', '.join(map(repr, ids[:3]))})" for name, ids in list(clashes.items())[:5])
+        raise ValueError(f"{len(clashes)} output files would be written by several AOIs, e.g. {examples}. Use a column with unique ids.")
+
+def batch_extract(cursor, aois, output_dir, target_crs="EPSG:4326", resolution_m=None, num_workers=4, filters=None):
+    """
+    Extract many AOIs with shared reads.
+
+    Args:
+        cursor: psycopg2 cursor.
+        aois (list): (aoi_id, geometry in EPSG:4326) tuples with unique ids.
+        output_dir (str): Directory for the per-AOI GeoTIFFs (named after the AOI id).
+        target_crs (str): CRS of the outputs.
+        resolution_m (float): Pixel size in meters, or None for the finest resolution of the files of each AOI.
+        num_workers (int): Number of parallel processes to use.
+        filters (dict): Filters for catalog_query.query_database (years, sources, tables, policy).
+
+    Returns:
+        int: Number of written files.
+    """
+    check_aoi_ids(aois)
+    files_by_aoi = find_intersecting_files(cursor, aois, **(filters or {}))
+    logger.info(f"{len(files_by_aoi)} of {len(aois)} AOIs intersect the catalog")
+
+    resolutions = get_aoi_resolutions(files_by_aoi, target_crs) if resolution_m is None else None
+    groups = group_aois(aois, files_by_aoi, resolutions)
+    tasks = [
+        (files, members, target_crs, resolutions[members[0][0]] if resolutions else None, resolution_m, output_dir)
+        for files, members in groups
+    ]
+    logger.info(f"Processing {len(tasks)} groups with {num_workers} workers...")
+
+    written = 0
+    with Pool(num_workers) as pool:
+        for done, (count, message) in enumerate(pool.imap_unordered(process_group, tasks), start=1):
+            written += count
+            logger.info(f"{done}/{len(tasks)}: {message}")
+    return written
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    vector_file = input("Enter the GeoPackage or shapefile with the AOIs: ").strip()
+    layer = input("Enter the layer name (leave blank for the first layer): ").strip() or None
+    id_column = input("Enter the column with the AOI ids (leave blank to use the row number): ").strip() or None
+    output_dir = input("Enter the output directory: ").strip()
+    os.makedirs(output_dir, exist_ok=True)
+    resolution_input = input("Enter the desired spatial resolution in meters (leave blank for original resolution): ")
+    resolution_m = float(resolution_input) if resolution_input else None
+    target_crs = input("Enter the CRS for the output files (default: EPSG:4326): ") or "EPSG:4326"
+    num_workers = int(input("Enter the number of workers (default: 4): ") or 4)
+    filters = prompt_filters()
+
+    import geopandas as gpd  # Only needed to read the AOI file, not by the workers
+
+    gdf = gpd.read_file(vector_file, layer=layer).to_crs("EPSG:4326")
+    ids = gdf[id_column] if id_column else gdf.index
+    aois = [(str(aoi_id), geom) for aoi_id, geom in zip(ids, gdf.geometry) if geom is not None and not geom.is_empty]
+    print(f"Loaded {len(aois)} AOIs from {vector_file}")
+
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+
+    start_time = time.time()
+    try:
+        written = batch_extract(cursor, aois, output_dir, target_crs, resolution_m, num_workers, filters)
+        print(f"Processing completed. Wrote {written} files in {time.time() - start_time:.2f} seconds.")
+    except ValueError as e:
+        print(f"Error: {e}")
+
+    conn.rollback()  # Drops the temporary AOI table
+    cursor.close()
+    conn.close()
+
+if __name__ == "__main__":
+    setup_logging()
+    with profiling():
+        main()
@@ -0,0 +1,201 @@
+import time
+import logging
+from multiprocessing import Pool
+
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from osgeo import gdal
+
+from build_pyramid import iter_pixel_centers, get_source_years
+from grid_summary import CELLS_PER_DEGREE
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+# Number of buffered cells from which partial summaries are merged into the running summary
+MERGE_CELLS = 1000000
+
+# Function to combine the statistics of equal cell keys
+def reduce_cells(keys, counts, sums, mins, maxs):
+    """Return the statistics of every distinct key, with counts and sums added up and the extremes kept."""
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return (
+        keys[starts],
+        np.add.reduceat(counts[order], starts),
+        np.add.reduceat(sums[order], starts),
+        np.minimum.reduceat(mins[order], starts),
+        np.maximum.reduceat(maxs[order], starts),
+    )
+
+# Function to merge partial summaries
+def merge_cells(parts):
+    return reduce_cells(*(np.concatenate(arrays) for arrays in zip(*parts)))
+
+# Worker: summarize the valid pixels of one file at the finest level
+def summarize_file(task):
+    """
+    Args:
+        task (tuple): file_path, cells_per_degree.
+
+    Returns:
+        tuple: (file path, (keys, counts, sums, mins, maxs) or None, message). The key of
+            cell (x, y) is y * 360 * cells_per_degree + x.
+    """
+    file_path, cells_per_degree = task
+    try:
+        with span("summarize_file", file=file_path) as record:
+            dataset = gdal.Open(file_path)
+            row_cells = 360 * cells_per_degree
+            parts = []
+            for data, lon, lat, valid in iter_pixel_centers(dataset, "EPSG:4326"):
+                if not valid.any():
+                    continue
+                cell_x = np.clip(np.floor((lon[valid] + 180) * cells_per_degree), 0, row_cells - 1).astype(np.int64)
+                cell_y = np.clip(np.floor((lat[valid] + 90) * cells_per_degree), 0, 180 * cells_per_degree - 1).astype(np.int64)
+                values = data[valid]
+                parts.append(reduce_cells(cell_y * row_cells + cell_x, np.ones(values.size, dtype=np.int64), values, values, values))
+            record["pixels"] = sum(int(part[1].sum()) for part in parts)
+        if not parts:
+            return file_path, None, f"{file_path} has no valid pixels"
+        cells = merge_cells(parts)
+        return file_path, cells, f"Summarized {file_path} into {cells[0].size} cells"
+    except Exception as e:
+        return file_path, None, f"Error summarizing {file_path}: {e}"
+
+# Function to add up the cells of a level into the cells of a coarser level
+def coarsen_cells(cells, cells_per_degree, coarser_cells_per_degree):
+    keys, counts, sums, mins, maxs = cells
+    factor = cells_per_degree // coarser_cells_per_degree
+    row_cells = 360 * cells_per_degree
+    cell_x, cell_y = keys % row_cells, keys // row_cells
+    coarser_keys = (cell_y // factor) * (360 * coarser_cells_per_degree) + cell_x // factor
+    return reduce_cells(coarser_keys, counts, sums, mins, maxs)
+
+def build_grid_summary(conn, table_name, source, year, levels=CELLS_PER_DEGREE, num_workers=4):
+    """
+    Summarize all files of one source and acquisition year into the grid_summary table.
+
+    Every valid pixel is added to the cell containing its center at the finest level;
+    coarser levels are added up from it, so counts, sums, minima and maxima are exact at
+    every level. Existing summaries of the source and year are replaced.
+
+    Returns:
+        int: Number of written cells over all levels.
+    """
+    levels = sorted(levels, reverse=True)
+    if any(finer % coarser for finer, coarser in zip(levels, levels[1:])):
+        raise ValueError(f"Every level must divide the next finer one: {levels}")
+
+    cursor = conn.cursor()
+    cursor.execute(
+        sql.SQL("""
+            SELECT tif_file_path FROM {}
+            WHERE source = %s AND acquisition_date >= %s::date AND acquisition_date < %s::date
+        """).format(sql.Identifier(table_name)),
+        (source, f"{year}-01-01", f"{year + 1}-01-01")
+    )
+    files = [row[0] for row in cursor.fetchall()]
+    if not files:
+        logger.info(f"No files found for {source} {year} in {table_name}.")
+        return 0
+
+    # Partial summaries are buffered and merged once they outgrow the running summary,
+    # so every cell is sorted only a few times however many files there are
+    summary = None
+    pending = []
+    pending_cells = 0
+    tasks = [(file_path, levels[0]) for file_path in files]
+    with Pool(num_workers) as pool:
+        for done, (_, cells, message) in enumerate(pool.imap_unordered(summarize_file, tasks), start=1):
+            logger.info(f"{done}/{len(tasks)}: {message}")
+            if cells is None:
+                continue
+            pending.append(cells)
+            pending_cells += cells[0].size
+            if pending_cells >= max(MERGE_CELLS, summary[0].size if summary is not None else 0):
+                summary = merge_cells(pending + ([summary] if summary is not None else []))
+                pending, pending_cells = [], 0
+    if pending:
+        summary = merge_cells(pending + ([summary] if summary is not None else []))
+
+    cells_by_level = {}
+    if summary is not None:
+        cells_by_level[levels[0]] = summary
+        for finer, coarser in zip(levels, levels[1:]):
+            cells_by_level[coarser] = coarsen_cells(cells_by_level[finer], finer, coarser)
+
+    # Replace the summaries of this source and year
+    with span("db.write_summary", table=table_name, source=source, year=year) as record:
+        cursor.execute(
+            "DELETE FROM grid_summary WHERE source_table = %s AND source = %s AND year = %s",
+            (table_name, source, year)
+        )
+        written = 0
+        for cells_per_degree, (keys, counts, sums, mins, maxs) in cells_by_level.items():
+            row_cells = 360 * cells_per_degree
+            records = (
+                (cells_per_degree, int(key % row_cells), int(key // row_cells), table_name, source, year,
+                 int(count), float(total), float(minimum), float(maximum), float(total / count),
+                 -180 + (key % row_cells) / cells_per_degree, -90 + (key // row_cells) / cells_per_degree,
+                 -180 + (key % row_cells + 1) / cells_per_degree, -90 + (key // row_cells + 1) / cells_per_degree)
+                for key, count, total, minimum, maximum in zip(keys.tolist(), counts, sums, mins, maxs)
+            )
+            execute_values(
+                cursor,
+                """
+                INSERT INTO grid_summary (cells_per_degree, cell_x, cell_y, source_table, source, year,
+                                          pixel_count, pixel_sum, pixel_min, pixel_max, pixel_mean, cell)
+                VALUES %s
+                """,
+                records,
+                template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_MakeEnvelope(%s, %s, %s, %s, 4326))",
+                page_size=10000
+            )
+            written += keys.size
+            logger.info(f"Wrote {keys.size} cells of {1 / cells_per_degree:g}°")
+        record["cells"] = written
+        conn.commit()
+    cursor.close()
+    return written
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    table_name = input("Enter the table name (biomass_data or canopy_height_data): ").strip()
+    if table_name not in ['biomass_data', 'canopy_height_data']:
+        print("Invalid table name. Please enter 'biomass_data' or 'canopy_height_data'.")
+        return
+    source_input = input("Enter the source to summarize (leave blank for all sources): ").strip()
+    year_input = input("Enter the acquisition year to summarize (leave blank for all years): ").strip()
+    levels_input = input(f"Enter the levels in cells per degree separated by commas (default: {', '.join(map(str, CELLS_PER_DEGREE))}): ").strip()
+    levels = [int(value) for value in levels_input.split(',')] if levels_input else CELLS_PER_DEGREE
+    num_workers = int(input("Enter the number of workers (default: 4): ") or 4)
+
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+    source_years = [
+        (source, year) for source, year in get_source_years(cursor, table_name)
+        if (not source_input or source == source_input) and (not year_input or year == int(year_input))
+    ]
+    cursor.close()
+
+    start_time = time.time()
+    written = 0
+    for source, year in source_years:
+        logger.info(f"Summarizing {source} {year}...")
+        written += build_grid_summary(conn, table_name, source, year, levels, num_workers)
+    conn.close()
+    print(f"Wrote {written} summary cells in {time.time() - start_time:.2f} seconds.")
+
+if __name__ == "__main__":
+    setup_logging()
+    with profiling():
+        main()
@@ -0,0 +1,329 @@
+import os
+import re
+import math
+import time
+from collections import defaultdict
+from multiprocessing import Pool
+
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from osgeo import gdal
+from pyproj import Transformer
+from shapely.geometry import box
+from shapely.ops import transform
+from shapely.wkt import loads as load_wkt
+
+from query_geometry import get_crs_wkt
+
+# Equal-area grid of the pyramid, so every cell of a level covers the same area
+PYRAMID_CRS = "EPSG:6933"
+
+# Resolutions of the pyramid levels in meters; every level must divide the next one
+LEVELS_M = [100, 1000, 10000]
+
+# Width and height of an aggregate tile in cells (must be divisible by the level ratios)
+TILE_CELLS = 1000
+
+# Number of source rows binned at once
+BLOCK_ROWS = 512
+
+# Function to get the bounds of a pyramid tile
+def get_tile_bounds(tile, resolution):
+    """Return (minx, miny, maxx, maxy) in PYRAMID_CRS of tile (tx, ty) at a resolution in meters."""
+    tx, ty = tile
+    size = TILE_CELLS * resolution
+    return (tx * size, ty * size, (tx + 1) * size, (ty + 1) * size)
+
+# Function to list the pyramid tiles touched by a footprint
+def get_tiles_for_footprint(footprint, resolution):
+    minx, miny, maxx, maxy = footprint.bounds
+    size = TILE_CELLS * resolution
+    return [
+        (tx, ty)
+        for tx in range(math.floor(minx / size), math.floor(maxx / size) + 1)
+        for ty in range(math.floor(miny / size), math.floor(maxy / size) + 1)
+    ]
+
+# Function to get the pixel window of a raster that covers a pyramid tile
+def get_source_window(dataset, tile_bounds):
+    """Return (col_off, row_off, cols, rows) of the part of the raster covering the tile, or None."""
+    to_source = Transformer.from_crs(PYRAMID_CRS, dataset.GetProjection(), always_xy=True)
+    minx, miny, maxx, maxy = to_source.transform_bounds(*tile_bounds, densify_pts=21)
+    inv_transform = gdal.InvGeoTransform(dataset.GetGeoTransform())
+    corners = [gdal.ApplyGeoTransform(inv_transform, x, y) for x in (minx, maxx) for y in (miny, maxy)]
+    col0 = max(math.floor(min(c for c, _ in corners)), 0)
+    col1 = min(math.ceil(max(c for c, _ in corners)), dataset.RasterXSize)
+    row0 = max(math.floor(min(r for _, r in corners)), 0)
+    row1 = min(math.ceil(max(r for _, r in corners)), dataset.RasterYSize)
+    if col1 <= col0 or row1 <= row0:
+        return None
+    return col0, row0, col1 - col0, row1 - row0
+
+# Function to read a raster window block by block together with its pixel centers in another CRS
+def iter_pixel_centers(dataset, target_crs, window=None, block_rows=BLOCK_ROWS):
+    """
+    Yield (data, x, y, valid) for blocks of rows of band 1, with the pixel centers in target_crs.
+
+    valid excludes no-data pixels, non-finite values and centers that cannot be transformed.
+    window is (col_off, row_off, cols, rows), or None for the whole raster.
+    """
+    col0, row0, cols, rows = window or (0, 0, dataset.RasterXSize, dataset.RasterYSize)
+    band = dataset.GetRasterBand(1)
+    nodata = band.GetNoDataValue()
+    geotransform = dataset.GetGeoTransform()
+    to_target = Transformer.from_crs(dataset.GetProjection(), target_crs, always_xy=True)
+
+    for row_off in range(row0, row0 + rows, block_rows):
+        num_rows = min(block_rows, row0 + rows - row_off)
+        data = band.ReadAsArray(col0, row_off, cols, num_rows).astype(np.float64)
+
+        # Pixel centers in the source CRS, then in the target CRS
+        pixel_col, pixel_row = np.meshgrid(np.arange(col0, col0 + cols) + 0.5, np.arange(row_off, row_off + num_rows) + 0.5)
+        x = geotransform[0] + pixel_col * geotransform[1] + pixel_row * geotransform[2]
+        y = geotransform[3] + pixel_col * geotransform[4] + pixel_row * geotransform[5]
+        x, y = to_target.transform(x, y)
+
+        valid = np.isfinite(data) & np.isfinite(x) & np.isfinite(y)
+        if nodata is not None:
+            valid &= data != nodata
+        yield data, x, y, valid
+
+# Function to add the valid pixels of a raster to the cells of a pyramid tile
+def bin_file_into_tile(file_path, tile_bounds, resolution, sums, counts):
+    """
+    Add every valid pixel of band 1 to the tile cell containing its center.
+
+    Each source pixel counts exactly once, so sums and counts of neighbouring tiles and
+    of coarser levels can be added up without error. sums and counts are flat arrays of
+    TILE_CELLS * TILE_CELLS cells, updated in place.
+    """
+    dataset = gdal.Open(file_path)
+    window = get_source_window(dataset, tile_bounds)
+    if window is None:
+        return
+    minx, _, _, maxy = tile_bounds
+
+    for data, x, y, valid in iter_pixel_centers(dataset, PYRAMID_CRS, window):
+        cell_col = np.floor((x - minx) / resolution)
+        cell_row = np.floor((maxy - y) / resolution)
+        valid &= (cell_col >= 0) & (cell_col < TILE_CELLS) & (cell_row >= 0) & (cell_row < TILE_CELLS)
+        if not valid.any():
+            continue
+
+        cell_idx = cell_row[valid].astype(np.int64) * TILE_CELLS + cell_col[valid].astype(np.int64)
+        sums += np.bincount(cell_idx, weights=data[valid], minlength=TILE_CELLS * TILE_CELLS)
+        counts += np.bincount(cell_idx, minlength=TILE_CELLS * TILE_CELLS)
+
+# Function to write the aggregates of a tile as a three-band GeoTIFF
+def write_aggregate_tile(output_tif, tile_bounds, resolution, sums, counts, crs_wkt):
+    """Write band 1 sum, band 2 valid pixel count and band 3 mean (NaN without valid pixels)."""
+    sums = sums.reshape(TILE_CELLS, TILE_CELLS)
+    counts = counts.reshape(TILE_CELLS, TILE_CELLS)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+
+    os.makedirs(os.path.dirname(output_tif), exist_ok=True)
+    output_ds = gdal.GetDriverByName("GTiff").Create(
+        output_tif, TILE_CELLS, TILE_CELLS, 3, gdal.GDT_Float64, ["COMPRESS=LZW", "TILED=YES"]
+    )
+    output_ds.SetGeoTransform((tile_bounds[0], resolution, 0, tile_bounds[3], 0, -resolution))
+    output_ds.SetProjection(crs_wkt)
+    for band_idx, (description, data) in enumerate([("sum", sums), ("count", counts), ("mean", means)], start=1):
+        output_band = output_ds.GetRasterBand(band_idx)
+        output_band.WriteArray(data)
+        output_band.SetDescription(description)
+    output_ds = None
+
+# Function to read the sum and count bands of an aggregate tile
+def read_aggregate_tile(tif_path):
+    dataset = gdal.Open(tif_path)
+    return dataset.GetRasterBand(1).ReadAsArray(), dataset.GetRasterBand(2).ReadAsArray()
+
+# Function to get the file name of a pyramid tile
+def get_tile_path(output_dir, resolution, tile):
+    return os.path.join(output_dir, f"{resolution}m", f"{resolution}m_{tile[0]}_{tile[1]}.tif")
+
+# Worker: build one tile of the finest level from the source files
+def build_base_tile(task):
+    """
+    Args:
+        task (tuple): tile, files, resolution, output_dir, crs_wkt.
+
+    Returns:
+        tuple: (tile, path of the written file or None if the tile has no valid pixels, message).
+    """
+    tile, files, resolution, output_dir, crs_wkt = task
+    try:
+        tile_bounds = get_tile_bounds(tile, resolution)
+        sums = np.zeros(TILE_CELLS * TILE_CELLS)
+        counts = np.zeros(TILE_CELLS * TILE_CELLS)
+        for file_path in files:
+            bin_file_into_tile(file_path, tile_bounds, resolution, sums, counts)
+        if not counts.any():
+            return tile, None, f"Tile {tile} has no valid pixels"
+        output_tif = get_tile_path(output_dir, resolution, tile)
+        write_aggregate_tile(output_tif, tile_bounds, resolution, sums, counts, crs_wkt)
+        return tile, output_tif, f"Built tile {tile} from {len(files)} files"
+    except Exception as e:
+        return tile, None, f"Error building tile {tile}: {e}"
+
+# Function to build a coarser level by adding up the cells of the level below
+def build_coarser_level(finer_tiles, finer_resolution, resolution, output_dir, crs_wkt):
+    """
+    Build all tiles of a level from the written tiles of the next finer level.
+
+    Sums and counts of the finer cells are added up in blocks, so the result is identical
+    to binning the source pixels directly at this resolution.
+
+    Returns:
+        dict: tile to path of the written file.
+    """
+    factor = resolution // finer_resolution
+    block = TILE_CELLS // factor
+    children = defaultdict(list)
+    for finer_tile, finer_tif in finer_tiles.items():
+        children[(finer_tile[0] // factor, finer_tile[1] // factor)].append((finer_tile, finer_tif))
+
+    tiles = {}
+    for tile, members in children.items():
+        sums = np.zeros((TILE_CELLS, TILE_CELLS))
+        counts = np.zeros((TILE_CELLS, TILE_CELLS))
+        for (ftx, fty), finer_tif in members:
+            finer_sums, finer_counts = read_aggregate_tile(finer_tif)
+            col_off = (ftx - tile[0] * factor) * block
+            # Tile rows run from north to south, tile indices from south to north
+            row_off = ((tile[1] + 1) * factor - 1 - fty) * block
+            sums[row_off:row_off + block, col_off:col_off + block] = finer_sums.reshape(block, factor, block, factor).sum(axis=(1, 3))
+            counts[row_off:row_off + block, col_off:col_off + block] = finer_counts.reshape(block, factor, block, factor).sum(axis=(1, 3))
+        output_tif = get_tile_path(output_dir, resolution, tile)
+        write_aggregate_tile(output_tif, get_tile_bounds(tile, resolution), resolution, sums.ravel(), counts.ravel(), crs_wkt)
+        tiles[tile] = output_tif
+    return tiles
+
+# Function to get the footprint of a pyramid tile in EPSG:4326
+def get_tile_footprint_wkt(tile, resolution):
+    polygon = box(*get_tile_bounds(tile, resolution))
+    transformer = Transformer.from_crs(PYRAMID_CRS, "EPSG:4326", always_xy=True)
+    return transform(transformer.transform, polygon.segmentize(polygon.length / 400)).wkt
+
+def build_pyramid(conn, table_name, source, year, output_dir, levels=LEVELS_M, num_workers=4):
+    """
+    Build and register the aggregate pyramid of one source and acquisition year.
+
+    The finest level is binned from the source files, every coarser level from the level
+    below. Existing aggregates of the source and year are replaced in aggregate_data.
+
+    Returns:
+        int: Number of registered aggregate tiles.
+    """
+    if any(coarser % finer or TILE_CELLS % (coarser // finer) for finer, coarser in zip(levels, levels[1:])):
+        raise ValueError(f"Every level must divide the next one and TILE_CELLS: {levels}")
+
+    cursor = conn.cursor()
+    cursor.execute(
+        sql.SQL("""
+            SELECT tif_file_path, ST_AsText(location) FROM {}
+            WHERE source = %s AND acquisition_date >= %s::date AND acquisition_date < %s::date
+        """).format(sql.Identifier(table_name)),
+        (source, f"{year}-01-01", f"{year + 1}-01-01")
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        print(f"No files found for {source} {year} in {table_name}.")
+        return 0
+
+    # Assign the source files to the tiles of the finest level
+    to_pyramid = Transformer.from_crs("EPSG:4326", PYRAMID_CRS, always_xy=True)
+    files_by_tile = defaultdict(list)
+    for file_path, footprint_wkt in rows:
+        footprint = transform(to_pyramid.transform, load_wkt(footprint_wkt))
+        for tile in get_tiles_for_footprint(footprint, levels[0]):
+            files_by_tile[tile].append(file_path)
+
+    crs_wkt = get_crs_wkt(PYRAMID_CRS)
+    source_dir = os.path.join(output_dir, table_name, re.sub(r'[^A-Za-z0-9_.-]+', '_', source), str(year))
+    tasks = [(tile, files, levels[0], source_dir, crs_wkt) for tile, files in files_by_tile.items()]
+    print(f"Building {len(tasks)} tiles at {levels[0]} m from {len(rows)} files with {num_workers} workers...")
+
+    tiles_by_level = {levels[0]: {}}
+    with Pool(num_workers) as pool:
+        for done, (tile, output_tif, message) in enumerate(pool.imap_unordered(build_base_tile, tasks), start=1):
+            if output_tif is not None:
+                tiles_by_level[levels[0]][tile] = output_tif
+            print(f"{done}/{len(tasks)}: {message}")
+
+    for finer_resolution, resolution in zip(levels, levels[1:]):
+        tiles_by_level[resolution] = build_coarser_level(tiles_by_level[finer_resolution], finer_resolution, resolution, source_dir, crs_wkt)
+        print(f"Built {len(tiles_by_level[resolution])} tiles at {resolution} m")
+
+    # Replace the registered aggregates of this source and year
+    cursor.execute(
+        """
+        DELETE FROM aggregate_data
+        WHERE source_table = %s AND source = %s AND acquisition_date >= %s::date AND acquisition_date < %s::date
+        """,
+        (table_name, source, f"{year}-01-01", f"{year + 1}-01-01")
+    )
+    records = [
+        (get_tile_footprint_wkt(tile, resolution), table_name, source, f"{year}-01-01", resolution, output_tif, PYRAMID_CRS)
+        for resolution, tiles in tiles_by_level.items()
+        for tile, output_tif in tiles.items()
+    ]
+    execute_values(
+        cursor,
+        """
+        INSERT INTO aggregate_data (location, source_table, source, acquisition_date, resolution_m, tif_file_path, native_crs)
+        VALUES %s
+        """,
+        records,
+        template="(ST_GeomFromText(%s, 4326), %s, %s, %s, %s, %s, %s)"
+    )
+    conn.commit()
+    cursor.close()
+    return len(records)
+
+# Function to list the sources and acquisition years of a table
+def get_source_years(cursor, table_name):
+    cursor.execute(sql.SQL(
+        "SELECT DISTINCT source, EXTRACT(YEAR FROM acquisition_date)::int FROM {} ORDER BY 1, 2"
+    ).format(sql.Identifier(table_name)))
+    return cursor.fetchall()
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    table_name = input("Enter the table name (biomass_data or canopy_height_data): ").strip()
+    if table_name not in ['biomass_data', 'canopy_height_data']:
+        print("Invalid table name. Please enter 'biomass_data' or 'canopy_height_data'.")
+        return
+    source_input = input("Enter the source to aggregate (leave blank for all sources): ").strip()
+    year_input = input("Enter the acquisition year to aggregate (leave blank for all years): ").strip()
+    levels_input = input(f"Enter the level resolutions in meters separated by commas (default: {', '.join(map(str, LEVELS_M))}): ").strip()
+    levels = [int(value) for value in levels_input.split(',')] if levels_input else LEVELS_M
+    output_dir = input("Enter the output directory for the aggregate tiles: ").strip()
+    num_workers = int(input("Enter the number of workers (default: 4): ") or 4)
+
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+    source_years = [
+        (source, year) for source, year in get_source_years(cursor, table_name)
+        if (not source_input or source == source_input) and (not year_input or year == int(year_input))
+    ]
+    cursor.close()
+
+    start_time = time.time()
+    registered = 0
+    for source, year in source_years:
+        print(f"Aggregating {source} {year}...")
+        registered += build_pyramid(conn, table_name, source, year, output_dir, levels, num_workers)
+    conn.close()
+    print(f"Registered {registered} aggregate tiles in {time.time() - start_time:.2f} seconds.")
+
+if __name__ == "__main__":
+    main()
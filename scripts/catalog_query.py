@@ -0,0 +1,254 @@
+# Catalog lookups shared by the query scripts. Only needs a psycopg2 cursor. psycopg2
+# itself is only imported where SQL is composed, so importing this module stays cheap
+# for the embedded catalog and for short-lived query processes.
+
+from instrumentation import span
+
+CATALOG_TABLES = ['biomass_data', 'canopy_height_data']
+
+# Compositing policies evaluated in SQL before any file is opened
+POLICIES = [None, 'latest_per_source', 'latest_per_pixel']
+
+# Function to build the filtered catalog query
+def build_catalog_query(years=None, sources=None, tables=None, policy=None):
+    """
+    Build the SQL and the filter parameters of a catalog query.
+
+    The geometry parameter (%(geom)s, WKT in EPSG:4326) is added by the caller.
+
+    Args:
+        years (tuple): Inclusive (first_year, last_year) range of acquisition years, or None for all.
+        sources (list): Source names to include, or None for all.
+        tables (list): Catalog tables to search, or None for both.
+        policy (str): None to return every intersecting file,
+            'latest_per_source' to keep only the most recent acquisition year of each source, or
+            'latest_per_pixel' to drop files whose part of the geometry is completely covered by
+            more recent files of the same source.
+
+    Returns:
+        tuple: (query, params)
+    """
+    tables = tables or CATALOG_TABLES
+    invalid_tables = [table for table in tables if table not in CATALOG_TABLES]
+    if invalid_tables:
+        raise ValueError(f"Invalid table name(s): {', '.join(invalid_tables)}")
+    if policy not in POLICIES:
+        raise ValueError(f"Invalid policy: {policy}")
+
+    # Filters on the catalog view are pushed down into both tables, where the
+    # bounding box test (&&) uses the GIST index before the exact intersection
+    conditions = [
+        "table_name = ANY(%(tables)s)",
+        "location && ST_GeomFromText(%(geom)s, 4326)",
+        "ST_Intersects(location, ST_GeomFromText(%(geom)s, 4326))",
+    ]
+    params = {"tables": list(tables)}
+    if years:
+        conditions.append("acquisition_date >= %(first_date)s::date AND acquisition_date < %(end_date)s::date")
+        params["first_date"] = f"{int(years[0])}-01-01"
+        params["end_date"] = f"{int(years[1]) + 1}-01-01"
+    if sources:
+        conditions.append("source = ANY(%(sources)s)")
+        params["sources"] = list(sources)
+
+    candidates = f"""
+        SELECT table_name, tif_file_path, location, source, acquisition_date, native_crs
+        FROM catalog
+        WHERE {' AND '.join(conditions)}
+    """
+
+    if policy == 'latest_per_source':
+        selection = """
+        SELECT * FROM (
+            SELECT *, max(acquisition_date) OVER (PARTITION BY table_name, source) AS latest_date
+            FROM candidates
+        ) AS ranked
+        WHERE acquisition_date = latest_date
+        """
+    elif policy == 'latest_per_pixel':
+        selection = """
+        SELECT * FROM candidates c
+        WHERE NOT COALESCE(ST_Covers(
+            (SELECT ST_Union(n.location) FROM candidates n
+             WHERE n.table_name = c.table_name AND n.source = c.source
+               AND n.acquisition_date > c.acquisition_date),
+            ST_Intersection(c.location, ST_GeomFromText(%(geom)s, 4326))
+        ), false)
+        """
+    else:
+        selection = "SELECT * FROM candidates"
+
+    query = f"""
+        WITH candidates AS ({candidates})
+        SELECT tif_file_path, ST_AsText(location), native_crs, table_name, source, acquisition_date
+        FROM ({selection}) AS selected
+        ORDER BY table_name, source, acquisition_date DESC, tif_file_path;
+    """
+    return query, params
+
+# Function to query the database for intersecting raster files using a geometry in WKT format
+def query_database(cursor, geom_wkt, years=None, sources=None, tables=None, policy=None):
+    """
+    Query the database for intersecting TIFF files.
+
+    cursor can also be an embedded_catalog.EmbeddedCatalog, which answers the query without PostgreSQL.
+
+    Returns:
+        list: (tif_file_path, footprint WKT, native_crs, table_name, source, acquisition_date) rows.
+    """
+    if hasattr(cursor, "query_catalog"):
+        with span("embedded.query_catalog", tables=tables, policy=policy) as record:
+            rows = cursor.query_catalog(geom_wkt, years, sources, tables, policy)
+            record["rows"] = len(rows)
+        return rows
+
+    query, params = build_catalog_query(years, sources, tables, policy)
+    params["geom"] = geom_wkt
+    with span("db.query_catalog", tables=tables, policy=policy) as record:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        record["rows"] = len(rows)
+    return rows
+
+class PreparedCatalogQuery:
+    """
+    Server-side prepared catalog query for running the same filters with many geometries.
+
+    The filters are bound when the statement is prepared, so every execution only sends
+    the geometry and skips parsing and planning. The statement lives as long as the
+    connection of the cursor.
+
+    Example:
+        prepared = PreparedCatalogQuery(cursor, years=(2021, 2021))
+        for wkt in geometries:
+            rows = prepared.execute(wkt)
+    """
+
+    def __init__(self, cursor, years=None, sources=None, tables=None, policy=None, name="catalog_query"):
+        from psycopg2 import sql
+        from psycopg2.extensions import AsIs
+
+        self.cursor = cursor
+        self.name = name
+        self.execute_statement = sql.SQL("EXECUTE {} (%s)").format(sql.Identifier(name))
+        self.deallocate_statement = sql.SQL("DEALLOCATE {}").format(sql.Identifier(name))
+        query, params = build_catalog_query(years, sources, tables, policy)
+        params["geom"] = AsIs("$1")
+        cursor.execute(
+            sql.SQL("PREPARE {} (text) AS ").format(sql.Identifier(name)).as_string(cursor)
+            + cursor.mogrify(query, params).decode()
+        )
+
+    def execute(self, geom_wkt):
+        """Return the rows of query_database for a geometry in WKT (EPSG:4326)."""
+        with span("db.query_catalog_prepared", statement=self.name) as record:
+            self.cursor.execute(self.execute_statement, (geom_wkt,))
+            rows = self.cursor.fetchall()
+            record["rows"] = len(rows)
+        return rows
+
+    def close(self):
+        self.cursor.execute(self.deallocate_statement)
+
+# Function to query the database for raster files containing a point
+def query_point(cursor, longitude, latitude, years=None, sources=None, tables=None, policy=None):
+    """Query the database for TIFF files containing a point given in EPSG:4326."""
+    return query_database(cursor, f"POINT({longitude} {latitude})", years, sources, tables, policy)
+
+# Function to query the aggregate pyramid written by build_pyramid.py
+def query_aggregates(cursor, geom_wkt, resolution_m, years=None, sources=None, tables=None):
+    """
+    Query the aggregate tiles intersecting a geometry at the coarsest level not coarser than resolution_m.
+
+    The level is chosen per source table, source and acquisition date, so sources with
+    different pyramids can be mixed.
+
+    Returns:
+        list: Rows in the format of query_database. Always empty for an embedded catalog.
+    """
+    if hasattr(cursor, "query_catalog"):
+        return []
+
+    conditions = ["resolution_m <= %(resolution_m)s"]
+    params = {"geom": geom_wkt, "resolution_m": resolution_m}
+    if years:
+        conditions.append("acquisition_date >= %(first_date)s::date AND acquisition_date < %(end_date)s::date")
+        params["first_date"] = f"{int(years[0])}-01-01"
+        params["end_date"] = f"{int(years[1]) + 1}-01-01"
+    if sources:
+        conditions.append("source = ANY(%(sources)s)")
+        params["sources"] = list(sources)
+    if tables:
+        conditions.append("source_table = ANY(%(tables)s)")
+        params["tables"] = list(tables)
+
+    cursor.execute(f"""
+        WITH levels AS (
+            SELECT source_table, source, acquisition_date, max(resolution_m) AS resolution_m
+            FROM aggregate_data
+            WHERE {' AND '.join(conditions)}
+            GROUP BY source_table, source, acquisition_date
+        )
+        SELECT a.tif_file_path, ST_AsText(a.location), a.native_crs, a.source_table, a.source, a.acquisition_date
+        FROM aggregate_data a
+        JOIN levels USING (source_table, source, acquisition_date, resolution_m)
+        WHERE ST_Intersects(a.location, ST_GeomFromText(%(geom)s, 4326))
+        ORDER BY a.source_table, a.source, a.acquisition_date DESC, a.tif_file_path;
+    """, params)
+    return cursor.fetchall()
+
+# Function to replace full resolution files by aggregate tiles where a coarse resolution is requested
+def substitute_aggregates(cursor, results, geom_wkt, resolution_m, years=None, sources=None, tables=None, policy=None):
+    """
+    Replace the files of every source and acquisition date in results that has a suitable
+    pyramid level by the aggregate tiles of that level.
+
+    Sources without aggregates keep their full resolution files. policy is only accepted so
+    the filters of prompt_filters can be passed on; it was already applied to results.
+
+    Returns:
+        tuple: (rows in the format of query_database, set of paths of aggregate tiles).
+    """
+    aggregates = {}
+    for row in query_aggregates(cursor, geom_wkt, resolution_m, years, sources, tables):
+        aggregates.setdefault((row[3], row[4], row[5]), []).append(row)
+
+    substituted = []
+    emitted = set()
+    for row in results:
+        key = (row[3], row[4], row[5])
+        if key not in aggregates:
+            substituted.append(row)
+        elif key not in emitted:
+            substituted.extend(aggregates[key])
+            emitted.add(key)
+    aggregate_paths = {row[0] for key in emitted for row in aggregates[key]}
+    return substituted, aggregate_paths
+
+# Function to parse the filter prompts of the query scripts
+def parse_filters(year_input, source_input, table_input, policy_input):
+    """
+    Turn the text entered by the user into query filters.
+
+    year_input is '2021' or '2015-2021', source_input and table_input are comma separated lists.
+    Blank inputs mean no filter.
+
+    Returns:
+        dict: Keyword arguments for query_database.
+    """
+    years = None
+    if year_input.strip():
+        first, _, last = year_input.strip().partition('-')
+        years = (int(first), int(last or first))
+    sources = [s.strip() for s in source_input.split(',') if s.strip()] or None
+    tables = [t.strip() for t in table_input.split(',') if t.strip()] or None
+    return {"years": years, "sources": sources, "tables": tables, "policy": policy_input.strip() or None}
+
+# Function to ask the user for the query filters
+def prompt_filters():
+    return parse_filters(
+        input("Enter the acquisition year or year range, e.g. 2021 or 2015-2021 (leave blank for all years): "),
+        input("Enter the sources separated by commas (leave blank for all sources): "),
+        input("Enter the tables separated by commas, biomass_data and/or canopy_height_data (leave blank for both): "),
+        input("Enter the policy: 'latest_per_source', 'latest_per_pixel' (leave blank to return all files): "),
+    )
@@ -0,0 +1,95 @@
+import time
+import psycopg2
+from psycopg2 import sql
+
+TABLES = ['biomass_data', 'canopy_height_data']
+
+# Function to list the tables that physically hold the rows (partitions, or the table itself)
+def get_leaf_tables(cursor, table_name):
+    """Return the leaf partitions of a table, or the table itself if it is not partitioned."""
+    cursor.execute(
+        "SELECT c.relname FROM pg_partition_tree(%s) t JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf",
+        (table_name,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+# Function to find the index of a leaf table to order it by
+def get_cluster_index(cursor, leaf_table, order):
+    """Return the name of the GIST index on location, or of the geohash index, of a leaf table."""
+    access_method, pattern = ('gist', '%(location)%') if order == 'gist' else ('btree', '%st_geohash%')
+    cursor.execute(
+        """
+        SELECT i.relname
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_am a ON a.oid = i.relam
+        WHERE x.indrelid = quote_ident(%s)::regclass AND a.amname = %s
+          AND pg_get_indexdef(x.indexrelid) ILIKE %s
+        """,
+        (leaf_table, access_method, pattern)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def cluster_tables(conn, order='gist'):
+    """
+    Physically reorder the catalog tables after a bulk load.
+
+    Rows are rewritten in the order of the spatial GIST index, or in geohash order of
+    the footprint centroids (a space-filling curve close to Hilbert order), so that
+    footprints that are close in space also share heap pages. Partitioned tables are
+    clustered partition by partition and analyzed afterwards.
+
+    Args:
+        conn: Open psycopg2 connection in autocommit mode.
+        order (str): 'gist' or 'geohash'.
+    """
+    cursor = conn.cursor()
+    for table_name in TABLES:
+        if order == 'geohash':
+            # Created on the parent, so it is also created on every partition
+            cursor.execute(sql.SQL(
+                "CREATE INDEX IF NOT EXISTS {} ON {} (ST_GeoHash(ST_Centroid(location), 10))"
+            ).format(sql.Identifier(f"idx_{table_name}_geohash"), sql.Identifier(table_name)))
+
+        for leaf_table in get_leaf_tables(cursor, table_name):
+            index_name = get_cluster_index(cursor, leaf_table, order)
+            if index_name is None:
+                print(f"No {order} index found on {leaf_table}, skipping.")
+                continue
+            start_time = time.time()
+            cursor.execute(sql.SQL("CLUSTER {} USING {}").format(
+                sql.Identifier(leaf_table), sql.Identifier(index_name)
+            ))
+            print(f"Clustered {leaf_table} using {index_name} in {time.time() - start_time:.2f} seconds")
+
+        cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table_name)))
+    cursor.close()
+
+# Main function
+def main():
+    # Get database connection details
+    dbname = input("Enter the database name: ")
+    user = input("Enter the database username: ")
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    order = input("Order rows by 'gist' index or 'geohash' (default: gist): ").strip() or 'gist'
+    if order not in ['gist', 'geohash']:
+        print("Invalid order. Please enter 'gist' or 'geohash'.")
+        return
+
+    try:
+        conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    except Exception as e:
+        print(f"Error connecting to the database: {e}")
+        return
+    conn.autocommit = True
+
+    cluster_tables(conn, order)
+    conn.close()
+    print("Clustering completed.")
+
+if __name__ == '__main__':
+    main()
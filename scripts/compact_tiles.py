@@ -0,0 +1,375 @@
+import os
+import re
+import math
+import time
+import hashlib
+import logging
+from collections import defaultdict
+from multiprocessing import Pool
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from osgeo import gdal
+from pyproj import Transformer
+from shapely.geometry import box
+from shapely.ops import transform, unary_union
+from shapely.wkt import loads as load_wkt
+
+from build_pyramid import get_source_years
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+# Width and height of a compacted block in pixels
+BLOCK_PIXELS = 8192
+
+# Tiles with more pixels than this are left as they are
+MAX_TILE_PIXELS = 2048 * 2048
+
+COG_OPTIONS = ["COMPRESS=DEFLATE", "PREDICTOR=YES", "BIGTIFF=IF_SAFER", "OVERVIEWS=AUTO"]
+
+# Function to read the grid of a tile and the state of its file
+def read_tile_info(file_path):
+    """
+    Returns:
+        tuple: (file path, geotransform, width, height, file size, file mtime), or
+            (file path, None, error message) if the file cannot be read.
+    """
+    try:
+        dataset = gdal.Open(file_path)
+        if dataset is None:
+            return file_path, None, "cannot be opened"
+        stat = os.stat(file_path)
+        return file_path, dataset.GetGeoTransform(), dataset.RasterXSize, dataset.RasterYSize, stat.st_size, stat.st_mtime
+    except Exception as e:
+        return file_path, None, str(e)
+
+# Function to describe the pixel grid of a tile
+def get_grid(native_crs, geotransform):
+    """
+    Return (grid_key, (origin_x, origin_y, pixel_width, pixel_height)) of a north-up tile.
+
+    Tiles with the same key share CRS, pixel size and pixel alignment, so they can be
+    merged without resampling. The origin is the grid position nearest to (0, 0).
+    """
+    pixel_width, pixel_height = geotransform[1], -geotransform[5]
+    origin_x = round(geotransform[0] % pixel_width, 6) % pixel_width
+    origin_y = round(geotransform[3] % pixel_height, 6) % pixel_height
+    description = f"{native_crs}|{pixel_width:.9g}|{pixel_height:.9g}|{origin_x:.6f}|{origin_y:.6f}"
+    return hashlib.sha1(description.encode()).hexdigest()[:16], (origin_x, origin_y, pixel_width, pixel_height)
+
+# Function to get the bounds of a block in the native CRS
+def get_block_bounds(block, grid, block_pixels=BLOCK_PIXELS):
+    origin_x, origin_y, pixel_width, pixel_height = grid
+    bx, by = block
+    return (
+        origin_x + bx * block_pixels * pixel_width, origin_y + by * block_pixels * pixel_height,
+        origin_x + (bx + 1) * block_pixels * pixel_width, origin_y + (by + 1) * block_pixels * pixel_height,
+    )
+
+# Function to list the blocks a tile overlaps
+def get_blocks_for_bounds(bounds, grid, block_pixels=BLOCK_PIXELS):
+    origin_x, origin_y, pixel_width, pixel_height = grid
+    width, height = block_pixels * pixel_width, block_pixels * pixel_height
+    minx, miny, maxx, maxy = bounds
+    return [
+        (bx, by)
+        for bx in range(math.floor((minx - origin_x) / width), math.ceil((maxx - origin_x) / width))
+        for by in range(math.floor((miny - origin_y) / height), math.ceil((maxy - origin_y) / height))
+    ]
+
+# Worker: merge the member tiles of a block into one COG
+def build_block(task):
+    """
+    Args:
+        task (tuple): block key, member paths (oldest first, so newer tiles end up on top), bounds, output path.
+
+    Returns:
+        tuple: (block key, output path or None, message).
+    """
+    key, member_paths, bounds, output_tif = task
+    vrt_path = f"/vsimem/compact_{os.getpid()}_{os.path.basename(output_tif)}.vrt"
+    tmp_path = f"{output_tif}.tmp-{os.getpid()}"
+    try:
+        os.makedirs(os.path.dirname(output_tif), exist_ok=True)
+        with span("build_block", block=key[1:], tiles=len(member_paths)) as record:
+            vrt = gdal.BuildVRT(vrt_path, member_paths)
+            minx, miny, maxx, maxy = bounds
+            # Same grid as the members, so the pixels are copied without resampling
+            result = gdal.Translate(tmp_path, vrt, format="COG", projWin=[minx, maxy, maxx, miny], creationOptions=COG_OPTIONS)
+            if result is None:
+                raise RuntimeError(gdal.GetLastErrorMsg())
+            result = None
+            vrt = None
+            os.replace(tmp_path, output_tif)
+            record["bytes"] = os.path.getsize(output_tif)
+        return key, output_tif, f"Merged {len(member_paths)} tiles into {os.path.basename(output_tif)}"
+    except Exception as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return key, None, f"Error building block {key[1:]}: {e}"
+    finally:
+        gdal.Unlink(vrt_path)
+
+# Function to load the blocks of a source and year written by earlier runs
+def get_existing_blocks(cursor, table_name, source, year):
+    """Return {(grid_key, bx, by): {"id", "path", "members": {path: member row}}}."""
+    cursor.execute(
+        """
+        SELECT b.id, b.grid_key, b.block_x, b.block_y, b.tif_file_path,
+               m.tif_file_path, ST_AsText(m.location), m.acquisition_date, m.native_crs, m.native_bounds, m.file_size, m.file_mtime
+        FROM compaction_blocks b JOIN compaction_members m ON m.block_id = b.id
+        WHERE b.source_table = %s AND b.source = %s AND b.year = %s
+        """,
+        (table_name, source, year)
+    )
+    blocks = {}
+    for block_id, grid_key, bx, by, block_path, *member in cursor.fetchall():
+        block = blocks.setdefault((grid_key, bx, by), {"id": block_id, "path": block_path, "members": {}})
+        block["members"][member[0]] = tuple(member)
+    return blocks
+
+# Function to check whether a member file changed since its block was built
+def has_file_changed(member):
+    file_path, *_, file_size, file_mtime = member
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return True
+    return stat.st_size != file_size or abs(stat.st_mtime - file_mtime) > 1e-3
+
+# Function to update the bounds and file state of a member before its block is rebuilt
+def refresh_member(member):
+    """Return the member row with the current bounds, size and mtime of its file, or None if it cannot be read."""
+    file_path, footprint_wkt, acquisition_date, native_crs, _, _, _ = member
+    info = read_tile_info(file_path)
+    if info[1] is None:
+        return None
+    _, geotransform, width, height, file_size, file_mtime = info
+    bounds = [geotransform[0], geotransform[3] + height * geotransform[5], geotransform[0] + width * geotransform[1], geotransform[3]]
+    return (file_path, footprint_wkt, acquisition_date, native_crs, bounds, file_size, file_mtime)
+
+# Function to compute the footprint of a block from the footprints of its members
+def get_block_footprint_wkt(members, bounds, native_crs):
+    """Return the union of the member footprints clipped to the block as WKT polygon in EPSG:4326."""
+    block_polygon = box(*bounds)
+    transformer = Transformer.from_crs(native_crs, "EPSG:4326", always_xy=True)
+    block_4326 = transform(transformer.transform, block_polygon.segmentize(block_polygon.length / 400))
+    footprint = unary_union([load_wkt(member[1]) for member in members]).intersection(block_4326)
+    if footprint.geom_type != "Polygon":
+        footprint = footprint.convex_hull  # The catalog column holds single polygons
+    return footprint.wkt
+
+def compact_tiles(conn, table_name, source, year, output_dir, block_pixels=BLOCK_PIXELS, max_tile_pixels=MAX_TILE_PIXELS, num_workers=4):
+    """
+    Merge the small tiles of one source and acquisition year into COG blocks on a regular grid.
+
+    Tiles are grouped by CRS, pixel size and pixel alignment, and every group is cut into
+    blocks of block_pixels x block_pixels on its own grid, so no pixel is resampled. Only
+    blocks with new tiles, or with member files that changed since they were built, are
+    (re)built; all other blocks are left alone. The catalog rows are swapped in one
+    transaction: the rows of the merged tiles are moved to compaction_members and every
+    block gets one catalog row. The member files themselves are not touched. A tile that
+    overlaps a block that failed to build keeps its catalog row and is retried next time.
+
+    Returns:
+        tuple: (number of merged tiles, number of written blocks).
+    """
+    cursor = conn.cursor()
+    table = sql.Identifier(table_name)
+    cursor.execute(
+        sql.SQL("""
+            SELECT t.id, t.tif_file_path, ST_AsText(t.location), t.acquisition_date, t.native_crs, t.native_bounds
+            FROM {} t
+            WHERE t.source = %s AND t.acquisition_date >= %s::date AND t.acquisition_date < %s::date
+              AND NOT EXISTS (SELECT 1 FROM compaction_blocks b WHERE b.tif_file_path = t.tif_file_path)
+        """).format(table),
+        (source, f"{year}-01-01", f"{year + 1}-01-01")
+    )
+    rows = cursor.fetchall()
+    existing_blocks = get_existing_blocks(cursor, table_name, source, year)
+
+    # Assign the new small tiles to the blocks of their grid
+    with Pool(num_workers) as pool:
+        infos = {info[0]: info for info in pool.imap_unordered(read_tile_info, [row[1] for row in rows], chunksize=16)}
+    grids = {}
+    new_members = defaultdict(dict)  # block key -> {path: member row}
+    row_ids = {}  # path -> catalog row id
+    tile_blocks = defaultdict(list)  # path -> block keys
+    for row_id, file_path, footprint_wkt, acquisition_date, native_crs, native_bounds in rows:
+        info = infos[file_path]
+        if info[1] is None:
+            logger.warning(f"Skipping {file_path}: {info[2]}")
+            continue
+        _, geotransform, width, height, file_size, file_mtime = info
+        if width * height > max_tile_pixels or geotransform[2] or geotransform[4] or not native_crs:
+            continue  # Large, rotated or unknown CRS tiles stay as they are
+        grid_key, grid = get_grid(native_crs, geotransform)
+        grids[grid_key] = (grid, native_crs)
+        bounds = (geotransform[0], geotransform[3] + height * geotransform[5], geotransform[0] + width * geotransform[1], geotransform[3])
+        member = (file_path, footprint_wkt, acquisition_date, native_crs, list(bounds), file_size, file_mtime)
+        row_ids[file_path] = row_id
+        for bx, by in get_blocks_for_bounds(bounds, grid, block_pixels):
+            new_members[(grid_key, bx, by)][file_path] = member
+            tile_blocks[file_path].append((grid_key, bx, by))
+
+    # Blocks to (re)build: blocks with new tiles and blocks whose member files changed
+    dirty = set(new_members)
+    for key, block in existing_blocks.items():
+        if any(has_file_changed(member) for member in block["members"].values()):
+            dirty.add(key)
+    if not dirty:
+        logger.info(f"Nothing to compact for {source} {year} in {table_name}.")
+        return 0, 0
+
+    # Grids of existing blocks come from their members
+    for key in dirty:
+        if key[0] not in grids:
+            member = next(iter(existing_blocks[key]["members"].values()))
+            info = read_tile_info(member[0])
+            if info[1] is None:
+                logger.warning(f"Cannot rebuild block {key[1:]}: {member[0]} {info[2]}")
+                continue
+            grids[key[0]] = (get_grid(member[3], info[1])[1], member[3])
+
+    source_dir = os.path.join(output_dir, table_name, re.sub(r'[^A-Za-z0-9_.-]+', '_', source), str(year))
+    stamp = time.strftime("%Y%m%d%H%M%S")
+    block_members = {}
+    tasks = []
+    for key in sorted(dirty):
+        if key[0] not in grids:
+            continue
+        members = {}
+        for file_path, member in existing_blocks.get(key, {}).get("members", {}).items():
+            member = refresh_member(member)
+            if member is None:
+                logger.warning(f"Dropping {file_path} from block {key[1:]}: the file cannot be read anymore")
+                continue
+            members[file_path] = member
+        members.update(new_members.get(key, {}))
+        if not members:
+            continue
+        block_members[key] = sorted(members.values(), key=lambda member: (member[2], member[0]))
+        grid, _ = grids[key[0]]
+        block_bounds = get_block_bounds(key[1:], grid, block_pixels)
+        # Crop the block to the extent of its members, on the pixel grid of the members
+        bounds = (
+            max(block_bounds[0], min(member[4][0] for member in block_members[key])),
+            max(block_bounds[1], min(member[4][1] for member in block_members[key])),
+            min(block_bounds[2], max(member[4][2] for member in block_members[key])),
+            min(block_bounds[3], max(member[4][3] for member in block_members[key])),
+        )
+        output_tif = os.path.join(source_dir, f"block_{key[0]}_{key[1]}_{key[2]}_{stamp}.tif")
+        tasks.append((key, [member[0] for member in block_members[key]], bounds, output_tif))
+    logger.info(f"Building {len(tasks)} blocks from {len(row_ids)} new tiles with {num_workers} workers...")
+
+    built = {}
+    bounds_by_key = {task[0]: task[2] for task in tasks}
+    with Pool(num_workers) as pool:
+        for done, (key, output_tif, message) in enumerate(pool.imap_unordered(build_block, tasks), start=1):
+            if output_tif is not None:
+                built[key] = output_tif
+            logger.info(f"{done}/{len(tasks)}: {message}")
+
+    # Tiles are only removed from the catalog once all of their blocks are built
+    merged_paths = [path for path, keys in tile_blocks.items() if all(key in built for key in keys)]
+    retired_files = []
+    try:
+        with span("db.swap_blocks", table=table_name, blocks=len(built), tiles=len(merged_paths)):
+            for key, output_tif in built.items():
+                grid, native_crs = grids[key[0]]
+                members = block_members[key]
+                bounds = bounds_by_key[key]
+                existing = existing_blocks.get(key)
+                if existing is not None:
+                    cursor.execute(sql.SQL("DELETE FROM {} WHERE tif_file_path = %s").format(table), (existing["path"],))
+                    cursor.execute("DELETE FROM compaction_members WHERE block_id = %s", (existing["id"],))
+                    cursor.execute("UPDATE compaction_blocks SET tif_file_path = %s, built_at = now() WHERE id = %s", (output_tif, existing["id"]))
+                    block_id = existing["id"]
+                    retired_files.append(existing["path"])
+                else:
+                    cursor.execute(
+                        """
+                        INSERT INTO compaction_blocks (source_table, source, year, grid_key, block_x, block_y, tif_file_path)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
+                        """,
+                        (table_name, source, year, key[0], key[1], key[2], output_tif)
+                    )
+                    block_id = cursor.fetchone()[0]
+
+                execute_values(
+                    cursor,
+                    """
+                    INSERT INTO compaction_members (block_id, tif_file_path, location, acquisition_date, native_crs, native_bounds, file_size, file_mtime)
+                    VALUES %s
+                    """,
+                    [(block_id, *member) for member in members],
+                    template="(%s, %s, ST_GeomFromText(%s, 4326), %s, %s, %s, %s, %s)"
+                )
+                cursor.execute(
+                    sql.SQL("""
+                        INSERT INTO {} (location, source, acquisition_date, tif_file_path, native_crs, native_bounds)
+                        VALUES (ST_GeomFromText(%s, 4326), %s, %s, %s, %s, %s)
+                    """).format(table),
+                    (get_block_footprint_wkt(members, bounds, native_crs), source, min(member[2] for member in members),
+                     output_tif, native_crs, list(bounds))
+                )
+
+            cursor.execute(sql.SQL("DELETE FROM {} WHERE id = ANY(%s)").format(table), ([row_ids[path] for path in merged_paths],))
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        for output_tif in built.values():
+            os.remove(output_tif)
+        raise
+    finally:
+        cursor.close()
+
+    # Replaced blocks are only deleted once no catalog row points to them anymore
+    for file_path in retired_files:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+    return len(merged_paths), len(built)
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    table_name = input("Enter the table name (biomass_data or canopy_height_data): ").strip()
+    if table_name not in ['biomass_data', 'canopy_height_data']:
+        print("Invalid table name. Please enter 'biomass_data' or 'canopy_height_data'.")
+        return
+    source_input = input("Enter the source to compact (leave blank for all sources): ").strip()
+    year_input = input("Enter the acquisition year to compact (leave blank for all years): ").strip()
+    output_dir = input("Enter the output directory for the compacted blocks: ").strip()
+    block_pixels = int(input(f"Enter the block size in pixels (default: {BLOCK_PIXELS}): ") or BLOCK_PIXELS)
+    num_workers = int(input("Enter the number of workers (default: 4): ") or 4)
+
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+    source_years = [
+        (source, year) for source, year in get_source_years(cursor, table_name)
+        if (not source_input or source == source_input) and (not year_input or year == int(year_input))
+    ]
+    cursor.close()
+
+    start_time = time.time()
+    merged = written = 0
+    for source, year in source_years:
+        logger.info(f"Compacting {source} {year}...")
+        source_merged, source_written = compact_tiles(conn, table_name, source, year, output_dir, block_pixels, num_workers=num_workers)
+        merged += source_merged
+        written += source_written
+    conn.close()
+    print(f"Merged {merged} tiles into {written} blocks in {time.time() - start_time:.2f} seconds.")
+
+if __name__ == "__main__":
+    setup_logging()
+    with profiling():
+        main()
@@ -1,7 +1,17 @@
+# geopandas, shapely and OGR are imported inside the functions that need them, so
+# looking up a single tile does not pay for loading geopandas (see read_tile_geometry).
+
 import os
-import geopandas as gpd
 import sys
-import shapely.ops 
+
+def find_shapefile(shapefile_dir):
+    """Return the path of the tile polygon shapefile in a directory, or exit if there is none."""
+    for file in os.listdir(shapefile_dir):
+        if file.endswith(".shp") and "centroid" not in file:  # Exclude centroid shapefile since we want polygons and not points
+            return os.path.join(shapefile_dir, file)
+
+    print("No valid .shp file found in the specified directory.")
+    sys.exit(1)
 
 def load_shapefile(shapefile_dir):
     """
@@ -13,19 +23,16 @@ def load_shapefile(shapefile_dir):
     Returns:
         gpd.GeoDataFrame: The GeoDataFrame loaded from the shapefile.
     """
-    for file in os.listdir(shapefile_dir):
-        if file.endswith(".shp") and "centroid" not in file:  # Exclude centroid shapefile since we want polygons and not points
-            shapefile_path = os.path.join(shapefile_dir, file)
-            try:
-                print(f"Loading shapefile: {shapefile_path}")
-                gdf = gpd.read_file(shapefile_path)
-                return gdf
-            except Exception as e:
-                print(f"Error loading shapefile: {e}")
-                sys.exit(1)
-
-    print("No valid .shp file found in the specified directory.")
-    sys.exit(1)
+    import geopandas as gpd
+
+    shapefile_path = find_shapefile(shapefile_dir)
+    try:
+        print(f"Loading shapefile: {shapefile_path}")
+        gdf = gpd.read_file(shapefile_path)
+        return gdf
+    except Exception as e:
+        print(f"Error loading shapefile: {e}")
+        sys.exit(1)
 
 def get_tile_geometry(gdf, tile_name):
     """
@@ -51,10 +58,40 @@ def get_tile_geometry(gdf, tile_name):
         sys.exit(1)
 
     if geometry.has_z:
+        import shapely.ops
         geometry = shapely.ops.transform(lambda x, y, z=None: (x, y), geometry)
 
     return geometry.wkt  # get the WKT representation
 
+def read_tile_geometry(shapefile_dir, tile_name):
+    """
+    Read the 2D geometry of a single tile in WKT format with an OGR attribute filter.
+
+    Only the matching feature is read, and neither geopandas nor shapely is imported, so
+    this is much faster than load_shapefile plus get_tile_geometry for one-off lookups.
+    """
+    from osgeo import ogr
+
+    shapefile_path = find_shapefile(shapefile_dir)
+    data_source = ogr.Open(shapefile_path)
+    if data_source is None:
+        print(f"Error loading shapefile: {shapefile_path}")
+        sys.exit(1)
+    layer = data_source.GetLayer()
+    layer.SetAttributeFilter("Name = '{}'".format(tile_name.replace("'", "")))
+    feature = layer.GetNextFeature()
+    if feature is None:
+        print(f"Tile {tile_name} not found in the shapefile.")
+        sys.exit(1)
+
+    geometry = feature.GetGeometryRef()
+    if geometry is None or geometry.IsEmpty():
+        print(f"No geometry found for tile {tile_name}.")
+        sys.exit(1)
+    geometry = geometry.Clone()
+    geometry.FlattenTo2D()  # Drop Z values if present
+    return geometry.ExportToWkt()
+
 def main():
     default_shapefile_dir = "/scratch/nkreyenkamp/Sentinel-2-Shapefile-Index-master"
     shapefile_dir = input(f"Enter the directory containing the Sentinel-2 shapefile index (leave blank for default: {default_shapefile_dir}): ").strip()
@@ -68,8 +105,7 @@ def main():
         sys.exit(1)
 
     tile_name = input("Enter the Sentinel-2 tile name (e.g., '04QFJ'): ").strip()
-    gdf = load_shapefile(shapefile_dir)
-    wkt_geometry = get_tile_geometry(gdf, tile_name)
+    wkt_geometry = read_tile_geometry(shapefile_dir, tile_name)
 
     print(f"WKT Geometry for tile {tile_name}:")
     print(wkt_geometry)
@@ -1,48 +1,250 @@
 import os
-import requests
-
-# Ask the user for the base directory
-BASE_DIR = input("Enter the directory where you want to save the dataset: ").strip()
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Ensure base directory exists
-os.makedirs(BASE_DIR, exist_ok=True)
-print(f"Using base directory: {BASE_DIR}")
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # File containing the list of URLs
 LINKS_FILE = "china_AGB_links.txt"
 
-# Read the list of URLs
-with open(LINKS_FILE, "r") as file:
-    urls = file.readlines()
+# Data older than this year is not downloaded
+MIN_YEAR = 2015
+
+# Size of the blocks streamed to disk
+CHUNK_SIZE = 1024 * 1024
+
+# Function to read the list of URLs
+def read_urls(links_file=LINKS_FILE):
+    """Read the download URLs, one per line, ignoring blank lines."""
+    with open(links_file, "r") as file:
+        return [line.strip() for line in file if line.strip()]
 
-# Function to download and save each file
-def download_file(url):
+# Function to read an optional checksum list
+def read_checksums(checksum_file):
+    """
+    Read SHA-256 checksums in the format written by sha256sum ("<hex digest>  <file name>").
+
+    Returns:
+        dict: File name to lower-case hex digest.
+    """
+    checksums = {}
+    with open(checksum_file, "r") as file:
+        for line in file:
+            parts = line.strip().split(maxsplit=1)
+            if len(parts) == 2:
+                checksums[parts[1].lstrip("*")] = parts[0].lower()
+    return checksums
+
+# Function to turn a URL into a download task (no network access)
+def plan_download(url, base_dir, min_year=MIN_YEAR):
+    """
+    Work out the year and target path of a URL.
+
+    Returns:
+        tuple: (url, filepath), or None if the file is older than min_year.
+    """
     year = url.split("/V1/")[1][:4]  # Extract year from the URL
-    if int(year) < 2015:  # Skip files older than 2015
-        print(f"Skipping {url}: Data is from {year}, which is older than 2015.")
-        return
-    
-    year_dir = os.path.join(BASE_DIR, year)
-    os.makedirs(year_dir, exist_ok=True)
-    
+    if int(year) < min_year:  # Skip files older than min_year
+        return None
+
     filename = url.split("fileName=")[1]  # Extract filename from URL
-    filepath = os.path.join(year_dir, filename)
-    
-    if os.path.exists(filepath):
-        print(f"{filename} already exists. Skipping download.")
-        return
-    
-    print(f"Downloading {filename} to {year_dir}")
-    try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        with open(filepath, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        print(f"Downloaded {filename}")
-    except requests.RequestException as e:
-        print(f"Failed to download {filename}: {e}")
-
-# Download each file
-for url in urls:
-    download_file(url.strip())
+    return url, os.path.join(base_dir, year, filename)
+
+# Function to compute the SHA-256 digest of a file
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+# Function to create a pooled HTTP session
+def create_session(max_connections):
+    """Create a requests session whose connection pool matches the number of workers."""
+    session = requests.Session()
+    retry = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Function to read the total file size from the response headers
+def get_total_size(response, offset):
+    content_range = response.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None:
+        return offset + int(content_length)
+    return None
+
+# Function to ask the server for the size of a file without downloading it
+def get_remote_size(session, url, timeout=60):
+    """Return the Content-Length of a HEAD request, or None if the server does not announce it."""
+    response = session.head(url, allow_redirects=True, timeout=timeout)
+    response.raise_for_status()
+    content_length = response.headers.get("Content-Length")
+    return int(content_length) if content_length and content_length.isdigit() else None
+
+# Function to check a file that already exists under its final path
+def check_existing_file(session, url, filepath, expected_sha256=None, timeout=60):
+    """
+    Compare an existing file with the size announced by the server and, if given, its SHA-256 digest.
+
+    A file that is too short is moved back to filepath + '.part' so the download resumes
+    from it; a file that is too long or has the wrong digest is deleted.
+
+    Returns:
+        bool: True if the file is complete.
+    """
+    size = os.path.getsize(filepath)
+    remote_size = get_remote_size(session, url, timeout)
+    if remote_size is not None and size < remote_size:
+        print(f"{os.path.basename(filepath)} has {size} of {remote_size} bytes, resuming...")
+        os.replace(filepath, filepath + ".part")
+        return False
+    if remote_size is not None and size > remote_size:
+        print(f"{os.path.basename(filepath)} has {size} bytes, but the server announced {remote_size} bytes, downloading again...")
+        os.remove(filepath)
+        return False
+    if expected_sha256 and file_sha256(filepath) != expected_sha256:
+        print(f"{os.path.basename(filepath)} does not match its checksum, downloading again...")
+        os.remove(filepath)
+        return False
+    return True
+
+# Function to download a single file into a .part file and move it into place when verified
+def download_file(session, url, filepath, expected_sha256=None, attempts=3, timeout=60):
+    """
+    Download url to filepath, resuming an existing filepath + '.part' with a Range request.
+
+    The file is only renamed to filepath once its size matches the size announced by the
+    server and, if given, its SHA-256 digest matches expected_sha256. A file that already
+    exists under filepath is checked the same way with check_existing_file first.
+
+    Returns:
+        str: "exists" or "downloaded".
+    """
+    if os.path.exists(filepath) and check_existing_file(session, url, filepath, expected_sha256, timeout):
+        return "exists"
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    part_path = filepath + ".part"
+
+    for attempt in range(1, attempts + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(url, stream=True, headers=headers, timeout=timeout) as response:
+                if response.status_code == 416:
+                    # The .part file already holds the whole file
+                    total_size = get_total_size(response, offset)
+                else:
+                    response.raise_for_status()
+                    if offset and response.status_code != 206:
+                        # The server ignored the Range header, start from scratch
+                        offset = 0
+                    total_size = get_total_size(response, offset)
+                    with open(part_path, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            f.write(chunk)
+        except requests.RequestException as e:
+            if attempt == attempts:
+                raise
+            print(f"Attempt {attempt} for {os.path.basename(filepath)} failed ({e}), resuming...")
+            continue
+
+        size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if total_size is not None and size < total_size:
+            if attempt == attempts:
+                raise IOError(f"Incomplete download: {size} of {total_size} bytes")
+            continue
+        if total_size is not None and size > total_size:
+            # Stale .part file from a different version of the file
+            os.remove(part_path)
+            raise IOError(f"Downloaded {size} bytes, but the server announced {total_size} bytes")
+        break
+
+    if expected_sha256 and file_sha256(part_path) != expected_sha256:
+        os.remove(part_path)
+        raise ValueError("Checksum mismatch")
+
+    os.replace(part_path, filepath)
+    return "downloaded"
+
+def download_all(urls, base_dir, max_connections=8, checksums=None, min_year=MIN_YEAR, session=None, on_complete=None):
+    """
+    Download all URLs concurrently.
+
+    Year filtering happens before any request is made. Files that already exist are checked
+    against the server size and their checksum by download_file and only counted as complete
+    if both match.
+
+    Args:
+        urls (list): Download URLs.
+        base_dir (str): Directory where the <year>/<file> tree is created.
+        max_connections (int): Number of concurrent downloads and pooled connections.
+        checksums (dict): Optional file name to SHA-256 hex digest mapping.
+        min_year (int): Files from earlier years are skipped.
+        session (requests.Session): Optional session to use instead of a new pooled one.
+        on_complete (callable): Optional function called with the path of every verified file,
+            both new downloads and existing files that passed the checks.
+
+    Returns:
+        list: (filepath, error) tuples for the failed downloads.
+    """
+    checksums = checksums or {}
+    tasks = []
+    for url in urls:
+        task = plan_download(url, base_dir, min_year)
+        if task is not None:
+            tasks.append(task)
+
+    print(f"{len(tasks)} files to check or download with {max_connections} connections")
+    session = session or create_session(max_connections)
+    failures = []
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        futures = {
+            executor.submit(download_file, session, url, filepath, checksums.get(os.path.basename(filepath))): filepath
+            for url, filepath in tasks
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            filepath = futures[future]
+            filename = os.path.basename(filepath)
+            try:
+                status = future.result()
+            except Exception as e:
+                print(f"Failed to download {filename}: {e}")
+                failures.append((filepath, e))
+                continue
+            if status == "exists":
+                print(f"{done}/{len(tasks)}: {filename} already exists and is complete. Skipping download.")
+            else:
+                print(f"Downloaded {done}/{len(tasks)}: {filename}")
+            if on_complete is not None:
+                on_complete(filepath)
+    return failures
+
+def main():
+    # Ask the user for the base directory
+    base_dir = input("Enter the directory where you want to save the dataset: ").strip()
+
+    # Ensure base directory exists
+    os.makedirs(base_dir, exist_ok=True)
+    print(f"Using base directory: {base_dir}")
+
+    max_connections = int(input("Enter the number of parallel downloads (default: 8): ") or 8)
+    checksum_file = input("Enter a sha256sum file to verify the downloads against (leave blank to skip): ").strip()
+    checksums = read_checksums(checksum_file) if checksum_file else None
+
+    failures = download_all(read_urls(), base_dir, max_connections, checksums)
+    if failures:
+        print(f"{len(failures)} downloads failed. Re-run the script to resume them.")
+    else:
+        print("All files downloaded.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+# Database-free catalog in a single SQLite file with an R*Tree index on the footprint
+# bounds. Answers the same queries as catalog_query.query_database in-process, so the
+# query scripts and loaders work without a PostgreSQL server. shapely and psycopg2 are
+# imported where they are used, so opening the catalog costs no more than sqlite3.
+
+import json
+import sqlite3
+from datetime import date
+
+from catalog_query import CATALOG_TABLES, POLICIES
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS catalog (
+    id INTEGER PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    tif_file_path TEXT NOT NULL,
+    footprint TEXT NOT NULL,
+    source TEXT NOT NULL,
+    acquisition_date TEXT NOT NULL,
+    native_crs TEXT,
+    native_bounds TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_source
+    ON catalog (table_name, source, acquisition_date);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS catalog_rtree USING rtree(id, minx, maxx, miny, maxy);
+"""
+
+class EmbeddedCatalog:
+    """
+    Catalog of biomass_data and canopy_height_data rows in one SQLite file.
+
+    Candidates are found with the R*Tree on the footprint bounds and checked for exact
+    intersection with shapely. The object can be passed wherever the scripts expect a
+    psycopg2 connection or cursor for catalog reads and loader writes: cursor() returns
+    the catalog itself, and query_database, write_records and get_loaded_paths use its
+    methods instead of SQL.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA_SQL)
+        self.footprints = {}  # Parsed footprints by row id
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def insert_records(self, table_name, records):
+        """Insert (footprint WKT, source, acquisition date, path, native CRS, native bounds) records."""
+        from shapely.wkt import loads as load_wkt
+
+        if table_name not in CATALOG_TABLES:
+            raise ValueError(f"Invalid table name: {table_name}")
+        for footprint_wkt, source, acquisition_date, file_path, native_crs, native_bounds in records:
+            minx, miny, maxx, maxy = load_wkt(footprint_wkt).bounds
+            if isinstance(acquisition_date, date):
+                acquisition_date = acquisition_date.isoformat()
+            row_id = self.conn.execute(
+                """
+                INSERT INTO catalog (table_name, tif_file_path, footprint, source, acquisition_date, native_crs, native_bounds)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (table_name, file_path, footprint_wkt, source, acquisition_date, native_crs,
+                 json.dumps(list(native_bounds)) if native_bounds is not None else None)
+            ).lastrowid
+            self.conn.execute("INSERT INTO catalog_rtree VALUES (?, ?, ?, ?, ?)", (row_id, minx, maxx, miny, maxy))
+
+    def get_loaded_paths(self, table_name):
+        return {row[0] for row in self.conn.execute("SELECT tif_file_path FROM catalog WHERE table_name = ?", (table_name,))}
+
+    def get_footprint(self, row_id, footprint_wkt):
+        from shapely.wkt import loads as load_wkt
+
+        if row_id not in self.footprints:
+            self.footprints[row_id] = load_wkt(footprint_wkt)
+        return self.footprints[row_id]
+
+    def query_catalog(self, geom_wkt, years=None, sources=None, tables=None, policy=None):
+        """
+        Same as catalog_query.query_database, answered from the SQLite file.
+
+        Returns:
+            list: (tif_file_path, footprint WKT, native_crs, table_name, source, acquisition_date) rows.
+        """
+        from shapely.ops import unary_union
+        from shapely.prepared import prep
+        from shapely.wkt import loads as load_wkt
+
+        tables = tables or CATALOG_TABLES
+        invalid_tables = [table for table in tables if table not in CATALOG_TABLES]
+        if invalid_tables:
+            raise ValueError(f"Invalid table name(s): {', '.join(invalid_tables)}")
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid policy: {policy}")
+
+        geom = load_wkt(geom_wkt)
+        minx, miny, maxx, maxy = geom.bounds
+        conditions = [
+            "r.minx <= ? AND r.maxx >= ? AND r.miny <= ? AND r.maxy >= ?",
+            f"c.table_name IN ({', '.join('?' * len(tables))})",
+        ]
+        params = [maxx, minx, maxy, miny, *tables]
+        if years:
+            conditions.append("c.acquisition_date >= ? AND c.acquisition_date < ?")
+            params += [f"{int(years[0])}-01-01", f"{int(years[1]) + 1}-01-01"]
+        if sources:
+            conditions.append(f"c.source IN ({', '.join('?' * len(sources))})")
+            params += list(sources)
+
+        rows = self.conn.execute(
+            f"""
+            SELECT c.id, c.tif_file_path, c.footprint, c.native_crs, c.table_name, c.source, c.acquisition_date
+            FROM catalog_rtree r JOIN catalog c ON c.id = r.id
+            WHERE {' AND '.join(conditions)}
+            """,
+            params
+        ).fetchall()
+
+        # Exact intersection test on the bounding box candidates
+        prepared_geom = prep(geom)
+        candidates = []
+        for row_id, file_path, footprint_wkt, native_crs, table_name, source, acquisition_date in rows:
+            footprint = self.get_footprint(row_id, footprint_wkt)
+            if prepared_geom.intersects(footprint):
+                candidates.append((footprint, (file_path, footprint_wkt, native_crs, table_name, source, date.fromisoformat(acquisition_date))))
+
+        if policy == 'latest_per_source':
+            latest = {}
+            for _, row in candidates:
+                latest[(row[3], row[4])] = max(latest.get((row[3], row[4]), row[5]), row[5])
+            candidates = [(footprint, row) for footprint, row in candidates if row[5] == latest[(row[3], row[4])]]
+        elif policy == 'latest_per_pixel':
+            selected = []
+            for footprint, row in candidates:
+                newer = [f for f, r in candidates if r[3] == row[3] and r[4] == row[4] and r[5] > row[5]]
+                if not newer or not unary_union(newer).covers(footprint.intersection(geom)):
+                    selected.append((footprint, row))
+            candidates = selected
+
+        results = [row for _, row in candidates]
+        results.sort(key=lambda row: row[0])
+        results.sort(key=lambda row: row[5], reverse=True)
+        results.sort(key=lambda row: (row[3], row[4]))
+        return results
+
+    def clear(self):
+        self.conn.execute("DELETE FROM catalog")
+        self.conn.execute("DELETE FROM catalog_rtree")
+        self.footprints = {}
+
+# Function to copy the PostgreSQL catalog into an embedded catalog
+def export_from_postgres(cursor, catalog):
+    """Replace the content of catalog with all rows of both PostgreSQL tables. Returns the number of rows."""
+    from psycopg2 import sql
+
+    catalog.clear()
+    total = 0
+    for table_name in CATALOG_TABLES:
+        cursor.execute(sql.SQL(
+            "SELECT ST_AsText(location), source, acquisition_date, tif_file_path, native_crs, native_bounds FROM {}"
+        ).format(sql.Identifier(table_name)))
+        records = cursor.fetchall()
+        catalog.insert_records(table_name, records)
+        total += len(records)
+    catalog.commit()
+    return total
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+    catalog_path = input("Enter the path of the embedded catalog file to write (e.g. catalog.sqlite): ").strip()
+
+    import psycopg2
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+    catalog = EmbeddedCatalog(catalog_path)
+    total = export_from_postgres(cursor, catalog)
+    catalog.close()
+    cursor.close()
+    conn.close()
+    print(f"Exported {total} rows to {catalog_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import os
+import json
+import math
+import time
+import logging
+from collections import defaultdict
+from multiprocessing import Pool
+
+import numpy as np
+import psycopg2
+from pyproj import Transformer
+from shapely.geometry import box
+from shapely.ops import transform
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+from shapely.wkt import loads as load_wkt
+
+from catalog_query import query_database, prompt_filters
+from query_geometry import reproject_geometry, get_crs_wkt, get_utm_crs
+from extract_timeseries import read_chunk
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+# Layers of every chip and the catalog table they are read from
+LAYERS = {"agb": "biomass_data", "canopy_height": "canopy_height_data"}
+
+# Default chip width and height in pixels
+CHIP_SIZE = 256
+
+# Chips are read in blocks of CHIPS_PER_BLOCK x CHIPS_PER_BLOCK; every source window is
+# read once per block, and every block is written as one shard
+CHIPS_PER_BLOCK = 8
+
+# Default share of pixels that must be valid in all layers for a chip to be kept
+MIN_VALID_FRACTION = 0.8
+
+# Function to plan the chips covering an area
+def plan_chips(aoi, resolution, chip_size=CHIP_SIZE, strategy="grid", num_samples=None, seed=0):
+    """
+    Return the (cx, cy) indices of the chips intersecting the AOI.
+
+    Chips lie on a fixed grid with its origin at (0, 0) of the output CRS, so chips of
+    different runs line up. Chip (cx, cy) covers x from cx * extent to (cx + 1) * extent
+    and y from cy * extent to (cy + 1) * extent. With strategy 'random', num_samples
+    chips are drawn from the grid chips with the given seed.
+    """
+    extent = chip_size * resolution
+    minx, miny, maxx, maxy = aoi.bounds
+    prepared_aoi = prep(aoi)
+    chips = [
+        (cx, cy)
+        for cx in range(math.floor(minx / extent), math.ceil(maxx / extent))
+        for cy in range(math.floor(miny / extent), math.ceil(maxy / extent))
+        if prepared_aoi.intersects(box(cx * extent, cy * extent, (cx + 1) * extent, (cy + 1) * extent))
+    ]
+    if strategy == "random" and num_samples is not None and num_samples < len(chips):
+        rng = np.random.default_rng(seed)
+        chips = [chips[i] for i in sorted(rng.choice(len(chips), num_samples, replace=False))]
+    return chips
+
+# Function to pick the source and year every layer is read from
+def select_layer_sources(results, layer_sources=None):
+    """
+    Return {layer: (source, year)}, so the files of a layer come from one product and year.
+
+    A layer without an entry in layer_sources must have exactly one (source, year) among
+    the results; otherwise chips would mix products or dates and a choice is required.
+
+    Raises:
+        ValueError: If a layer has no files, or several candidates and no choice was given.
+    """
+    layer_sources = layer_sources or {}
+    selected = {}
+    for layer, layer_table in LAYERS.items():
+        available = sorted({
+            (source, acquisition_date.year)
+            for _, _, _, table_name, source, acquisition_date in results if table_name == layer_table
+        })
+        choice = layer_sources.get(layer)
+        if choice is not None:
+            choice = (choice[0], int(choice[1]))
+            if choice not in available:
+                raise ValueError(f"No {layer} files of {choice[0]} from {choice[1]} in the area (available: {available})")
+            selected[layer] = choice
+        elif len(available) == 1:
+            selected[layer] = available[0]
+        elif not available:
+            raise ValueError(f"No {layer} files in the area")
+        else:
+            raise ValueError(f"The {layer} files in the area come from several sources or years {available}; choose one")
+    return selected
+
+# Function to group chips into blocks and assign the source files of every layer
+def plan_blocks(chips, results, target_crs, resolution, chip_size=CHIP_SIZE, layer_sources=None):
+    """
+    Group chips into blocks and find the files of every layer intersecting each block.
+
+    All files come from one catalog query for the AOI; the assignment to blocks is done
+    in memory with an STRtree of the footprints. With layer_sources ({layer: (source, year)},
+    see select_layer_sources), only files of that source and year are used for a layer.
+    Blocks without files for every layer are dropped.
+
+    Returns:
+        list: (block_bounds, chips, {layer: files}) tuples.
+    """
+    extent = chip_size * resolution
+    to_target = Transformer.from_crs("EPSG:4326", target_crs, always_xy=True)
+    footprints = {layer: [] for layer in LAYERS}
+    for file_path, footprint_wkt, _, table_name, source, acquisition_date in reversed(results):  # Oldest first, so newer files are warped on top
+        for layer, layer_table in LAYERS.items():
+            if table_name != layer_table:
+                continue
+            if layer_sources is not None and (source, acquisition_date.year) != tuple(layer_sources[layer]):
+                continue
+            footprints[layer].append((file_path, transform(to_target.transform, load_wkt(footprint_wkt))))
+    trees = {layer: STRtree([footprint for _, footprint in items]) for layer, items in footprints.items() if items}
+
+    chips_by_block = defaultdict(list)
+    for cx, cy in chips:
+        chips_by_block[(cx // CHIPS_PER_BLOCK, cy // CHIPS_PER_BLOCK)].append((cx, cy))
+
+    blocks = []
+    for block_chips in chips_by_block.values():
+        block_bounds = (
+            min(cx for cx, _ in block_chips) * extent, min(cy for _, cy in block_chips) * extent,
+            (max(cx for cx, _ in block_chips) + 1) * extent, (max(cy for _, cy in block_chips) + 1) * extent,
+        )
+        files = {}
+        for layer in LAYERS:
+            if layer not in trees:
+                break
+            indices = sorted(trees[layer].query(box(*block_bounds)))
+            if not len(indices):
+                break
+            files[layer] = [footprints[layer][i][0] for i in indices]
+        if len(files) == len(LAYERS):
+            blocks.append((block_bounds, block_chips, files))
+    return blocks
+
+# Worker: read one block of all layers and write its valid chips as one shard
+def export_block(task):
+    """
+    Args:
+        task (tuple): block_bounds, chips, files, crs_wkt, resolution, chip_size, min_valid, shard_path.
+
+    Returns:
+        tuple: (written chips, rejected chips, shard path or None, message).
+    """
+    block_bounds, chips, files, crs_wkt, resolution, chip_size, min_valid, shard_path = task
+    try:
+        minx, _, maxx, maxy = block_bounds
+        cols = int(round((maxx - minx) / resolution))
+        rows = int(round((maxy - block_bounds[1]) / resolution))
+        # Every source window is read once for all chips of the block
+        with span("read_block", chips=len(chips), files=sum(len(layer_files) for layer_files in files.values()), pixels=cols * rows):
+            layers = {layer: read_chunk(files[layer], block_bounds, cols, rows, crs_wkt) for layer in LAYERS}
+
+        extent = chip_size * resolution
+        kept = []
+        for cx, cy in chips:
+            col_off = int(round((cx * extent - minx) / resolution))
+            row_off = int(round((maxy - (cy + 1) * extent) / resolution))
+            patches = {layer: data[row_off:row_off + chip_size, col_off:col_off + chip_size] for layer, data in layers.items()}
+            valid = np.logical_and.reduce([np.isfinite(patch) for patch in patches.values()])
+            if valid.mean() >= min_valid:
+                kept.append(((cx, cy), patches))
+
+        if not kept:
+            return 0, len(chips), None, f"Block at {block_bounds[:2]}: no chip above the valid pixel threshold"
+
+        with span("write_shard", file=shard_path, chips=len(kept)):
+            np.savez(
+                shard_path,
+                chip_x=np.array([cx for (cx, _), _ in kept]),
+                chip_y=np.array([cy for (_, cy), _ in kept]),
+                # Upper left corner of every chip in the output CRS
+                origin_x=np.array([cx * extent for (cx, _), _ in kept]),
+                origin_y=np.array([(cy + 1) * extent for (_, cy), _ in kept]),
+                **{layer: np.stack([patches[layer] for _, patches in kept]) for layer in LAYERS},
+            )
+        return len(kept), len(chips) - len(kept), shard_path, f"Wrote {len(kept)} chips to {os.path.basename(shard_path)}"
+    except Exception as e:
+        return 0, len(chips), None, f"Error exporting block at {block_bounds[:2]}: {e}"
+
+def export_chips(cursor, aoi, aoi_crs, output_dir, target_crs="UTM", resolution=10.0, chip_size=CHIP_SIZE,
+                 strategy="grid", num_samples=None, min_valid=MIN_VALID_FRACTION, filters=None, num_workers=4, seed=0,
+                 layer_sources=None):
+    """
+    Export paired AGB and canopy height chips of an AOI as NPZ shards.
+
+    Args:
+        cursor: psycopg2 cursor or embedded catalog.
+        aoi (Polygon): Area to cover, in aoi_crs.
+        output_dir (str): Directory for the shards and manifest.json.
+        target_crs (str): CRS of the chips, or 'UTM' for the UTM zone of the AOI.
+        resolution (float): Pixel size in units of target_crs.
+        chip_size (int): Chip width and height in pixels.
+        strategy (str): 'grid' for all chips of the AOI, 'random' for num_samples of them.
+        min_valid (float): Minimum share of pixels valid in all layers.
+        filters (dict): Filters for catalog_query.query_database.
+        layer_sources (dict): {layer: (source, year)} for layers with files of several
+            sources or years in the area (see select_layer_sources).
+
+    Returns:
+        dict: The manifest, also written to manifest.json, including the filters and the
+            source and year of every layer. Every shard holds one array per
+            layer (chips, chip_size, chip_size) as float32 with NaN for no data, plus the
+            grid indices (chip_x, chip_y) and upper left corners (origin_x, origin_y).
+    """
+    if target_crs.upper() == "UTM":
+        target_crs = get_utm_crs(aoi, aoi_crs)
+    crs_wkt = get_crs_wkt(target_crs)
+    aoi_target = reproject_geometry(aoi, aoi_crs, target_crs)
+
+    results = query_database(cursor, reproject_geometry(aoi, aoi_crs, "EPSG:4326").wkt, **(filters or {}))
+    layer_sources = select_layer_sources(results, layer_sources)
+    chips = plan_chips(aoi_target, resolution, chip_size, strategy, num_samples, seed)
+    blocks = plan_blocks(chips, results, target_crs, resolution, chip_size, layer_sources)
+    logger.info(f"Planned {len(chips)} chips in {len(blocks)} blocks with data for all layers")
+
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [
+        (block_bounds, block_chips, files, crs_wkt, resolution, chip_size, min_valid,
+         os.path.join(output_dir, f"shard_{i:06d}.npz"))
+        for i, (block_bounds, block_chips, files) in enumerate(blocks)
+    ]
+
+    start_time = time.time()
+    shards = []
+    written = rejected = 0
+    with Pool(num_workers) as pool:
+        for done, (count, rejected_count, shard_path, message) in enumerate(pool.imap_unordered(export_block, tasks), start=1):
+            written += count
+            rejected += rejected_count
+            if shard_path is not None:
+                shards.append({"path": os.path.basename(shard_path), "chips": count})
+            logger.info(f"{done}/{len(tasks)}: {message}")
+    elapsed = time.time() - start_time
+
+    manifest = {
+        "crs": target_crs,
+        "crs_wkt": crs_wkt,
+        "resolution": resolution,
+        "chip_size": chip_size,
+        "layers": LAYERS,
+        "layer_sources": {layer: {"source": source, "year": year} for layer, (source, year) in layer_sources.items()},
+        "filters": filters or {},
+        "min_valid_fraction": min_valid,
+        "chips": written,
+        "rejected": rejected,
+        "shards": sorted(shards, key=lambda shard: shard["path"]),
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=2)
+    logger.info(f"Exported {written} chips ({rejected} rejected) in {elapsed:.2f} seconds ({written / max(elapsed, 1e-9):.0f} chips/s)")
+    return manifest
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    aoi = load_wkt(input("Enter the area to cover in WKT format: "))
+    aoi_crs = input("Enter the CRS of the area (default: EPSG:4326): ") or "EPSG:4326"
+    target_crs = input("Enter the CRS of the chips (default: UTM zone of the area): ") or "UTM"
+    resolution = float(input("Enter the pixel size in units of that CRS (default: 10): ") or 10)
+    chip_size = int(input(f"Enter the chip size in pixels (default: {CHIP_SIZE}): ") or CHIP_SIZE)
+    strategy = input("Enter the sampling strategy, 'grid' or 'random' (default: grid): ").strip() or "grid"
+    num_samples = int(input("Enter the number of chips to sample: ")) if strategy == "random" else None
+    min_valid = float(input(f"Enter the minimum share of valid pixels (default: {MIN_VALID_FRACTION}): ") or MIN_VALID_FRACTION)
+    output_dir = input("Enter the output directory for the shards: ").strip()
+    num_workers = int(input("Enter the number of workers (default: 4): ") or 4)
+    filters = prompt_filters()
+    layer_sources = {}
+    for layer in LAYERS:
+        choice = input(f"Enter the source and year of the {layer} layer, e.g. AGB_China,2020 (leave blank if the area has only one): ").strip()
+        if choice:
+            source, year = choice.rsplit(',', 1)
+            layer_sources[layer] = (source.strip(), int(year))
+
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+    try:
+        export_chips(cursor, aoi, aoi_crs, output_dir, target_crs, resolution, chip_size,
+                     strategy, num_samples, min_valid, filters, num_workers, layer_sources=layer_sources)
+    except ValueError as e:
+        print(f"Error: {e}")
+    cursor.close()
+    conn.close()
+
+if __name__ == "__main__":
+    setup_logging()
+    with profiling():
+        main()
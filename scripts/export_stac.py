@@ -0,0 +1,314 @@
+# Export of the catalog as a static STAC catalog, so other teams can discover the files
+# without database credentials. Layout of the output directory:
+#   catalog.json                                    root catalog linking all collections
+#   <table>-<source>/collection.json                one collection per table and source
+#   <table>-<source>/items/<table>-<id>.json        one item per catalog row
+#   index.json                                      bounding boxes and dates of all items plus
+#                                                   the exported catalog version, read by
+#                                                   stac_search.py and by the next export
+
+import os
+import re
+import json
+import time
+import shutil
+import logging
+
+import psycopg2
+from osgeo import gdal
+from shapely.geometry import mapping
+from shapely.wkt import loads as load_wkt
+
+from catalog_query import CATALOG_TABLES
+from query_cache import get_catalog_version
+from stac_search import INDEX_FILE, load_index
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+STAC_VERSION = "1.0.0"
+PROJECTION_EXTENSION = "https://stac-extensions.github.io/projection/v2.0.0/schema.json"
+RASTER_EXTENSION = "https://stac-extensions.github.io/raster/v1.1.0/schema.json"
+
+# GDAL data types as named by the raster extension
+DATA_TYPES = {
+    gdal.GDT_Byte: "uint8", gdal.GDT_UInt16: "uint16", gdal.GDT_Int16: "int16",
+    gdal.GDT_UInt32: "uint32", gdal.GDT_Int32: "int32", gdal.GDT_Float32: "float32", gdal.GDT_Float64: "float64",
+}
+
+ROW_COLUMNS = "table_name, id, ST_AsText(location), source, acquisition_date, tif_file_path, native_crs, native_bounds"
+
+# Function to get the collection id of a table and source
+def get_collection_id(table_name, source):
+    return f"{table_name}-{re.sub(r'[^A-Za-z0-9_.-]+', '_', source)}"
+
+# Function to get the href of a data file as published in the items
+def get_asset_href(file_path, data_root=None, href_root=None):
+    """Replace the local data_root prefix of a path by href_root (e.g. a URL), if both are given."""
+    if data_root and href_root and file_path.startswith(data_root):
+        return href_root.rstrip("/") + "/" + os.path.relpath(file_path, data_root).replace(os.sep, "/")
+    return file_path
+
+# Function to read the raster metadata of an item from the file header
+def get_raster_properties(file_path):
+    dataset = gdal.Open(file_path)
+    if dataset is None:
+        return {}
+    bands = []
+    for band_idx in range(1, dataset.RasterCount + 1):
+        band = dataset.GetRasterBand(band_idx)
+        band_info = {"data_type": DATA_TYPES.get(band.DataType, gdal.GetDataTypeName(band.DataType).lower())}
+        if band.GetNoDataValue() is not None:
+            band_info["nodata"] = band.GetNoDataValue()
+        bands.append(band_info)
+    geotransform = dataset.GetGeoTransform()
+    return {
+        "proj:shape": [dataset.RasterYSize, dataset.RasterXSize],
+        "proj:transform": [geotransform[1], geotransform[2], geotransform[0], geotransform[4], geotransform[5], geotransform[3]],
+        "raster:bands": bands,
+    }
+
+# Function to build the STAC item of a catalog row
+def build_item(row, data_root=None, href_root=None, read_metadata=True):
+    table_name, row_id, footprint_wkt, source, acquisition_date, file_path, native_crs, native_bounds = row
+    footprint = load_wkt(footprint_wkt)
+    collection_id = get_collection_id(table_name, source)
+    properties = {
+        "datetime": f"{acquisition_date.isoformat()}T00:00:00Z",
+        "source": source,
+        "table_name": table_name,
+    }
+    if native_crs:
+        # Authority codes as written by the loaders, anything else is a WKT string
+        properties["proj:code" if re.fullmatch(r"[A-Za-z]+:\w+", native_crs) else "proj:wkt2"] = native_crs
+    if native_bounds:
+        properties["proj:bbox"] = list(native_bounds)
+
+    asset = {"href": get_asset_href(file_path, data_root, href_root), "type": "image/tiff; application=geotiff", "roles": ["data"]}
+    if read_metadata:
+        raster_properties = get_raster_properties(file_path)
+        bands = raster_properties.pop("raster:bands", None)
+        properties.update(raster_properties)
+        if bands:
+            asset["raster:bands"] = bands
+
+    return {
+        "type": "Feature",
+        "stac_version": STAC_VERSION,
+        "stac_extensions": [PROJECTION_EXTENSION] + ([RASTER_EXTENSION] if read_metadata else []),
+        "id": f"{table_name}-{row_id}",
+        "collection": collection_id,
+        "geometry": mapping(footprint),
+        "bbox": list(footprint.bounds),
+        "properties": properties,
+        "assets": {"data": asset},
+        "links": [
+            {"rel": "root", "href": "../../catalog.json", "type": "application/json"},
+            {"rel": "parent", "href": "../collection.json", "type": "application/json"},
+            {"rel": "collection", "href": "../collection.json", "type": "application/json"},
+        ],
+    }
+
+# Function to write a JSON file in one step, so readers never see it half written
+def write_json(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as file:
+        json.dump(content, file, indent=2)
+    os.replace(tmp_path, path)
+
+# Function to check whether any catalog row changed since a version (aggregate tiles are not exported)
+def has_changes_since(cursor, catalog_version):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM catalog_changes WHERE xact_id >= %s AND table_name <> 'aggregate_data')",
+        (catalog_version,)
+    )
+    return cursor.fetchone()[0]
+
+# Function to fetch the catalog rows that have to be (re-)exported
+def get_rows_to_export(cursor, index):
+    """
+    Return (rows to write, ids of items to delete).
+
+    Without a previous export every row is written. Otherwise rows that are not in the
+    index yet and rows whose footprint overlaps a change logged at or after the exported
+    catalog version (see query_cache.get_catalog_version) are written, and items whose row
+    no longer exists are deleted.
+    """
+    if index is None:
+        cursor.execute(f"SELECT {ROW_COLUMNS} FROM catalog")
+        return cursor.fetchall(), set()
+
+    cursor.execute("SELECT table_name, id FROM catalog")
+    current_ids = {f"{table_name}-{row_id}": (table_name, row_id) for table_name, row_id in cursor.fetchall()}
+    deleted = set(index["items"]) - set(current_ids)
+    new_ids = [current_ids[item_id] for item_id in current_ids.keys() - index["items"].keys()]
+
+    cursor.execute(f"""
+        SELECT {ROW_COLUMNS} FROM catalog c
+        WHERE EXISTS (
+            SELECT 1 FROM catalog_changes ch
+            WHERE ch.xact_id >= %s AND ch.table_name <> 'aggregate_data' AND ch.location && c.location
+        )
+    """, (index["catalog_version"],))
+    rows = {f"{row[0]}-{row[1]}": row for row in cursor.fetchall()}
+
+    for table_name in CATALOG_TABLES:
+        table_ids = [row_id for name, row_id in new_ids if name == table_name]
+        if table_ids:
+            cursor.execute(f"SELECT {ROW_COLUMNS} FROM catalog WHERE table_name = %s AND id = ANY(%s)", (table_name, table_ids))
+            rows.update((f"{row[0]}-{row[1]}", row) for row in cursor.fetchall())
+    return list(rows.values()), deleted
+
+# Function to write the root catalog and the collections from the index
+def write_catalog(output_dir, index, title="Biomass and canopy height catalog"):
+    """
+    Write catalog.json and one collection.json per collection of the index items.
+
+    Collection directories of earlier exports without items in the index are deleted.
+
+    Returns:
+        int: Number of collections.
+    """
+    collections = {}
+    for entry in index["items"].values():
+        collection = collections.setdefault(entry["collection"], {
+            "table_name": entry["table_name"], "source": entry["source"],
+            "bbox": list(entry["bbox"]), "start": entry["datetime"], "end": entry["datetime"], "items": [],
+        })
+        bbox = collection["bbox"]
+        collection["bbox"] = [min(bbox[0], entry["bbox"][0]), min(bbox[1], entry["bbox"][1]),
+                              max(bbox[2], entry["bbox"][2]), max(bbox[3], entry["bbox"][3])]
+        collection["start"] = min(collection["start"], entry["datetime"])
+        collection["end"] = max(collection["end"], entry["datetime"])
+        collection["items"].append(entry["href"])
+
+    for collection_id, collection in collections.items():
+        write_json(os.path.join(output_dir, collection_id, "collection.json"), {
+            "type": "Collection",
+            "stac_version": STAC_VERSION,
+            "id": collection_id,
+            "description": f"{collection['source']} files of {collection['table_name']}",
+            "license": "various",
+            "extent": {
+                "spatial": {"bbox": [collection["bbox"]]},
+                "temporal": {"interval": [[collection["start"], collection["end"]]]},
+            },
+            "links": [
+                {"rel": "root", "href": "../catalog.json", "type": "application/json"},
+                {"rel": "parent", "href": "../catalog.json", "type": "application/json"},
+            ] + [
+                {"rel": "item", "href": os.path.relpath(href, collection_id).replace(os.sep, "/"), "type": "application/geo+json"}
+                for href in sorted(collection["items"])
+            ],
+        })
+
+    write_json(os.path.join(output_dir, "catalog.json"), {
+        "type": "Catalog",
+        "stac_version": STAC_VERSION,
+        "id": "bt-biomass",
+        "description": title,
+        "links": [{"rel": "root", "href": "./catalog.json", "type": "application/json"}] + [
+            {"rel": "child", "href": f"./{collection_id}/collection.json", "type": "application/json"}
+            for collection_id in sorted(collections)
+        ],
+    })
+
+    # Collections whose last item was deleted or moved, removed once catalog.json no longer links them
+    for name in os.listdir(output_dir):
+        collection_dir = os.path.join(output_dir, name)
+        if name not in collections and os.path.isfile(os.path.join(collection_dir, "collection.json")):
+            shutil.rmtree(collection_dir)
+            logger.info(f"Deleted the empty collection {name}")
+    return len(collections)
+
+def export_stac(cursor, output_dir, data_root=None, href_root=None, read_metadata=True, full=False):
+    """
+    Export the catalog to a static STAC catalog in output_dir, incrementally by default.
+
+    Only rows added, changed or deleted since the previous export are written, based on the
+    catalog version stored in index.json and the catalog_changes log. The index is written
+    last, so an interrupted export is simply repeated by the next run.
+
+    Args:
+        cursor: psycopg2 cursor.
+        data_root (str): Local directory of the data files, replaced by href_root in asset hrefs.
+        href_root (str): Published location of data_root, e.g. a URL or a shared mount.
+        read_metadata (bool): Open every written file for its shape, transform, data types and no-data values.
+        full (bool): Ignore the previous export and write every item.
+
+    Returns:
+        tuple: (written items, deleted items).
+    """
+    catalog_version = get_catalog_version(cursor)  # Taken first, so changes made during the export are picked up next time
+    index = None if full else load_index(output_dir)
+    if index is not None and not has_changes_since(cursor, index["catalog_version"]):
+        return 0, 0
+
+    with span("db.query_changes", full=index is None) as record:
+        rows, deleted = get_rows_to_export(cursor, index)
+        record["rows"] = len(rows)
+        record["deleted"] = len(deleted)
+    items = {} if index is None else index["items"]
+    for item_id in deleted:
+        entry = items.pop(item_id)
+        try:
+            os.remove(os.path.join(output_dir, entry["href"]))
+        except FileNotFoundError:
+            pass
+
+    for done, row in enumerate(rows, start=1):
+        with span("build_item", file=row[5]):
+            item = build_item(row, data_root, href_root, read_metadata)
+        href = f"{item['collection']}/items/{item['id']}.json"
+        previous = items.get(item["id"])
+        if previous is not None and previous["href"] != href:
+            # The source of the row changed, so the item moves to another collection
+            try:
+                os.remove(os.path.join(output_dir, previous["href"]))
+            except FileNotFoundError:
+                pass
+        write_json(os.path.join(output_dir, href), item)
+        items[item["id"]] = {
+            "href": href, "bbox": item["bbox"], "datetime": item["properties"]["datetime"],
+            "collection": item["collection"], "table_name": row[0], "source": row[3],
+        }
+        if done % 1000 == 0:
+            logger.info(f"Wrote {done}/{len(rows)} items")
+
+    index = {"catalog_version": catalog_version, "items": items}
+    with span("write_catalog", items=len(items)) as record:
+        record["collections"] = write_catalog(output_dir, index)
+        write_json(os.path.join(output_dir, INDEX_FILE), index)
+    return len(rows), len(deleted)
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    output_dir = input("Enter the output directory of the STAC catalog: ").strip()
+    data_root = input("Enter the local data directory to replace in asset hrefs (leave blank to keep local paths): ").strip() or None
+    href_root = None
+    if data_root:
+        href_root = input("Enter the published location of that directory (e.g. https://host/data): ").strip() or None
+    read_metadata = input("Read shape, data type and no-data value from every file? (Y/n): ").strip().lower() != 'n'
+    full = input("Rewrite all items instead of only the changed ones? (y/N): ").strip().lower() == 'y'
+
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+    start_time = time.time()
+    written, deleted = export_stac(cursor, output_dir, data_root, href_root, read_metadata, full)
+    cursor.close()
+    conn.close()
+    if not written and not deleted:
+        print("The export is up to date.")
+    else:
+        print(f"Wrote {written} and deleted {deleted} items in {time.time() - start_time:.2f} seconds.")
+
+if __name__ == "__main__":
+    setup_logging()
+    with profiling():
+        main()
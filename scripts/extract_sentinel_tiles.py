@@ -0,0 +1,146 @@
+import os
+import sys
+import logging
+import psycopg2
+from shapely.wkt import loads as load_wkt
+
+from convert_sentinel_tile import load_shapefile, get_tile_geometry
+from catalog_query import PreparedCatalogQuery, prompt_filters
+from query_geometry import reproject_geometry, get_crs_wkt, write_multi_layer_tif
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+# Size of a Sentinel-2 L1C/L2A tile in meters
+TILE_SIZE_M = 109800
+
+# Tile origins lie on a 60 m grid, so all 10, 20 and 60 m grids share their corner
+TILE_ORIGIN_STEP_M = 60
+
+# Maximum number of source dataset handles (one per file and reading thread) kept open between tiles
+MAX_OPEN_DATASETS = 256
+
+# Function to get the UTM CRS of a Sentinel-2 tile from its name
+def get_tile_crs(tile_name):
+    """Return the EPSG code of the UTM zone of a tile name such as '32UQD' (bands N-X are north)."""
+    zone = int(tile_name[:2])
+    latitude_band = tile_name[2].upper()
+    return f"EPSG:{(32600 if latitude_band >= 'N' else 32700) + zone}"
+
+# Function to compute the native pixel grid of a Sentinel-2 tile
+def get_tile_grid(tile_name, tile_geom, resolution):
+    """
+    Compute the output grid of a tile at 10, 20 or 60 m, aligned like the Sentinel-2 product.
+
+    Args:
+        tile_name (str): Tile name, e.g. '32UQD'.
+        tile_geom (Polygon or MultiPolygon): Tile footprint in EPSG:4326 from the shapefile index;
+            tiles crossing the antimeridian are split into two parts.
+        resolution (int): Pixel size in meters.
+
+    Returns:
+        dict: Grid in the format of query_geometry.compute_output_grid.
+    """
+    tile_crs = get_tile_crs(tile_name)
+    # The parts of a split tile join up again in UTM, so the bounds cover the whole tile
+    utm_geom = reproject_geometry(tile_geom, "EPSG:4326", tile_crs)
+    minx, _, _, maxy = utm_geom.bounds
+    # Snap the upper left corner back onto the tile origin grid
+    ulx = round(minx / TILE_ORIGIN_STEP_M) * TILE_ORIGIN_STEP_M
+    uly = round(maxy / TILE_ORIGIN_STEP_M) * TILE_ORIGIN_STEP_M
+    size = TILE_SIZE_M // resolution
+
+    return {
+        "crs_wkt": get_crs_wkt(tile_crs),
+        "geotransform": (ulx, resolution, 0, uly, 0, -resolution),
+        "cols": size,
+        "rows": size,
+        "bounds": (ulx, uly - TILE_SIZE_M, ulx + TILE_SIZE_M, uly),
+        "resolution": (resolution, resolution),
+    }
+
+def extract_tiles(cursor, gdf, tile_names, resolutions, output_dir, filters=None):
+    """
+    Write one multi-layer GeoTIFF per tile and resolution on the tile's UTM grid.
+
+    Source datasets stay open across tiles, so neighbouring tiles that share a source
+    do not open it again. filters are passed on to catalog_query.query_database; the
+    query is prepared once and executed per tile.
+
+    Returns:
+        list: Paths of the written files.
+    """
+    known_tiles = set(gdf['Name'])
+    prepared_query = PreparedCatalogQuery(cursor, **(filters or {}))
+    dataset_cache = {}
+    written = []
+    for tile_name in tile_names:
+        if tile_name not in known_tiles:
+            logger.warning(f"Tile {tile_name} not found in the shapefile. Skipping.")
+            continue
+        tile_geom = load_wkt(get_tile_geometry(gdf, tile_name))
+
+        intersecting_files = [result[0] for result in prepared_query.execute(tile_geom.wkt)]
+        if not intersecting_files:
+            logger.warning(f"No intersecting files found for tile {tile_name}. Skipping.")
+            continue
+        logger.info(f"Tile {tile_name}: {len(intersecting_files)} intersecting files")
+
+        if len(dataset_cache) > MAX_OPEN_DATASETS:
+            dataset_cache.clear()
+
+        with span("extract_tile", tile=tile_name, files=len(intersecting_files), resolutions=len(resolutions)):
+            for resolution in resolutions:
+                grid = get_tile_grid(tile_name, tile_geom, resolution)
+                output_tif = os.path.join(output_dir, f"{tile_name}_{resolution}m.tif")
+                write_multi_layer_tif(intersecting_files, output_tif, grid, dataset_cache)
+                written.append(output_tif)
+    prepared_query.close()
+    return written
+
+# Function to read tile names from the user input
+def parse_tile_names(tile_input):
+    """Accept a comma separated list of tile names or the path of a text file with one name per line."""
+    if os.path.isfile(tile_input):
+        with open(tile_input, "r") as file:
+            return [line.strip().lstrip('T') for line in file if line.strip()]
+    return [name.strip().lstrip('T') for name in tile_input.split(',') if name.strip()]
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    default_shapefile_dir = "/scratch/nkreyenkamp/Sentinel-2-Shapefile-Index-master"
+    shapefile_dir = input(f"Enter the directory containing the Sentinel-2 shapefile index (leave blank for default: {default_shapefile_dir}): ").strip() or default_shapefile_dir
+    if not os.path.isdir(shapefile_dir):
+        print(f"The specified directory does not exist: {shapefile_dir}")
+        sys.exit(1)
+
+    tile_names = parse_tile_names(input("Enter Sentinel-2 tile names separated by commas, or a file with one name per line: ").strip())
+    resolution_input = input("Enter the resolutions in meters separated by commas (10, 20 and/or 60, default: 10): ").strip() or "10"
+    resolutions = [int(value) for value in resolution_input.split(',')]
+    if any(resolution not in (10, 20, 60) for resolution in resolutions):
+        print("Invalid resolution. Please use 10, 20 and/or 60.")
+        sys.exit(1)
+
+    output_dir = input("Enter the output directory: ").strip()
+    os.makedirs(output_dir, exist_ok=True)
+    filters = prompt_filters()
+
+    gdf = load_shapefile(shapefile_dir)
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+
+    written = extract_tiles(cursor, gdf, tile_names, resolutions, output_dir, filters)
+    print(f"Processing completed. Wrote {len(written)} files.")
+
+    cursor.close()
+    conn.close()
+
+if __name__ == "__main__":
+    setup_logging()
+    with profiling():
+        main()
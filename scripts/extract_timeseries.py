@@ -0,0 +1,144 @@
+# dask and xarray are only imported by the functions that build the cubes, so importing
+# this module (e.g. for read_chunk) does not load them.
+
+import os
+import re
+import logging
+from collections import defaultdict
+
+import numpy as np
+import psycopg2
+from osgeo import gdal
+from shapely.wkt import loads as load_wkt
+
+from catalog_query import query_database, prompt_filters
+from query_geometry import compute_output_grid, reproject_geometry
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+# Default size of the spatial chunks in pixels
+CHUNK_SIZE = 1024
+
+# Function to warp and mosaic the sources of one time step into one chunk
+def read_chunk(file_paths, bounds, cols, rows, crs_wkt):
+    """
+    Mosaic band 1 of the given files into a float32 window, NaN where no data is available.
+
+    Datasets are opened per call, so chunks can be read from several threads at once.
+    """
+    with span("read_chunk", files=len(file_paths), pixels=cols * rows):
+        datasets = [gdal.Open(file_path) for file_path in file_paths]
+        warped_ds = gdal.Warp(
+            '', datasets, format='MEM', outputBounds=bounds, width=cols, height=rows,
+            dstSRS=crs_wkt, outputType=gdal.GDT_Float32, dstNodata=np.nan,
+            resampleAlg=gdal.GRA_NearestNeighbour, warpOptions=['INIT_DEST=NO_DATA']
+        )
+        return warped_ds.GetRasterBand(1).ReadAsArray()
+
+# Function to build a lazy (y, x) array for one time step
+def build_time_step(file_paths, grid, chunk_size=CHUNK_SIZE):
+    """Return a dask array on the output grid that reads its chunks only when computed."""
+    import dask
+    import dask.array as da
+
+    minx, _, _, maxy = grid["bounds"]
+    resolution_x, resolution_y = grid["resolution"]
+    blocks = []
+    for row_off in range(0, grid["rows"], chunk_size):
+        rows = min(chunk_size, grid["rows"] - row_off)
+        block_row = []
+        for col_off in range(0, grid["cols"], chunk_size):
+            cols = min(chunk_size, grid["cols"] - col_off)
+            chunk_bounds = (
+                minx + col_off * resolution_x, maxy - (row_off + rows) * resolution_y,
+                minx + (col_off + cols) * resolution_x, maxy - row_off * resolution_y,
+            )
+            chunk = dask.delayed(read_chunk)(file_paths, chunk_bounds, cols, rows, grid["crs_wkt"])
+            block_row.append(da.from_delayed(chunk, shape=(rows, cols), dtype=np.float32))
+        blocks.append(block_row)
+    return da.block(blocks)
+
+def build_timeseries_cubes(results, grid, chunk_size=CHUNK_SIZE):
+    """
+    Build one lazy (time, y, x) cube per source on a common grid.
+
+    Args:
+        results (list): Rows of catalog_query.query_database.
+        grid (dict): Output grid from query_geometry.compute_output_grid.
+        chunk_size (int): Spatial chunk size in pixels; every time step is its own chunk.
+
+    Returns:
+        dict: Source name to dask-backed xarray.DataArray with acquisition_date as time coordinate.
+    """
+    import dask.array as da
+    import xarray as xr
+
+    files_by_source = defaultdict(lambda: defaultdict(list))
+    for file_path, _, _, _, source, acquisition_date in results:
+        files_by_source[source][acquisition_date].append(file_path)
+
+    minx, _, _, maxy = grid["bounds"]
+    resolution_x, resolution_y = grid["resolution"]
+    x = minx + (np.arange(grid["cols"]) + 0.5) * resolution_x
+    y = maxy - (np.arange(grid["rows"]) + 0.5) * resolution_y
+
+    cubes = {}
+    for source, files_by_date in files_by_source.items():
+        dates = sorted(files_by_date)
+        data = da.stack([build_time_step(files_by_date[date], grid, chunk_size) for date in dates])
+        times = np.array(dates, dtype="datetime64[ns]")
+        cubes[source] = xr.DataArray(
+            data,
+            dims=("time", "y", "x"),
+            coords={"time": times, "acquisition_date": ("time", times), "y": y, "x": x},
+            name=re.sub(r'[^A-Za-z0-9_]+', '_', source),
+            attrs={"crs_wkt": grid["crs_wkt"], "geotransform": list(grid["geotransform"]), "source": source},
+        )
+    return cubes
+
+# Function to write the cubes to a Zarr store, one group per source
+def write_zarr(cubes, zarr_path):
+    """Write every cube chunk by chunk; only the chunks being written are held in memory."""
+    for source, cube in cubes.items():
+        with span("write_zarr", source=source, time_steps=cube.sizes['time'], pixels=cube.size):
+            cube.to_dataset().to_zarr(zarr_path, group=cube.name, mode='a' if os.path.exists(zarr_path) else 'w')
+        logger.info(f"Wrote {source} ({cube.sizes['time']} time steps) to {zarr_path}/{cube.name}")
+
+def main():
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    input_geom = load_wkt(input("Enter the geometry in WKT format: "))
+    input_crs = input("Enter the CRS for the input geometry (default: EPSG:4326): ") or "EPSG:4326"
+    resolution_input = input("Enter the desired spatial resolution in meters (leave blank for original resolution): ")
+    resolution_m = float(resolution_input) if resolution_input else None
+    target_crs = input("Enter the CRS for the output (default: EPSG:4326): ") or "EPSG:4326"
+    zarr_path = input("Enter the path of the Zarr store to write: ").strip()
+    chunk_size = int(input(f"Enter the chunk size in pixels (default: {CHUNK_SIZE}): ") or CHUNK_SIZE)
+    filters = prompt_filters()
+
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+    query_wkt = reproject_geometry(input_geom, input_crs, "EPSG:4326").wkt
+    results = query_database(cursor, query_wkt, **filters)
+    cursor.close()
+    conn.close()
+
+    if not results:
+        logger.warning("No intersecting files found. Exiting.")
+        return
+
+    grid = compute_output_grid([result[0] for result in results], input_geom, input_crs, None, target_crs, resolution_m)
+    cubes = build_timeseries_cubes(results, grid, chunk_size)
+    logger.info(f"Writing {len(cubes)} cubes from {len(results)} files to {zarr_path}...")
+    write_zarr(cubes, zarr_path)
+    logger.info("Processing completed.")
+
+if __name__ == "__main__":
+    setup_logging()
+    with profiling():
+        main()
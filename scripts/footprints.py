@@ -0,0 +1,41 @@
+from osgeo import osr
+from shapely.ops import transform
+from pyproj import CRS, Transformer
+
+# Function to reproject a raster footprint to EPSG:4326
+def get_polygon_in_4326(polygon, src_crs):
+    """
+    Reproject a footprint polygon to EPSG:4326.
+
+    Args:
+        polygon (Polygon): Footprint in the source CRS.
+        src_crs: Source CRS as WKT, authority string (e.g. 'EPSG:2154') or CRS object.
+
+    Returns:
+        Polygon: Footprint in EPSG:4326.
+    """
+    if not src_crs:
+        raise ValueError("Invalid source CRS: Could not determine projection.")
+    src_crs = CRS.from_user_input(src_crs)
+    if src_crs == CRS.from_epsg(4326):
+        return polygon
+
+    transformer = Transformer.from_crs(src_crs, 'EPSG:4326', always_xy=True)
+    # Densify the edges so the footprint still covers the raster after reprojection
+    polygon = polygon.segmentize(polygon.length / 400)
+    return transform(transformer.transform, polygon)
+
+# Function to get a compact identifier of the native CRS
+def get_native_crs(src_wkt):
+    """Return the authority code of a CRS (e.g. 'EPSG:2154'), or its WKT if it has none."""
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(src_wkt)
+    try:
+        srs.AutoIdentifyEPSG()
+    except RuntimeError:
+        pass
+    name = srs.GetAuthorityName(None)
+    code = srs.GetAuthorityCode(None)
+    if name and code:
+        return f"{name}:{code}"
+    return src_wkt
@@ -0,0 +1,121 @@
+# Fixed-degree summary grid written by build_grid_summary.py. Cells are indexed from
+# (-180, -90): cell (x, y) of a level with n cells per degree covers longitudes
+# -180 + x / n to -180 + (x + 1) / n and latitudes -90 + y / n to -90 + (y + 1) / n.
+# Point and polygon summaries are answered from the grid_summary table without opening
+# any raster.
+
+import math
+
+# Levels of the grid as cells per degree (1°, 0.1° and 0.01° cells); every level must divide the next one
+CELLS_PER_DEGREE = [1, 10, 100]
+
+# A polygon summary uses the finest level with at most this many cells in the bounding box of the polygon
+MAX_QUERY_CELLS = 10000
+
+# Function to get the cell containing a point
+def get_cell(longitude, latitude, cells_per_degree):
+    """Return (cell_x, cell_y) of the cell containing a point in EPSG:4326."""
+    cell_x = min(math.floor((longitude + 180) * cells_per_degree), 360 * cells_per_degree - 1)
+    cell_y = min(math.floor((latitude + 90) * cells_per_degree), 180 * cells_per_degree - 1)
+    return cell_x, cell_y
+
+# Function to pick the level a polygon summary is answered at
+def get_summary_level(geom, max_cells=MAX_QUERY_CELLS):
+    """Return the finest level whose cells in the bounding box of geom (EPSG:4326) do not exceed max_cells."""
+    minx, miny, maxx, maxy = geom.bounds
+    for cells_per_degree in sorted(CELLS_PER_DEGREE, reverse=True):
+        if (maxx - minx) * (maxy - miny) * cells_per_degree ** 2 <= max_cells:
+            return cells_per_degree
+    return min(CELLS_PER_DEGREE)
+
+# Function to check whether the grid_summary table exists (databases set up before it was added lack it)
+def has_grid_summary(cursor):
+    if hasattr(cursor, "query_catalog"):
+        return False
+    cursor.execute("SELECT to_regclass('grid_summary') IS NOT NULL")
+    return cursor.fetchone()[0]
+
+# Function to add the filter conditions of the query scripts to a summary query
+def get_summary_conditions(params, years=None, sources=None, tables=None):
+    conditions = []
+    if years:
+        conditions.append("year BETWEEN %(first_year)s AND %(last_year)s")
+        params["first_year"], params["last_year"] = int(years[0]), int(years[1])
+    if sources:
+        conditions.append("source = ANY(%(sources)s)")
+        params["sources"] = list(sources)
+    if tables:
+        conditions.append("source_table = ANY(%(tables)s)")
+        params["tables"] = list(tables)
+    return conditions
+
+# Function to turn summary rows into dicts
+def get_summary_dicts(rows, cells_per_degree):
+    return [
+        {
+            "table_name": table_name, "source": source, "year": year, "count": int(count),
+            "sum": total, "mean": total / count if count else float("nan"), "min": minimum, "max": maximum,
+            "cells": cells, "cell_size_deg": 1 / cells_per_degree,
+        }
+        for table_name, source, year, count, total, minimum, maximum, cells in rows
+    ]
+
+def query_point_summary(cursor, longitude, latitude, cells_per_degree=max(CELLS_PER_DEGREE),
+                        years=None, sources=None, tables=None, policy=None):
+    """
+    Look up the summary of the cell containing a point, per source table, source and year.
+
+    The cell is computed here, so the lookup is a primary key scan. policy is only accepted
+    so the filters of prompt_filters can be passed on; summaries cover all files of a year.
+
+    Returns:
+        list: Dicts with table_name, source, year, count, sum, mean, min, max, cells and
+            cell_size_deg. Empty for an embedded catalog or without a grid_summary table.
+    """
+    if not has_grid_summary(cursor):
+        return []
+    cell_x, cell_y = get_cell(longitude, latitude, cells_per_degree)
+    params = {"cells_per_degree": cells_per_degree, "cell_x": cell_x, "cell_y": cell_y}
+    conditions = [
+        "cells_per_degree = %(cells_per_degree)s AND cell_x = %(cell_x)s AND cell_y = %(cell_y)s",
+        *get_summary_conditions(params, years, sources, tables),
+    ]
+    cursor.execute(f"""
+        SELECT source_table, source, year, pixel_count, pixel_sum, pixel_min, pixel_max, 1
+        FROM grid_summary
+        WHERE {' AND '.join(conditions)}
+        ORDER BY source_table, source, year DESC;
+    """, params)
+    return get_summary_dicts(cursor.fetchall(), cells_per_degree)
+
+def query_geometry_summary(cursor, geom_wkt, cells_per_degree=None, years=None, sources=None, tables=None, policy=None):
+    """
+    Summarize the cells whose center lies inside a geometry, per source table, source and year.
+
+    Counts, sums, minima and maxima of the cells are combined exactly, so the mean is the
+    mean of all pixels behind the cells. The boundary follows the cells, not the pixels.
+    Without cells_per_degree, the level is picked with get_summary_level.
+
+    Returns:
+        list: Dicts as returned by query_point_summary.
+    """
+    if not has_grid_summary(cursor):
+        return []
+    if cells_per_degree is None:
+        from shapely.wkt import loads as load_wkt
+        cells_per_degree = get_summary_level(load_wkt(geom_wkt))
+    params = {"cells_per_degree": cells_per_degree, "geom": geom_wkt}
+    conditions = [
+        "cells_per_degree = %(cells_per_degree)s",
+        "cell && ST_GeomFromText(%(geom)s, 4326)",
+        "ST_Intersects(ST_GeomFromText(%(geom)s, 4326), ST_Centroid(cell))",
+        *get_summary_conditions(params, years, sources, tables),
+    ]
+    cursor.execute(f"""
+        SELECT source_table, source, year, sum(pixel_count), sum(pixel_sum), min(pixel_min), max(pixel_max), count(*)
+        FROM grid_summary
+        WHERE {' AND '.join(conditions)}
+        GROUP BY source_table, source, year
+        ORDER BY source_table, source, year DESC;
+    """, params)
+    return get_summary_dicts(cursor.fetchall(), cells_per_degree)
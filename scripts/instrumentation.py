@@ -0,0 +1,134 @@
+# Opt-in timing of the hot paths of query and ingest, plus logging setup for the scripts.
+#
+# Spans are only recorded when tracing is enabled, either with enable_tracing() or with
+# the environment variables read by setup_logging():
+#   BT_LOG_LEVEL  log level of the scripts (default: INFO)
+#   BT_TRACE      '1' to write spans as JSON lines to stderr, or a file path
+#   BT_PROFILE    file path for a cProfile dump (.prof) or a pyinstrument report (.html)
+
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import itertools
+from contextlib import contextmanager
+
+trace_logger = logging.getLogger("bt_biomass.trace")
+trace_logger.propagate = False
+
+_tracing = False
+_span_ids = itertools.count(1)
+_local = threading.local()
+
+# Function to configure leveled logging and, if requested, tracing from the environment
+def setup_logging(level=None):
+    logging.basicConfig(
+        level=(level or os.environ.get("BT_LOG_LEVEL", "INFO")).upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    trace_target = os.environ.get("BT_TRACE")
+    if trace_target:
+        enable_tracing(None if trace_target == "1" else trace_target)
+
+# Function to switch span recording on
+def enable_tracing(log_path=None):
+    """Write every finished span as one JSON line to log_path, or to stderr if it is None."""
+    global _tracing
+    handler = logging.FileHandler(log_path) if log_path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    trace_logger.handlers = [handler]
+    trace_logger.setLevel(logging.INFO)
+    _tracing = True
+
+def tracing_enabled():
+    return _tracing
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Time a block of code and log it as a JSON span when tracing is enabled.
+
+    The yielded dict can be filled inside the block, e.g. with bytes or pixel counts.
+    Spans opened inside the block in the same thread are logged with this span as parent.
+
+    Example:
+        with span("warp", file=path) as record:
+            data = band.ReadAsArray()
+            record["pixels"] = data.size
+    """
+    if not _tracing:
+        yield attrs
+        return
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    span_id = next(_span_ids)
+    parent_id = stack[-1] if stack else None
+    stack.append(span_id)
+    start_wall = time.time()
+    start_time = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        stack.pop()
+        record = {
+            "span": name,
+            "id": span_id,
+            "parent": parent_id,
+            "thread": threading.current_thread().name,
+            "pid": os.getpid(),
+            "start": start_wall,
+            "ms": (time.perf_counter() - start_time) * 1000,
+            **attrs,
+        }
+        if error:
+            record["error"] = error
+        trace_logger.info(json.dumps(record, default=str))
+
+@contextmanager
+def profiling(output_path=None):
+    """
+    Profile the block and write the result to output_path (default: $BT_PROFILE).
+
+    Paths ending in .html use pyinstrument if it is installed, all others a cProfile dump
+    that can be read with pstats or snakeviz. Without a path the block runs unprofiled.
+    """
+    output_path = output_path or os.environ.get("BT_PROFILE")
+    if not output_path:
+        yield
+        return
+
+    if output_path.endswith(".html"):
+        try:
+            from pyinstrument import Profiler  # Optional dependency
+        except ImportError:
+            logging.getLogger(__name__).warning("pyinstrument is not installed, writing a cProfile dump instead")
+            output_path = os.path.splitext(output_path)[0] + ".prof"
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with open(output_path, "w") as file:
+                    file.write(profiler.output_html())
+                logging.getLogger(__name__).info(f"Wrote profile to {output_path}")
+            return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_path)
+        logging.getLogger(__name__).info(f"Wrote profile to {output_path}")
@@ -1,9 +1,15 @@
 import os
+import logging
 import psycopg2
-from osgeo import gdal, osr
+from osgeo import gdal
 from shapely.geometry import Polygon
-from shapely.ops import transform
-from pyproj import Transformer
+
+from footprints import get_polygon_in_4326, get_native_crs
+from reproject_and_load import write_records
+from embedded_catalog import EmbeddedCatalog
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
 
 # Function to establish a connection to the PostgreSQL database
 def connect_to_db(dbname, user, password, host, port):
@@ -20,23 +26,14 @@ def connect_to_db(dbname, user, password, host, port):
         print(f"Error connecting to the database: {e}")
         return None
 
-# Function to determine CRS and transform if needed
-def get_polygon_in_4326(polygon, src_wkt):
-    """Reprojects a polygon from its source CRS to EPSG:4326."""
-    src_crs = osr.SpatialReference()
-    src_crs.ImportFromWkt(src_wkt)
-    src_proj = src_crs.ExportToProj4()
-
-    transformer = Transformer.from_crs(src_proj, 'EPSG:4326', always_xy=True)
-    return transform(transformer.transform, polygon)
-
 # Function to insert GeoTIFF data into the database
 def insert_geotiff_data(cursor, file_path, source, acquisition_year):
     try:
         # Open the GeoTIFF file
-        dataset = gdal.Open(file_path)
+        with span("gdal.open", file=file_path):
+            dataset = gdal.Open(file_path)
         if dataset is None:
-            print(f"Could not open {file_path}")
+            logger.error(f"Could not open {file_path}")
             return
 
         # Get GeoTIFF coordinates
@@ -56,32 +53,32 @@ def insert_geotiff_data(cursor, file_path, source, acquisition_year):
         # Check the CRS of the GeoTIFF file
         src_wkt = dataset.GetProjection()
         if not src_wkt:
-            print(f"No CRS information found in {file_path}")
+            logger.error(f"No CRS information found in {file_path}")
             return
 
         # Transform polygon if needed
         polygon_4326 = get_polygon_in_4326(polygon, src_wkt)
 
         # Insert the data into the canopy_height_data table with specified acquisition date
-        insert_query = """
-        INSERT INTO canopy_height_data (location, source, acquisition_date, tif_file_path)
-        VALUES (ST_GeomFromText(%s, 4326), %s, %s, %s)
-        """
         acquisition_date = f"{acquisition_year}-01-01"
-        cursor.execute(insert_query, (polygon_4326.wkt, source, acquisition_date, file_path))
-        print(f"Inserted {file_path} from {source}")
+        native_bounds = [min_x, min_y, max_x, max_y]
+        with span("db.insert", table="canopy_height_data", rows=1):
+            write_records(cursor, "canopy_height_data", [(polygon_4326.wkt, source, acquisition_date, file_path, get_native_crs(src_wkt), native_bounds)])
+        logger.info(f"Inserted {file_path} from {source}")
         
     except Exception as e:
-        print(f"Error processing file {file_path}: {e}")
+        logger.error(f"Error processing file {file_path}: {e}")
 
 # Main function
 def main():
-    # Get database connection details
-    dbname = input("Enter the database name: ")
-    user = input("Enter the database username: ")
-    password = input("Enter the database password (leave blank if not set): ") or None
-    host = input("Enter the database host (default: localhost): ") or "localhost"
-    port = input("Enter the database port (default: 5432): ") or "5432"
+    # Get database connection details, or the file of an embedded catalog
+    catalog_path = input("Enter the path of an embedded catalog file to write to (leave blank to use PostgreSQL): ").strip()
+    if not catalog_path:
+        dbname = input("Enter the database name: ")
+        user = input("Enter the database username: ")
+        password = input("Enter the database password (leave blank if not set): ") or None
+        host = input("Enter the database host (default: localhost): ") or "localhost"
+        port = input("Enter the database port (default: 5432): ") or "5432"
 
     # Get data location
     open_canopy_root = input("Enter the root folder containing Open-Canopy data: ")
@@ -92,7 +89,7 @@ def main():
         return
 
     # Connect to the database
-    conn = connect_to_db(dbname, user, password, host, port)
+    conn = EmbeddedCatalog(catalog_path) if catalog_path else connect_to_db(dbname, user, password, host, port)
     if not conn:
         return
     cursor = conn.cursor()
@@ -116,4 +113,6 @@ def main():
     print("Data loading completed.")
 
 if __name__ == '__main__':
-    main()
+    setup_logging()
+    with profiling():
+        main()
@@ -0,0 +1,184 @@
+# On-disk cache for geometry queries. Stores the intersecting files and the written
+# rasters of a request, keyed by a hash of the normalized request.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from datetime import date
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout of the cache entries changes
+CACHE_VERSION = 1
+
+# Default size limit of the cache directory
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+
+ENTRY_FILE = "entry.json"
+
+# Function to compute the cache key of a geometry request
+def get_cache_key(input_geom, input_crs, **request):
+    """
+    Hash the normalized geometry (WKB) together with all other request parameters.
+
+    The geometry is normalized first, so the same polygon with another start vertex or
+    ring orientation gives the same key. request holds everything else that changes the
+    output, e.g. resolution, target_crs and the query filters.
+    """
+    geom_hash = hashlib.sha256(input_geom.normalize().wkb).hexdigest()
+    payload = json.dumps(
+        {"version": CACHE_VERSION, "geom": geom_hash, "input_crs": input_crs, **request},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# Function to get the current position in the catalog change log
+def get_catalog_version(cursor):
+    """
+    Return the oldest transaction id that may still be running (the xmin of the current snapshot).
+
+    Every change written by an older transaction was committed or rolled back before, so
+    queries that follow see it. Changes of this transaction id or newer may not have been
+    visible yet, so they count as changed after the version, even if some were already seen.
+    """
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    return cursor.fetchone()[0]
+
+# Function to check whether catalog or aggregate rows covering an area changed since a given version
+def has_catalog_changed(cursor, query_wkt, catalog_version):
+    cursor.execute(
+        """
+        SELECT EXISTS (
+            SELECT 1 FROM catalog_changes
+            WHERE xact_id >= %s AND ST_Intersects(location, ST_GeomFromText(%s, 4326))
+        )
+        """,
+        (catalog_version, query_wkt)
+    )
+    return cursor.fetchone()[0]
+
+class QueryCache:
+    """
+    Size-bounded LRU cache of query results on local disk.
+
+    Every entry is a directory named after the cache key, holding entry.json (catalog rows,
+    query geometry and catalog version) and copies of the written rasters. An entry is
+    dropped on lookup if catalog or aggregate rows intersecting its query geometry were
+    inserted, updated or deleted after it was created, and the least recently used entries are evicted once
+    the cache grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, cursor, key):
+        """
+        Return the entry of a key, or None if there is no valid entry.
+
+        The entry has the keys results (catalog rows as returned by query_database) and
+        rasters (paths of the cached files).
+        """
+        entry_dir = self.get_entry_dir(key)
+        entry_file = os.path.join(entry_dir, ENTRY_FILE)
+        try:
+            with open(entry_file, "r") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if has_catalog_changed(cursor, entry["query_wkt"], entry["catalog_version"]):
+            logger.info(f"Catalog changed since cache entry {key[:12]} was written, discarding it.")
+            self.invalidate(key)
+            return None
+
+        os.utime(entry_file)  # Mark as recently used
+        return {
+            "results": [
+                (path, wkt, native_crs, table_name, source, date.fromisoformat(acquisition_date))
+                for path, wkt, native_crs, table_name, source, acquisition_date in entry["results"]
+            ],
+            "rasters": [os.path.join(entry_dir, name) for name in entry["rasters"]],
+        }
+
+    def store(self, key, query_wkt, catalog_version, results, raster_paths):
+        """
+        Store the catalog rows and copies of the rasters of a request.
+
+        catalog_version must be taken before the catalog was queried, so changes made
+        while the request was processed also invalidate the entry.
+        """
+        entry_dir = self.get_entry_dir(key)
+        tmp_dir = f"{entry_dir}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        for raster_path in raster_paths:
+            shutil.copyfile(raster_path, os.path.join(tmp_dir, os.path.basename(raster_path)))
+
+        entry = {
+            "query_wkt": query_wkt,
+            "catalog_version": catalog_version,
+            "created": time.time(),
+            "results": [
+                [path, wkt, native_crs, table_name, source, acquisition_date.isoformat()]
+                for path, wkt, native_crs, table_name, source, acquisition_date in results
+            ],
+            "rasters": [os.path.basename(raster_path) for raster_path in raster_paths],
+        }
+        with open(os.path.join(tmp_dir, ENTRY_FILE), "w") as file:
+            json.dump(entry, file)
+
+        # Publish the entry in one step, so readers never see it half written
+        self.invalidate(key)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)  # Another process stored it first
+        self.evict()
+
+    def invalidate(self, key):
+        shutil.rmtree(self.get_entry_dir(key), ignore_errors=True)
+
+    def get_entries(self):
+        """Return (last used, size in bytes, key) of every entry."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self.get_entry_dir(key)
+            entry_file = os.path.join(entry_dir, ENTRY_FILE)
+            if not os.path.isfile(entry_file):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(entry_dir) if entry.is_file())
+            entries.append((os.path.getmtime(entry_file), size, key))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits into max_bytes."""
+        entries = sorted(self.get_entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total_size <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total_size -= size
+
+    def clear(self):
+        for _, _, key in self.get_entries():
+            self.invalidate(key)
+
+def main():
+    cache_dir = input("Enter the cache directory: ").strip()
+    cache = QueryCache(cache_dir)
+    entries = cache.get_entries()
+    print(f"{len(entries)} entries, {sum(size for _, size, _ in entries) / 1024 ** 2:.1f} MB")
+    if input("Clear the cache? (y/N): ").strip().lower() == 'y':
+        cache.clear()
+        print("Cache cleared.")
+
+if __name__ == "__main__":
+    main()
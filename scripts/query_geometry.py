@@ -1,42 +1,76 @@
+# Also imported by the per-request scripts, so numpy, GDAL, shapely, pyproj and psycopg2
+# are imported by the functions that use them; importing this module loads none of them.
+
 import os
-import psycopg2
-from shapely.geometry import Polygon
-from shapely.wkt import loads as load_wkt
-from osgeo import gdal, osr
-from pyproj import CRS, Transformer
+import re
+import math
+import hashlib
+import shutil
+import logging
+import threading
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from catalog_query import query_database, prompt_filters, substitute_aggregates
+from query_cache import QueryCache, get_cache_key, get_catalog_version
+from embedded_catalog import EmbeddedCatalog
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+# Number of source files read at the same time
+READ_THREADS = 4
+
+# Maximum number of bytes of warped sources held in memory before they are written
+READ_MEMORY_BUDGET = 1024 ** 3
+
+# Band of the mean in the aggregate tiles of build_pyramid.py (after sum and count)
+AGGREGATE_MEAN_BAND = 3
+
+# Reading thread pools by thread count; they live as long as the process, so the handles
+# their threads keep in a dataset_cache stay valid for later calls
+_read_executors = {}
+_read_executors_lock = threading.Lock()
 
 # Function to reproject a given geometry from one CRS to another
 def reproject_geometry(input_geom, input_crs, target_crs):
-    """Reproject geometry from input CRS to target CRS."""
+    """
+    Reproject geometry from input CRS to target CRS.
+
+    Works for any geometry type, including MultiPolygons such as tiles split at the
+    antimeridian, and keeps interior rings.
+    """
+    from shapely.ops import transform
+    from pyproj import CRS, Transformer
+
     transformer = Transformer.from_crs(CRS.from_user_input(input_crs), CRS.from_user_input(target_crs), always_xy=True)
     # Transform each coordinate in the geometry
-    transformed_coords = [transformer.transform(x, y) for x, y in input_geom.exterior.coords]
-    return Polygon(transformed_coords)
-
-# Function to query the database for intersecting raster files using a geometry in WKT format
-def query_database(cursor, geom_wkt):
-    """Query the database for intersecting TIFF files."""
-    # SQL query to find intersections across multiple tables
-    query = """
-        SELECT tif_file_path, ST_AsText(location)
-        FROM (
-            SELECT tif_file_path, location FROM biomass_data
-            UNION
-            SELECT tif_file_path, location FROM canopy_height_data
-        ) AS combined
-        WHERE ST_Intersects(location, ST_GeomFromText(%s, 4326));
-    """
-    cursor.execute(query, (geom_wkt,))  # Execute the query with the provided WKT geometry
-    return cursor.fetchall()  # Fetch all matching records
+    return transform(transformer.transform, input_geom)
 
 # Function to extract geotransform and spatial reference information from a raster dataset
 def get_raster_geotransform(dataset):
     """Get the geotransform and CRS of the raster dataset."""
+    from osgeo import osr
+
     geo_transform = dataset.GetGeoTransform()  # Get geotransform (origin, resolution, etc.)
     spatial_ref = osr.SpatialReference()  # Create spatial reference object
     spatial_ref.ImportFromWkt(dataset.GetProjection())  # Import WKT projection
     return geo_transform, spatial_ref
 
+# Function to get the geotransform a raster would have after warping it to another CRS
+def get_warped_geotransform(dataset, dst_wkt):
+    """Get the geotransform of the dataset expressed in the destination CRS."""
+    from osgeo import gdal, osr
+
+    geo_transform, spatial_ref = get_raster_geotransform(dataset)
+    dst_ref = osr.SpatialReference()
+    dst_ref.ImportFromWkt(dst_wkt)
+    if spatial_ref.IsSame(dst_ref):
+        return geo_transform
+    # A warped VRT only computes the suggested output grid, no pixels are read
+    warped_vrt = gdal.AutoCreateWarpedVRT(dataset, None, dst_wkt)
+    return warped_vrt.GetGeoTransform()
+
 # Function to align a coordinate to the original raster grid
 def align_to_original_grid(value, origin, pixel_size, align_func):
     """Align a coordinate value to the original raster grid."""
@@ -44,41 +78,124 @@ def align_to_original_grid(value, origin, pixel_size, align_func):
     return origin + align_func((value - origin) / pixel_size) * pixel_size
 
 # Function to determine the finest resolution among a list of raster files
-def get_finest_resolution(intersecting_files):
-    """Find the finest resolution among all intersecting files."""
+def get_finest_resolution(intersecting_files, dst_wkt):
+    """Find the finest resolution among all intersecting files, in units of the destination CRS."""
+    from osgeo import gdal
+
     min_pixel_width = float('inf')  # Initialize with infinity for width
     min_pixel_height = float('inf')  # Initialize with infinity for height
 
     # Loop through each file to determine the smallest pixel dimensions
     for intersecting_file in intersecting_files:
         ds = gdal.Open(intersecting_file)  # Open the file
-        geo_transform, _ = get_raster_geotransform(ds)  # Get geotransform
+        geo_transform = get_warped_geotransform(ds, dst_wkt)  # Get geotransform in the output CRS
         min_pixel_width = min(min_pixel_width, geo_transform[1])  # Update min width
         min_pixel_height = min(min_pixel_height, abs(geo_transform[5]))  # Update min height
         ds = None  # Close the dataset
 
     return min_pixel_width, min_pixel_height  # Return the smallest dimensions
 
-# Function to create a multi-layer GeoTIFF using intersecting raster files
-def create_multi_layer_tif(intersecting_files, output_tif, input_geom, input_crs, resolution=None, target_crs="EPSG:4326"):
-    """Create a multi-layer GeoTIFF with intersecting files."""
+# Function to get the WKT of a CRS given as EPSG code, PROJ string or WKT
+def get_crs_wkt(crs):
+    """Return the WKT of a user-supplied CRS definition."""
+    from osgeo import osr
+
+    spatial_ref = osr.SpatialReference()
+    spatial_ref.SetFromUserInput(crs)
+    return spatial_ref.ExportToWkt()
+
+# Function to get the UTM zone CRS of a geometry
+def get_utm_crs(input_geom, input_crs):
+    """Return the EPSG code of the UTM zone containing the centroid of the geometry."""
+    centroid = reproject_geometry(input_geom, input_crs, "EPSG:4326").centroid
+    zone = min(int((centroid.x + 180) // 6) + 1, 60)
+    return f"EPSG:{(32600 if centroid.y >= 0 else 32700) + zone}"
+
+# Function to convert a resolution in meters to the units of a CRS
+def get_resolution_in_crs(meters, crs_wkt, latitude):
+    """
+    Return the (x, y) pixel size in units of the CRS for square pixels of the given size in meters.
+
+    For geographic CRSs the length of a degree of longitude and latitude at the given
+    latitude is used, so pixels stay square on the ground instead of getting wider
+    towards the poles.
+    """
+    from osgeo import osr
+
+    spatial_ref = osr.SpatialReference()
+    spatial_ref.ImportFromWkt(crs_wkt)
+    if spatial_ref.IsGeographic():
+        phi = math.radians(max(min(latitude, 89.0), -89.0))
+        meters_per_degree_y = 111132.954 - 559.822 * math.cos(2 * phi) + 1.175 * math.cos(4 * phi)
+        meters_per_degree_x = 111412.84 * math.cos(phi) - 93.5 * math.cos(3 * phi) + 0.118 * math.cos(5 * phi)
+        return meters / meters_per_degree_x, meters / meters_per_degree_y
+    meters_per_unit = spatial_ref.GetLinearUnits()
+    return meters / meters_per_unit, meters / meters_per_unit
+
+# Function to convert the pixel size of a grid for the EPSG:4326 copy of an output
+def get_4326_resolution(grid, input_geom, input_crs):
+    """
+    Return the (x, y) pixel size in degrees that matches the pixel size of a grid.
+
+    Geographic grids keep their pixel size. Projected pixel sizes are converted to meters
+    and then to degrees at the latitude of the geometry, the same way as resolution_m.
+    """
+    from osgeo import osr
+
+    spatial_ref = osr.SpatialReference()
+    spatial_ref.ImportFromWkt(grid["crs_wkt"])
+    if spatial_ref.IsGeographic():
+        return tuple(grid["resolution"])
+    meters_per_unit = spatial_ref.GetLinearUnits()
+    latitude = reproject_geometry(input_geom, input_crs, "EPSG:4326").centroid.y
+    crs_4326 = get_crs_wkt("EPSG:4326")
+    resolution_x = get_resolution_in_crs(grid["resolution"][0] * meters_per_unit, crs_4326, latitude)[0]
+    resolution_y = get_resolution_in_crs(grid["resolution"][1] * meters_per_unit, crs_4326, latitude)[1]
+    return resolution_x, resolution_y
+
+# Function to compute the output grid for a geometry directly in the target CRS
+def compute_output_grid(intersecting_files, input_geom, input_crs, resolution=None, target_crs="EPSG:4326", resolution_m=None):
+    """
+    Compute the output raster grid covering the input geometry in the target CRS.
+
+    Args:
+        intersecting_files (list): Paths of the source rasters.
+        input_geom (Polygon): Geometry to cover.
+        input_crs (str): CRS of input_geom.
+        resolution (float or tuple): Pixel size (or (x, y) pixel sizes) in units of target_crs,
+            or None for the finest source resolution.
+        target_crs (str): CRS of the output grid.
+        resolution_m (float): Pixel size in meters, converted to the units of target_crs
+            at the latitude of the geometry. Takes precedence over resolution.
+
+    Returns:
+        dict: crs_wkt, geotransform, cols, rows, bounds (minx, miny, maxx, maxy) and resolution (x, y).
+    """
+    from osgeo import gdal
+
+    # The grid is defined in the target CRS; sources in other CRSs are warped on the fly
+    raster_crs = get_crs_wkt(target_crs)
+
+    if resolution_m is not None:
+        latitude = reproject_geometry(input_geom, input_crs, "EPSG:4326").centroid.y
+        resolution = get_resolution_in_crs(resolution_m, raster_crs, latitude)
+
     # Use the finest resolution if none is provided
     if resolution is None:
-        resolution_x, resolution_y = get_finest_resolution(intersecting_files)
+        resolution_x, resolution_y = get_finest_resolution(intersecting_files, raster_crs)
+    elif isinstance(resolution, tuple):
+        resolution_x, resolution_y = resolution
     else:
         resolution_x = resolution_y = resolution
 
-    driver = gdal.GetDriverByName("GTiff")  # Get the GeoTIFF driver
     first_ds = gdal.Open(intersecting_files[0])  # Open the first dataset to derive metadata
     if not first_ds:
         raise FileNotFoundError(f"Could not open file: {intersecting_files[0]}")
 
-    # Extract geotransform and spatial reference
-    geo_transform, spatial_ref = get_raster_geotransform(first_ds)
+    # Align the output grid to the first dataset as seen in the output CRS
+    geo_transform = get_warped_geotransform(first_ds, raster_crs)
     origin_x = geo_transform[0]
     origin_y = geo_transform[3]
-
-    raster_crs = spatial_ref.ExportToWkt()  # Export CRS in WKT format
     # Reproject the input geometry to match the raster CRS
     reprojected_geom = reproject_geometry(input_geom, input_crs, raster_crs)
 
@@ -99,70 +216,454 @@ def create_multi_layer_tif(intersecting_files, output_tif, input_geom, input_crs
     if cols <= 0 or rows <= 0:
         raise ValueError("Calculated dimensions are zero or negative. Check input geometry and alignment.")
 
-    # Print alignment and resolution details
-    print(f"Using resolution: {resolution_x} x {resolution_y}")
-    print(f"Aligned bounds: minx={minx}, maxx={maxx}, miny={miny}, maxy={maxy}")
-    print(f"Calculated dimensions: cols={cols}, rows={rows}")
+    # Log alignment and resolution details
+    logger.info(f"Using resolution: {resolution_x} x {resolution_y}")
+    logger.debug(f"Aligned bounds: minx={minx}, maxx={maxx}, miny={miny}, maxy={maxy}")
+    logger.debug(f"Calculated dimensions: cols={cols}, rows={rows}")
+
+    return {
+        "crs_wkt": raster_crs,
+        "geotransform": (minx, resolution_x, 0, maxy, 0, -resolution_y),
+        "cols": cols,
+        "rows": rows,
+        "bounds": (minx, miny, maxx, maxy),
+        "resolution": (resolution_x, resolution_y),
+    }
+
+# Function to open a dataset, reusing an already open handle if a cache is given
+def open_dataset(file_path, dataset_cache=None):
+    """
+    Open a raster, keeping the handle in dataset_cache (a dict) for later calls.
+
+    file_path may also be a (path, thread id) key, for handles owned by one reading thread.
+    """
+    from osgeo import gdal
+
+    path = file_path[0] if isinstance(file_path, tuple) else file_path
+    if dataset_cache is None:
+        with span("gdal.open", file=path):
+            return gdal.Open(path)
+    if file_path not in dataset_cache:
+        with span("gdal.open", file=path):
+            dataset_cache[file_path] = gdal.Open(path)
+    return dataset_cache[file_path]
+
+# Function to warp all bands of one source onto the output grid
+def warp_source(src_ds, file_path, grid, out=None):
+    """
+    Return (description, nodata, array) for every band of src_ds warped onto the output grid.
+
+    If out is given (a (bands, rows, cols) array), the bands are read straight into it.
+    """
+    from osgeo import gdal
+
+    rows, cols = grid["rows"], grid["cols"]
+    resolution_x, resolution_y = grid["resolution"]
+
+    # Warp only the requested window, directly from the source CRS into the output grid
+    with span("gdal.warp", file=file_path, bands=src_ds.RasterCount, pixels=rows * cols * src_ds.RasterCount):
+        clipped_ds = gdal.Warp(
+            '', src_ds, format='MEM', outputBounds=grid["bounds"],
+            xRes=resolution_x, yRes=resolution_y, dstSRS=grid["crs_wkt"],
+            resampleAlg=gdal.GRA_NearestNeighbour
+        )
+    bands = []
+    for band_idx in range(1, src_ds.RasterCount + 1):
+        buf_obj = out[band_idx - 1] if out is not None else None
+        with span("gdal.read", file=file_path, band=band_idx, pixels=rows * cols) as record:
+            data = clipped_ds.GetRasterBand(band_idx).ReadAsArray(buf_obj=buf_obj)
+            record["bytes"] = data.nbytes
+
+        if data.shape != (rows, cols):
+            raise ValueError(
+                f"Array shape {data.shape} does not match output dimensions ({rows}, {cols})."
+            )
+
+        # Name the band based on source file and band index
+        description = f"Source: {os.path.basename(file_path)}, Band: {band_idx}"
+        bands.append((description, src_ds.GetRasterBand(band_idx).GetNoDataValue(), data))
+    return bands
+
+# Worker: warp a file onto the output grid with a handle of the calling thread
+def warp_file(file_path, grid, out=None, dataset_cache=None):
+    """
+    Same as warp_source, but with a handle owned by the calling thread, so it can run in any thread.
+
+    With dataset_cache, the handle is kept there under (file_path, thread id), so every
+    reading thread opens a file only once across calls that share the cache.
+    """
+    if dataset_cache is None:
+        return warp_source(open_dataset(file_path), file_path, grid, out)
+    return warp_source(open_dataset((file_path, threading.get_ident()), dataset_cache), file_path, grid, out)
+
+# Function to get the shared pool of reading threads
+def get_read_executor(num_threads):
+    with _read_executors_lock:
+        if num_threads not in _read_executors:
+            _read_executors[num_threads] = ThreadPoolExecutor(max_workers=num_threads, thread_name_prefix="read")
+        return _read_executors[num_threads]
+
+# Function to get the number of bytes of a source once warped onto the output grid
+def get_warped_size(src_ds, grid):
+    from osgeo import gdal
+
+    item_size = gdal.GetDataTypeSize(src_ds.GetRasterBand(1).DataType) // 8
+    return src_ds.RasterCount * grid["rows"] * grid["cols"] * item_size
+
+# Function to warp the intersecting files band by band onto a given output grid
+def iter_warped_bands(intersecting_files, grid, dataset_cache=None, num_threads=READ_THREADS, memory_budget=READ_MEMORY_BUDGET):
+    """
+    Yield (description, nodata, array) for every band of every file, warped onto the output grid.
+
+    With num_threads > 1 several files are warped at the same time (GDAL releases the GIL
+    while reading and warping). Bands are still yielded in file order, so the caller stays
+    the single, ordered writer. A file is only started while the warped windows that have
+    not been consumed yet fit into memory_budget bytes; at least one file is always in flight.
+    The reading threads keep their own handles in dataset_cache (see warp_file).
+    """
+    if num_threads <= 1:
+        for intersecting_file in intersecting_files:
+            yield from warp_source(open_dataset(intersecting_file, dataset_cache), intersecting_file, grid)
+        return
+
+    sizes = [get_warped_size(open_dataset(f, dataset_cache), grid) for f in intersecting_files]
+    pending = deque()
+    in_flight = 0
+    next_idx = 0
+    executor = get_read_executor(num_threads)
+    while next_idx < len(intersecting_files) or pending:
+        while next_idx < len(intersecting_files) and (not pending or in_flight + sizes[next_idx] <= memory_budget):
+            future = executor.submit(warp_file, intersecting_files[next_idx], grid, None, dataset_cache)
+            pending.append((sizes[next_idx], future))
+            in_flight += sizes[next_idx]
+            next_idx += 1
+        size, future = pending.popleft()
+        yield from future.result()
+        in_flight -= size
+
+# Function to get the number of output bands and their data type
+def get_band_layout(intersecting_files, dataset_cache=None):
+    """Return the total band count of all files and the smallest data type that holds every band."""
+    from osgeo import gdal
+
+    total_bands = 0
+    data_type = None
+    for intersecting_file in intersecting_files:
+        dataset = open_dataset(intersecting_file, dataset_cache)
+        total_bands += dataset.RasterCount
+        for band_idx in range(1, dataset.RasterCount + 1):
+            band_type = dataset.GetRasterBand(band_idx).DataType
+            data_type = band_type if data_type is None else gdal.DataTypeUnion(data_type, band_type)
+    return total_bands, data_type
+
+# Function to write all bands of the intersecting files on a given output grid
+def write_multi_layer_tif(intersecting_files, output_tif, grid, dataset_cache=None, num_threads=READ_THREADS, memory_budget=READ_MEMORY_BUDGET):
+    """
+    Warp every intersecting file straight onto the output grid and write one multi-layer GeoTIFF.
+
+    Pass the same dataset_cache dict to several calls to share open source handles between outputs.
+    Sources are read by num_threads threads; the output is written from this thread only, in file order.
+    """
+    from osgeo import gdal
+
+    driver = gdal.GetDriverByName("GTiff")  # Get the GeoTIFF driver
 
     # Prepare options for output GeoTIFF
     options = ["COMPRESS=LZW", "BIGTIFF=YES"]
-    total_bands = sum(gdal.Open(f).RasterCount for f in intersecting_files)
+    total_bands, data_type = get_band_layout(intersecting_files, dataset_cache)
 
     # Create the output GeoTIFF
-    output_ds = driver.Create(output_tif, cols, rows, total_bands, first_ds.GetRasterBand(1).DataType, options)
+    output_ds = driver.Create(output_tif, grid["cols"], grid["rows"], total_bands, data_type, options)
     if output_ds is None:
         raise RuntimeError("Failed to create the output GeoTIFF dataset.")
 
     # Set geotransform and projection
-    output_geotransform = (minx, resolution_x, 0, maxy, 0, -resolution_y)
-    output_ds.SetGeoTransform(output_geotransform)
-    output_ds.SetProjection(raster_crs)
+    output_ds.SetGeoTransform(grid["geotransform"])
+    output_ds.SetProjection(grid["crs_wkt"])
+
+    with span("write_multi_layer_tif", file=output_tif, files=len(intersecting_files), bands=total_bands,
+              pixels=grid["rows"] * grid["cols"] * total_bands, threads=num_threads):
+        bands = iter_warped_bands(intersecting_files, grid, dataset_cache, num_threads, memory_budget)
+        for band_idx, (description, _, data) in enumerate(bands, start=1):
+            with span("gdal.write", file=output_tif, band=band_idx, pixels=data.size, bytes=data.nbytes):
+                output_band = output_ds.GetRasterBand(band_idx)
+                output_band.WriteArray(data)
+                output_band.SetDescription(description)
+
+        # Flush and close the output file; pending blocks are compressed here
+        with span("gdal.flush", file=output_tif):
+            output_ds = None
+    logger.info(f"Created multi-layer GeoTIFF: {output_tif}")
+
+# Function to read all bands of the intersecting files on a given output grid into memory
+def read_multi_layer_arrays(intersecting_files, grid, dataset_cache=None, num_threads=READ_THREADS):
+    """
+    Warp every intersecting file onto the output grid and return the bands without writing a file.
+
+    The output array is allocated once and num_threads threads read their sources straight
+    into their own slice of it. With num_threads <= 1 the files are read in the calling thread.
 
+    Returns:
+        dict: data ((bands, rows, cols) NumPy array), geotransform, crs_wkt,
+            band_descriptions and nodata (one value or None per band).
+    """
+    import numpy as np
+    from osgeo import gdal_array
+
+    total_bands, data_type = get_band_layout(intersecting_files, dataset_cache)
+    dtype = gdal_array.GDALTypeCodeToNumericTypeCode(data_type)
+    data = np.empty((total_bands, grid["rows"], grid["cols"]), dtype=dtype)
+
+    # Band slice of the output array for every file
+    slices = []
     band_offset = 0
     for intersecting_file in intersecting_files:
-        src_ds = gdal.Open(intersecting_file)
-        num_bands = src_ds.RasterCount
-        for band_idx in range(1, num_bands + 1):
-            clipped_ds = gdal.Warp(
-                '', src_ds, format='MEM', outputBounds=(minx, miny, maxx, maxy),
-                xRes=resolution_x, yRes=resolution_y, dstSRS=raster_crs,
-                resampleAlg=gdal.GRA_NearestNeighbour
-            )
-            data = clipped_ds.GetRasterBand(band_idx).ReadAsArray()
+        num_bands = open_dataset(intersecting_file, dataset_cache).RasterCount
+        slices.append(data[band_offset:band_offset + num_bands])
+        band_offset += num_bands
 
-            if data.shape != (rows, cols):
-                raise ValueError(
-                    f"Array shape {data.shape} does not match output dimensions ({rows}, {cols})."
-                )
+    caches = [dataset_cache] * len(slices)
+    if num_threads <= 1:
+        file_bands = map(warp_file, intersecting_files, [grid] * len(slices), slices, caches)
+    else:
+        file_bands = get_read_executor(num_threads).map(warp_file, intersecting_files, [grid] * len(slices), slices, caches)
+    bands = [band for bands_of_file in file_bands for band in bands_of_file]
+
+    return {
+        "data": data,
+        "geotransform": grid["geotransform"],
+        "crs_wkt": grid["crs_wkt"],
+        "band_descriptions": [description for description, _, _ in bands],
+        "nodata": [nodata for _, nodata, _ in bands],
+    }
+
+# Function to write an in-memory result as GeoTIFF
+def write_result_tif(result, output_tif):
+    """Write the result of read_multi_layer_arrays or extract_geometry to a GeoTIFF."""
+    from osgeo import gdal, gdal_array
+
+    bands, rows, cols = result["data"].shape
+    data_type = gdal_array.NumericTypeCodeToGDALTypeCode(result["data"].dtype)
+    output_ds = gdal.GetDriverByName("GTiff").Create(output_tif, cols, rows, bands, data_type, ["COMPRESS=LZW", "BIGTIFF=YES"])
+    output_ds.SetGeoTransform(result["geotransform"])
+    output_ds.SetProjection(result["crs_wkt"])
+    for band_idx, description in enumerate(result["band_descriptions"], start=1):
+        output_band = output_ds.GetRasterBand(band_idx)
+        output_band.WriteArray(result["data"][band_idx - 1])
+        output_band.SetDescription(description)
+    output_ds = None
+
+# Function to wrap an in-memory result in an xarray DataArray
+def result_to_xarray(result):
+    """Return the result as xarray.DataArray with band, y and x coordinates; the data is not copied."""
+    import numpy as np
+    import xarray as xr  # Optional dependency, only needed for this sink
+
+    bands, rows, cols = result["data"].shape
+    origin_x, resolution_x, _, origin_y, _, resolution_y = result["geotransform"]
+    return xr.DataArray(
+        result["data"],
+        dims=("band", "y", "x"),
+        coords={
+            "band": result["band_descriptions"],
+            "y": origin_y + (np.arange(rows) + 0.5) * resolution_y,
+            "x": origin_x + (np.arange(cols) + 0.5) * resolution_x,
+        },
+        attrs={"crs_wkt": result["crs_wkt"], "geotransform": list(result["geotransform"]), "nodata": result["nodata"]},
+    )
+
+# Function to put an in-memory result into a rasterio MemoryFile
+def result_to_memfile(result):
+    """Return the result as an uncompressed in-memory GeoTIFF (rasterio.io.MemoryFile) for rasterio-based code."""
+    from rasterio.io import MemoryFile  # Optional dependency, only needed for this sink
+    from rasterio.transform import Affine
+
+    bands, rows, cols = result["data"].shape
+    memfile = MemoryFile()
+    with memfile.open(
+        driver="GTiff", width=cols, height=rows, count=bands, dtype=result["data"].dtype,
+        crs=result["crs_wkt"], transform=Affine.from_gdal(*result["geotransform"])
+    ) as dst:
+        dst.write(result["data"])
+        for band_idx, description in enumerate(result["band_descriptions"], start=1):
+            dst.set_band_description(band_idx, description)
+    return memfile
+
+# Function to resolve the 'UTM' shortcut for the output CRS
+def resolve_target_crs(target_crs, input_geom, input_crs):
+    if target_crs.upper() == "UTM":
+        target_crs = get_utm_crs(input_geom, input_crs)
+        logger.info(f"Using UTM zone {target_crs}")
+    return target_crs
+
+# Function to extract the data of a geometry into memory
+def extract_geometry(intersecting_files, input_geom, input_crs, resolution=None, target_crs="EPSG:4326", resolution_m=None, dataset_cache=None, num_threads=READ_THREADS):
+    """
+    Library entry point: like create_multi_layer_tif, but returns the stacked bands instead of writing a GeoTIFF.
 
-            output_band = output_ds.GetRasterBand(band_offset + band_idx)
-            output_band.WriteArray(data)
+    Use write_result_tif, result_to_xarray or result_to_memfile to hand the result on.
 
-            # Name the band based on source file and band index
-            output_band.SetDescription(f"Source: {os.path.basename(intersecting_file)}, Band: {band_idx}")
-        band_offset += num_bands
+    Returns:
+        dict: See read_multi_layer_arrays.
+    """
+    target_crs = resolve_target_crs(target_crs, input_geom, input_crs)
+    grid = compute_output_grid(intersecting_files, input_geom, input_crs, resolution, target_crs, resolution_m)
+    return read_multi_layer_arrays(intersecting_files, grid, dataset_cache, num_threads)
 
-    print(f"Created multi-layer GeoTIFF: {output_tif}")
+# Function to get the output file name for a CRS
+def get_output_path(output_tif, target_crs):
+    """Output files not in EPSG:4326 get the CRS appended to their name, e.g. intersected_data_EPSG_32633.tif."""
+    if target_crs == "EPSG:4326":
+        return output_tif
+    return output_tif.replace(".tif", f"_{target_crs.replace(':', '_')}.tif")
 
-    if target_crs != "EPSG:4326":
-        print(f"Reprojecting output to {target_crs}...")
-        reprojected_tif = output_tif.replace(".tif", f"_{target_crs.replace(':', '_')}.tif")
-        gdal.Warp(
-            reprojected_tif,
-            output_tif,
-            dstSRS=target_crs,
-            format="GTiff",
-            creationOptions=["COMPRESS=LZW", "BIGTIFF=YES"]
-        )
-        print(f"Reprojected output saved to {reprojected_tif}")
+# Function to create a multi-layer GeoTIFF using intersecting raster files
+def create_multi_layer_tif(intersecting_files, output_tif, input_geom, input_crs, resolution=None, target_crs="EPSG:4326", keep_4326=False, resolution_m=None, num_threads=READ_THREADS):
+    """
+    Create a multi-layer GeoTIFF with intersecting files.
+
+    The output grid is computed directly in target_crs and every source is resampled
+    into it once, so there is no intermediate EPSG:4326 file. An additional EPSG:4326
+    file (also warped directly from the sources) is only written if keep_4326 is set.
+    resolution is given in units of target_crs, resolution_m in meters (see compute_output_grid);
+    the EPSG:4326 copy gets the same pixel size on the ground (see get_4326_resolution).
+    target_crs "UTM" selects the UTM zone of the geometry. Up to num_threads sources are read
+    at the same time.
+
+    Returns:
+        str: Path of the file written in target_crs.
+    """
+    target_crs = resolve_target_crs(target_crs, input_geom, input_crs)
+    with span("compute_output_grid", files=len(intersecting_files), target_crs=target_crs) as record:
+        grid = compute_output_grid(intersecting_files, input_geom, input_crs, resolution, target_crs, resolution_m)
+        record["pixels"] = grid["rows"] * grid["cols"]
+    target_tif = get_output_path(output_tif, target_crs)
+    dataset_cache = {}  # The EPSG:4326 copy reuses the source handles of the first output
+    write_multi_layer_tif(intersecting_files, target_tif, grid, dataset_cache, num_threads)
+
+    if keep_4326 and target_crs != "EPSG:4326":
+        # An explicit resolution is in units of target_crs and is converted for the copy
+        resolution_4326 = get_4326_resolution(grid, input_geom, input_crs) if resolution is not None and resolution_m is None else None
+        grid_4326 = compute_output_grid(intersecting_files, input_geom, input_crs, resolution_4326, "EPSG:4326", resolution_m)
+        write_multi_layer_tif(intersecting_files, output_tif, grid_4326, dataset_cache, num_threads)
+
+    return target_tif
+
+# Function to mosaic the mean bands of the aggregate tiles of every source
+def mosaic_aggregates(results, aggregate_paths):
+    """
+    Replace the aggregate tiles of every table, source and acquisition date in results by
+    one in-memory VRT of their mean bands.
+
+    The tiles of a pyramid level share one grid (see build_pyramid.py), so each source
+    becomes a single mean layer instead of sum, count and mean bands per tile.
+
+    Returns:
+        list: Rows in the format of query_database, with the VRT path in place of the tiles.
+    """
+    from osgeo import gdal
+
+    tiles = defaultdict(list)
+    for row in results:
+        if row[0] in aggregate_paths:
+            tiles[(row[3], row[4], row[5])].append(row[0])
+
+    mosaicked = []
+    emitted = set()
+    for row in results:
+        key = (row[3], row[4], row[5])
+        if row[0] not in aggregate_paths:
+            mosaicked.append(row)
+            continue
+        if key in emitted:
+            continue
+        emitted.add(key)
+        paths = sorted(tiles[key])
+        digest = hashlib.sha1("\n".join(paths).encode()).hexdigest()[:12]
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', f"{row[4]}_{row[5]}")
+        vrt_path = f"/vsimem/aggregates/{name}_mean_{digest}.vrt"
+        if gdal.VSIStatL(vrt_path) is None:
+            vrt = gdal.BuildVRT(vrt_path, paths, bandList=[AGGREGATE_MEAN_BAND], VRTNodata="nan")
+            vrt.GetRasterBand(1).SetDescription("mean")
+            vrt = None
+        mosaicked.append((vrt_path, row[1], row[2], *key))
+    return mosaicked
+
+# Function to query the files to read for a request
+def query_sources(cursor, query_wkt, filters, resolution_m=None):
+    """
+    Query the catalog and, if a resolution in meters is requested, use precomputed
+    aggregate tiles (see build_pyramid.py) instead of full resolution files where possible.
+    The tiles of a source are read as one mosaic of their mean band (see mosaic_aggregates).
+    """
+    results = query_database(cursor, query_wkt, **filters)
+    if resolution_m is not None and results:
+        results, aggregate_paths = substitute_aggregates(cursor, results, query_wkt, resolution_m, **filters)
+        if aggregate_paths:
+            logger.info(f"Using {len(aggregate_paths)} aggregate tiles for the requested resolution of {resolution_m} m")
+            results = mosaic_aggregates(results, aggregate_paths)
+    return results
+
+# Function to create the multi-layer GeoTIFF of a request, reusing cached results
+def cached_create_multi_layer_tif(cursor, cache, input_geom, input_crs, output_tif, resolution=None, target_crs="EPSG:4326", keep_4326=False, resolution_m=None, filters=None, num_threads=READ_THREADS):
+    """
+    Query the catalog and call create_multi_layer_tif, or copy the files of an earlier identical request.
+
+    cache is a query_cache.QueryCache. Entries are reused until catalog rows intersecting the
+    geometry change.
+
+    Returns:
+        tuple: (catalog rows, paths of the written files).
+    """
+    filters = filters or {}
+    key = get_cache_key(
+        input_geom, input_crs, output_name=os.path.basename(output_tif), resolution=resolution,
+        target_crs=target_crs, keep_4326=keep_4326, resolution_m=resolution_m, filters=filters
+    )
+
+    entry = cache.lookup(cursor, key)
+    if entry is not None:
+        written = []
+        for cached_raster in entry["rasters"]:
+            output_path = os.path.join(os.path.dirname(output_tif), os.path.basename(cached_raster))
+            shutil.copyfile(cached_raster, output_path)
+            written.append(output_path)
+        logger.info(f"Copied {len(written)} file(s) from the cache.")
+        return entry["results"], written
+
+    # Taken before the query, so rows changed while processing also invalidate the entry
+    catalog_version = get_catalog_version(cursor)
+    # The catalog footprints are stored in EPSG:4326
+    query_wkt = reproject_geometry(input_geom, input_crs, "EPSG:4326").wkt
+    results = query_sources(cursor, query_wkt, filters, resolution_m)
+    if not results:
+        return results, []
+
+    intersecting_files = [result[0] for result in results]
+    target_tif = create_multi_layer_tif(intersecting_files, output_tif, input_geom, input_crs, resolution, target_crs, keep_4326, resolution_m, num_threads)
+    written = [target_tif]
+    if keep_4326 and target_tif != output_tif:
+        written.append(output_tif)
+    cache.store(key, query_wkt, catalog_version, results, written)
+    return results, written
+
+# Function to print the intersecting files of a query
+def print_results(results):
+    print("The following intersecting files were found:")
+    for file_path, _, native_crs, table_name, source, acquisition_date in results:
+        print(f" - {file_path} ({table_name}, {source}, {acquisition_date:%Y}, {native_crs or 'CRS unknown'})")
 
 # Main function to handle user input, database interaction, and raster processing
 def main():
-    dbname = input("Enter the database name: ") or "bmdata"
-    user = input("Enter the database username: ") or "nkreyenkamp"
-    password = input("Enter the database password (leave blank if not set): ") or None
-    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
-    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+    from shapely.wkt import loads as load_wkt
+
+    catalog_path = input("Enter the path of an embedded catalog file (leave blank to use PostgreSQL): ").strip()
+    if not catalog_path:
+        dbname = input("Enter the database name: ") or "bmdata"
+        user = input("Enter the database username: ") or "nkreyenkamp"
+        password = input("Enter the database password (leave blank if not set): ") or None
+        host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+        port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
 
     geom_wkt = input("Enter the geometry in WKT format: ")  # Input geometry in WKT
     input_geom = load_wkt(geom_wkt)
@@ -172,20 +673,46 @@ def main():
 
     output_tif = os.path.join(output_dir, "intersected_data.tif")  # Output file path
     resolution_input = input("Enter the desired spatial resolution in meters (leave blank for original resolution): ")
-    resolution = float(resolution_input) / 111320.0 if resolution_input else None  # Convert meters to degrees if necessary
-    target_crs = input("Enter the CRS for the output file (default: EPSG:4326): ") or "EPSG:4326"
-
-    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)  # Connect to database
+    resolution_m = float(resolution_input) if resolution_input else None
+    target_crs = input("Enter the CRS for the output file (default: EPSG:4326, 'UTM' for the UTM zone of the geometry): ") or "EPSG:4326"
+    keep_4326 = False
+    if target_crs != "EPSG:4326":
+        keep_4326 = input("Also write an EPSG:4326 copy? (y/N): ").strip().lower() == 'y'
+    num_threads = int(input(f"Enter the number of files to read at the same time (default: {READ_THREADS}): ") or READ_THREADS)
+    cache_dir = None
+    if not catalog_path:  # Invalidation relies on the change log in PostgreSQL
+        cache_dir = input("Enter a cache directory to reuse results of identical earlier requests (leave blank for no cache): ").strip()
+    filters = prompt_filters()
+
+    if catalog_path:
+        conn = EmbeddedCatalog(catalog_path)
+    else:
+        import psycopg2
+        conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)  # Connect to database
     cursor = conn.cursor()
 
+    if cache_dir:
+        results, _ = cached_create_multi_layer_tif(
+            cursor, QueryCache(cache_dir), input_geom, input_crs, output_tif, None,
+            target_crs, keep_4326, resolution_m, filters, num_threads
+        )
+        if results:
+            print_results(results)
+            print("Processing completed.")
+        else:
+            print("No intersecting files found.")
+        cursor.close()
+        conn.close()
+        return
+
     # Query the database for intersecting files
-    results = query_database(cursor, geom_wkt)
+    # The catalog footprints are stored in EPSG:4326
+    query_wkt = reproject_geometry(input_geom, input_crs, "EPSG:4326").wkt if input_crs != "EPSG:4326" else geom_wkt
+    results = query_sources(cursor, query_wkt, filters, resolution_m)
     intersecting_files = [result[0] for result in results]
 
     if intersecting_files:
-        print("The following intersecting files were found:")
-        for file_path in intersecting_files:
-            print(f" - {file_path}")
+        print_results(results)
     else:
         print("No intersecting files found. Exiting.")
         cursor.close()
@@ -193,7 +720,7 @@ def main():
         return
 
     # Process the intersecting files into a multi-layer TIFF
-    create_multi_layer_tif(intersecting_files, output_tif, input_geom, input_crs, resolution, target_crs)
+    create_multi_layer_tif(intersecting_files, output_tif, input_geom, input_crs, None, target_crs, keep_4326, resolution_m, num_threads)
     print("Processing completed.")
 
     cursor.close()
@@ -201,4 +728,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    setup_logging()
+    with profiling():
+        main()
@@ -1,4 +1,9 @@
-import psycopg2
+# Startup matters here, since the script is often run once per point: psycopg2 is only
+# imported when connecting to PostgreSQL, and no raster or projection library is loaded.
+
+from catalog_query import query_point, prompt_filters
+from embedded_catalog import EmbeddedCatalog
+from grid_summary import query_point_summary
 
 # Function to establish a connection to the PostgreSQL database
 def connect_to_db():
@@ -9,6 +14,7 @@ def connect_to_db():
         host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
         port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
 
+        import psycopg2
         conn = psycopg2.connect(
             dbname=dbname,
             user=user,
@@ -23,7 +29,8 @@ def connect_to_db():
 
 # Main function to query for TIFF files based on latitude and longitude
 def main():
-    conn = connect_to_db()
+    catalog_path = input("Enter the path of an embedded catalog file (leave blank to use PostgreSQL): ").strip()
+    conn = EmbeddedCatalog(catalog_path) if catalog_path else connect_to_db()
     if not conn:
         return
     
@@ -39,47 +46,37 @@ def main():
         conn.close()
         return
 
-    # Query for TIFF files in biomass_data table
-    query_biomass = """
-    SELECT 'biomass_data' AS table_name, tif_file_path
-    FROM biomass_data
-    WHERE ST_Intersects(
-        location,
-        ST_SetSRID(ST_Point(%s, %s), 4326)::GEOGRAPHY
-    );
-    """
-
-    # Query for TIFF files in canopy_height_data table
-    query_canopy = """
-    SELECT 'canopy_height_data' AS table_name, tif_file_path
-    FROM canopy_height_data
-    WHERE ST_Intersects(
-        location,
-        ST_SetSRID(ST_Point(%s, %s), 4326)::GEOGRAPHY
-    );
-    """
-
-    # Execute both queries
-    cursor.execute(query_biomass, (longitude, latitude))
-    biomass_results = cursor.fetchall()
+    # Get optional filters
+    filters = prompt_filters()
 
-    cursor.execute(query_canopy, (longitude, latitude))
-    canopy_results = cursor.fetchall()
-
-    # Combine results
-    results = biomass_results + canopy_results
+    # Query both tables for TIFF files containing the point
+    results = query_point(cursor, longitude, latitude, **filters)
 
     # Print the results
     if results:
         print("TIFF file paths containing the specified point:")
-        for row in results:
-            print(f"Table: {row[0]}, TIFF file path: {row[1]}")
+        for file_path, _, _, table_name, source, acquisition_date in results:
+            print(f"Table: {table_name}, Source: {source}, Year: {acquisition_date:%Y}, TIFF file path: {file_path}")
     else:
         print("No TIFF files found for the specified point in either table.")
 
+    # Print the precomputed summaries of the grid cell containing the point, if built
+    summary = query_point_summary(cursor, longitude, latitude, **filters) if results else []
+    if summary:
+        print(f"Summary of the surrounding {summary[0]['cell_size_deg']:g}° cell:")
+        for row in summary:
+            print(
+                f"Table: {row['table_name']}, Source: {row['source']}, Year: {row['year']}, "
+                f"Mean: {row['mean']:.6g}, Min: {row['min']:.6g}, Max: {row['max']:.6g}, Valid pixels: {row['count']}"
+            )
+
     # Close connection
     cursor.close()
     conn.close()
 
 if __name__ == "__main__":
-    main()
+    from instrumentation import setup_logging, profiling
+
+    setup_logging()
+    with profiling():
+        main()
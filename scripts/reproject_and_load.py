@@ -0,0 +1,273 @@
+import os
+import re
+import time
+import logging
+from multiprocessing import Pool
+
+import psycopg2
+from psycopg2.extras import execute_values
+import rasterio
+from shapely.geometry import Polygon
+
+from footprints import get_polygon_in_4326
+from reproject_data import reproject_file, is_complete_output, find_tif_files
+from embedded_catalog import EmbeddedCatalog
+from instrumentation import span, setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+
+# Function to establish a connection to the PostgreSQL database
+def connect_to_db(dbname, user, password, host, port):
+    try:
+        conn = psycopg2.connect(
+            dbname=dbname,
+            user=user,
+            password=password,
+            host=host,
+            port=port
+        )
+        return conn
+    except Exception as e:
+        print(f"Error connecting to the database: {e}")
+        return None
+
+# Function to derive the acquisition year from a folder or file name
+def guess_year_from_path(path):
+    """Return the first year (19xx/20xx) found in the path, preferring whole folder names."""
+    parts = os.path.normpath(path).split(os.sep)
+    for part in reversed(parts[:-1]):
+        if re.fullmatch(r"(19|20)\d{2}", part):
+            return part
+    match = re.search(r"(?<!\d)((?:19|20)\d{2})(?!\d)", parts[-1])
+    return match.group(1) if match else None
+
+# Function to get the bounds of a raster grid in its own CRS
+def get_grid_bounds(geo_transform, width, height):
+    """Return [min_x, min_y, max_x, max_y] of a north-up raster grid."""
+    min_x = geo_transform.c
+    max_y = geo_transform.f
+    max_x = min_x + geo_transform.a * width
+    min_y = max_y + geo_transform.e * height
+    return [min_x, min_y, max_x, max_y]
+
+# Function to build the EPSG:4326 footprint of a raster from its grid
+def get_footprint_wkt(crs, geo_transform, width, height):
+    """Return the footprint of a raster grid as a WKT polygon in EPSG:4326."""
+    min_x, min_y, max_x, max_y = get_grid_bounds(geo_transform, width, height)
+    polygon = Polygon([(min_x, min_y), (min_x, max_y), (max_x, max_y), (max_x, min_y), (min_x, min_y)])
+
+    return get_polygon_in_4326(polygon, crs).wkt
+
+# Worker: reproject one file and describe the result for the catalog
+def reproject_and_describe(task):
+    """
+    Reproject a single GeoTIFF file and return the catalog record of the written file.
+    If target_crs is None the file is catalogued in its native CRS without being rewritten.
+
+    Args:
+        task (tuple): Contains input_path, output_path, target_crs, source, acquisition_year.
+
+    Returns:
+        tuple: (record, message). record is None if the file could not be processed.
+    """
+    input_path, output_path, target_crs, source, acquisition_year = task
+    try:
+        if target_crs is None:
+            with rasterio.open(input_path) as src:
+                geo_transform, width, height = src.transform, src.width, src.height
+                target_crs = src.crs.to_string()
+            output_path = input_path
+            message = f"Described {input_path}"
+        elif os.path.exists(output_path) and is_complete_output(input_path, output_path, target_crs):
+            # Already reprojected in an earlier run, only the header is needed
+            with rasterio.open(output_path) as dst:
+                geo_transform, width, height = dst.transform, dst.width, dst.height
+            message = f"Reused {output_path}"
+        else:
+            with span("reproject", file=input_path, target_crs=target_crs) as record:
+                geo_transform, width, height = reproject_file(input_path, output_path, target_crs)
+                record["pixels"] = width * height
+            message = f"Processed {output_path}"
+
+        footprint = get_footprint_wkt(target_crs, geo_transform, width, height)
+        native_bounds = get_grid_bounds(geo_transform, width, height)
+        record = (footprint, source, f"{acquisition_year}-01-01", output_path, target_crs, native_bounds)
+        return record, message
+    except Exception as e:
+        return None, f"Error processing {input_path}: {e}"
+
+# Function to insert a batch of catalog records
+def write_records(cursor, table_name, records):
+    """Insert catalog records (footprint WKT, source, acquisition date, path, native CRS, native bounds) in one statement."""
+    if hasattr(cursor, "insert_records"):
+        cursor.insert_records(table_name, records)  # Embedded catalog
+        return
+    insert_query = f"""
+    INSERT INTO {table_name} (location, source, acquisition_date, tif_file_path, native_crs, native_bounds)
+    VALUES %s
+    """
+    execute_values(
+        cursor, insert_query, records,
+        template="(ST_GeomFromText(%s, 4326), %s, %s, %s, %s, %s)"
+    )
+
+# Function to list the files that are already in the catalog
+def get_loaded_paths(cursor, table_name):
+    """Return the set of tif_file_path values already present in the table, including tiles merged by compact_tiles.py."""
+    if hasattr(cursor, "get_loaded_paths"):
+        return cursor.get_loaded_paths(table_name)  # Embedded catalog
+    cursor.execute(f"SELECT tif_file_path FROM {table_name}")
+    loaded_paths = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT to_regclass('compaction_members') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute(
+            """
+            SELECT m.tif_file_path FROM compaction_members m
+            JOIN compaction_blocks b ON b.id = m.block_id
+            WHERE b.source_table = %s
+            """,
+            (table_name,)
+        )
+        loaded_paths.update(row[0] for row in cursor.fetchall())
+    return loaded_paths
+
+class BatchedCatalogWriter:
+    """
+    Single writer that collects catalog records and inserts them in batches.
+
+    A batch is committed as soon as it holds batch_size records or the oldest
+    record has waited flush_interval seconds, so finished tiles become
+    queryable while a long run continues. Callbacks passed to add() run only
+    after the batch holding their record was committed.
+    """
+
+    def __init__(self, conn, table_name, batch_size=100, flush_interval=30.0):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batch = []
+        self.on_commit = []
+        self.inserted = 0
+        self.last_flush = time.time()
+
+    def add(self, record, on_commit=None):
+        self.batch.append(record)
+        if on_commit is not None:
+            self.on_commit.append(on_commit)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if len(self.batch) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            with span("db.insert_batch", table=self.table_name, rows=len(self.batch)):
+                write_records(self.cursor, self.table_name, self.batch)
+                self.conn.commit()
+            self.inserted += len(self.batch)
+            logger.info(f"Inserted {len(self.batch)} records into {self.table_name} ({self.inserted} total)")
+        callbacks = self.on_commit
+        self.batch = []
+        self.on_commit = []
+        self.last_flush = time.time()
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        self.flush()
+        self.cursor.close()
+
+def run_pipeline(conn, table_name, tasks, num_workers=4, batch_size=100, flush_interval=30.0):
+    """
+    Reproject files in parallel and stream their footprints into the catalog.
+
+    Workers only reproject and describe their output; all inserts go through this
+    single writer, which commits a batch as soon as it is full or flush_interval
+    seconds have passed, so finished tiles become queryable while the run continues.
+
+    Args:
+        conn: Open psycopg2 connection, or an embedded_catalog.EmbeddedCatalog.
+        table_name (str): Target table (biomass_data or canopy_height_data).
+        tasks (list): Task tuples for reproject_and_describe.
+        num_workers (int): Number of parallel processes to use.
+        batch_size (int): Maximum number of records per insert.
+        flush_interval (float): Maximum number of seconds a record waits before being committed.
+
+    Returns:
+        int: Number of inserted records.
+    """
+    writer = BatchedCatalogWriter(conn, table_name, batch_size, flush_interval)
+    loaded_paths = get_loaded_paths(writer.cursor, table_name)
+    tasks = [task for task in tasks if task[1] not in loaded_paths]
+    total_tasks = len(tasks)
+    print(f"Found {total_tasks} files to process. Starting with {num_workers} workers...")
+
+    with Pool(num_workers) as pool:
+        for done, (record, message) in enumerate(pool.imap_unordered(reproject_and_describe, tasks), start=1):
+            print(f"{done}/{total_tasks}: {message}")
+            if record is not None:
+                writer.add(record)
+            else:
+                writer.flush_if_due()
+    writer.close()
+
+    return writer.inserted
+
+# Main function
+def main():
+    # Get database connection details, or the file of an embedded catalog
+    catalog_path = input("Enter the path of an embedded catalog file to write to (leave blank to use PostgreSQL): ").strip()
+    if not catalog_path:
+        dbname = input("Enter the database name: ")
+        user = input("Enter the database username: ")
+        password = input("Enter the database password (leave blank if not set): ") or None
+        host = input("Enter the database host (default: localhost): ") or "localhost"
+        port = input("Enter the database port (default: 5432): ") or "5432"
+
+    # Get input and output locations
+    base_dir = input("Enter the path to the input folder containing GeoTIFF files: ").strip()
+    output_base_dir = input("Enter the path to the output folder for reprojected files: ").strip()
+    if not os.path.isdir(base_dir):
+        print(f"Folder {base_dir} does not exist.")
+        return
+    os.makedirs(output_base_dir, exist_ok=True)
+
+    # Get table name
+    table_name = input("Enter the target table (biomass_data or canopy_height_data): ").strip()
+    if table_name not in ['biomass_data', 'canopy_height_data']:
+        print("Invalid table name. Please enter 'biomass_data' or 'canopy_height_data'.")
+        return
+
+    # Get source and acquisition year
+    source = input("Enter the source name: ")
+    acquisition_year = input("Enter the acquisition year (leave blank to take it from the folder or file names): ").strip()
+    num_workers = int(input("Enter the number of workers (default: 8): ") or 8)
+    target_crs = "EPSG:4326"  # Target CRS is hardcoded to WGS84
+
+    tasks = []
+    for input_path, output_path in find_tif_files(base_dir, output_base_dir):
+        year = acquisition_year or guess_year_from_path(os.path.relpath(input_path, base_dir))
+        if not year:
+            print(f"Skipping {input_path}: could not determine the acquisition year.")
+            continue
+        tasks.append((input_path, output_path, target_crs, source, year))
+
+    # Connect to the database
+    conn = EmbeddedCatalog(catalog_path) if catalog_path else connect_to_db(dbname, user, password, host, port)
+    if not conn:
+        return
+
+    start_time = time.time()
+    inserted = run_pipeline(conn, table_name, tasks, num_workers)
+    conn.close()
+
+    print(f"Data loading completed. Inserted {inserted} records in {time.time() - start_time:.2f} seconds")
+
+if __name__ == '__main__':
+    setup_logging()
+    with profiling():
+        main()
@@ -1,42 +1,45 @@
 import os
 import rasterio
+from rasterio.errors import RasterioError
 from rasterio.warp import calculate_default_transform, reproject, Resampling
+from rasterio.windows import Window
 from multiprocessing import Pool, Manager, Lock
 import time
 
 
-def reproject_tif(input_output):
+def reproject_file(input_path, output_path, target_crs):
     """
     Reproject a single GeoTIFF file to the target CRS with LZW compression and BIGTIFF support,
     while preserving band names.
-    
+
+    The file is written to output_path + '.tmp' and only renamed to output_path once it is
+    closed, so an interrupted run never leaves a truncated file under output_path.
+
     Args:
-        input_output (tuple): Contains input_path, output_path, target_crs, counter, total_tasks, lock.
+        input_path (str): Path to the source GeoTIFF file.
+        output_path (str): Path of the reprojected GeoTIFF file to write.
+        target_crs (str): Target CRS in EPSG format.
+
+    Returns:
+        tuple: (transform, width, height) of the written file.
     """
-    input_path, output_path, target_crs, counter, total_tasks, lock = input_output
-    
-    if os.path.exists(output_path):
-        with lock:
-            counter.value += 1
-            print(f"Skipped {counter.value}/{total_tasks}: {output_path} already exists.")
-        return
+    with rasterio.open(input_path) as src:
+        transform, width, height = calculate_default_transform(
+            src.crs, target_crs, src.width, src.height, *src.bounds
+        )
+        kwargs = src.meta.copy()
+        kwargs.update({
+            'crs': target_crs,
+            'transform': transform,
+            'width': width,
+            'height': height,
+            'compress': 'LZW',  # Add LZW compression
+            'BIGTIFF': 'YES'    # Enable BigTIFF support
+        })
 
-    try:
-        with rasterio.open(input_path) as src:
-            transform, width, height = calculate_default_transform(
-                src.crs, target_crs, src.width, src.height, *src.bounds
-            )
-            kwargs = src.meta.copy()
-            kwargs.update({
-                'crs': target_crs,
-                'transform': transform,
-                'width': width,
-                'height': height,
-                'compress': 'LZW',  # Add LZW compression
-                'BIGTIFF': 'YES'    # Enable BigTIFF support
-            })
-            
-            with rasterio.open(output_path, 'w', **kwargs) as dst:
+        tmp_path = output_path + ".tmp"
+        try:
+            with rasterio.open(tmp_path, 'w', **kwargs) as dst:
                 for i in range(1, src.count + 1):
                     # Reproject the band data
                     reproject(
@@ -52,6 +55,54 @@ def reproject_tif(input_output):
                     band_name = src.descriptions[i - 1]
                     if band_name:
                         dst.set_band_description(i, band_name)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, output_path)
+
+    return transform, width, height
+
+
+def is_complete_output(input_path, output_path, target_crs):
+    """
+    Check a reprojected file left by an earlier run before it is reused.
+
+    The file must open, have the size the reprojection of input_path would have, and its
+    last row must be readable (files cut off while being written fail here).
+
+    Returns:
+        bool: True if output_path can be reused.
+    """
+    try:
+        with rasterio.open(input_path) as src:
+            _, width, height = calculate_default_transform(src.crs, target_crs, src.width, src.height, *src.bounds)
+        with rasterio.open(output_path) as dst:
+            if (dst.width, dst.height) != (width, height):
+                return False
+            dst.read(dst.count, window=Window(0, height - 1, width, 1))
+        return True
+    except (RasterioError, OSError):
+        return False
+
+
+def reproject_tif(input_output):
+    """
+    Reproject a single GeoTIFF file and report progress through the shared counter.
+    
+    Args:
+        input_output (tuple): Contains input_path, output_path, target_crs, counter, total_tasks, lock.
+    """
+    input_path, output_path, target_crs, counter, total_tasks, lock = input_output
+    
+    if os.path.exists(output_path) and is_complete_output(input_path, output_path, target_crs):
+        with lock:
+            counter.value += 1
+            print(f"Skipped {counter.value}/{total_tasks}: {output_path} already exists.")
+        return
+
+    try:
+        reproject_file(input_path, output_path, target_crs)
         
         # Update the progress counter safely using the lock
         with lock:
@@ -62,18 +113,19 @@ def reproject_tif(input_output):
         print(f"Error processing {input_path}: {e}")
 
 
-def process_directory_parallel(base_dir, output_base_dir, target_crs="EPSG:4326", num_workers=4):
+def find_tif_files(base_dir, output_base_dir):
     """
-    Reproject all .tif files in a directory structure to a target CRS in parallel with LZW compression.
-    Skips files that are already processed and preserves band names.
-    
+    Collect all .tif files below base_dir together with their mirrored output path.
+    Output subdirectories are created on the way.
+
     Args:
         base_dir (str): Path to the base directory containing GeoTIFF files.
         output_base_dir (str): Path to the base directory for reprojected and compressed files.
-        target_crs (str): Target CRS in EPSG format.
-        num_workers (int): Number of parallel processes to use.
+
+    Returns:
+        list: (input_path, output_path) tuples.
     """
-    tasks = []
+    pairs = []
     for root, _, files in os.walk(base_dir):
         for file in files:
             if file.endswith('.tif') and not file.endswith('.aux.xml'):
@@ -82,7 +134,22 @@ def process_directory_parallel(base_dir, output_base_dir, target_crs="EPSG:4326"
                 output_dir = os.path.join(output_base_dir, relative_path)
                 os.makedirs(output_dir, exist_ok=True)
                 output_path = os.path.join(output_dir, file)
-                tasks.append((input_path, output_path, target_crs))
+                pairs.append((input_path, output_path))
+    return pairs
+
+
+def process_directory_parallel(base_dir, output_base_dir, target_crs="EPSG:4326", num_workers=4):
+    """
+    Reproject all .tif files in a directory structure to a target CRS in parallel with LZW compression.
+    Skips files that are already processed and preserves band names.
+    
+    Args:
+        base_dir (str): Path to the base directory containing GeoTIFF files.
+        output_base_dir (str): Path to the base directory for reprojected and compressed files.
+        target_crs (str): Target CRS in EPSG format.
+        num_workers (int): Number of parallel processes to use.
+    """
+    tasks = [(input_path, output_path, target_crs) for input_path, output_path in find_tif_files(base_dir, output_base_dir)]
     
     total_tasks = len(tasks)
     print(f"Found {total_tasks} files to process. Starting with {num_workers} workers...")
@@ -24,6 +24,13 @@ CREATE TABLE IF NOT EXISTS canopy_height_data (
     tif_file_path TEXT NOT NULL
 );
 
+-- Native CRS and bounds of the file at tif_file_path, so sources can stay in
+-- their original projection and be warped per query
+ALTER TABLE biomass_data ADD COLUMN IF NOT EXISTS native_crs TEXT;
+ALTER TABLE biomass_data ADD COLUMN IF NOT EXISTS native_bounds DOUBLE PRECISION[];
+ALTER TABLE canopy_height_data ADD COLUMN IF NOT EXISTS native_crs TEXT;
+ALTER TABLE canopy_height_data ADD COLUMN IF NOT EXISTS native_bounds DOUBLE PRECISION[];
+
 -- Create spatial indexes
 CREATE INDEX IF NOT EXISTS idx_biomass_data_location
     ON biomass_data USING GIST(location);
@@ -32,6 +39,215 @@ CREATE INDEX IF NOT EXISTS idx_canopy_height_data_location
     ON canopy_height_data USING GIST(location);
 """
 
+# Alternative schema with both tables partitioned by acquisition year. Queries that
+# filter on acquisition_date only scan the matching yearly partitions, and every
+# partition gets its own GIST index through the index on the parent table.
+PARTITIONED_SCHEMA_SQL = """
+-- Enable PostGIS extension
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+-- Create biomass_data table
+CREATE TABLE IF NOT EXISTS biomass_data (
+    id SERIAL,
+    location GEOMETRY(POLYGON, 4326) NOT NULL,
+    source VARCHAR(255) NOT NULL,
+    acquisition_date DATE NOT NULL,
+    tif_file_path TEXT NOT NULL,
+    native_crs TEXT,
+    native_bounds DOUBLE PRECISION[],
+    PRIMARY KEY (id, acquisition_date)
+) PARTITION BY RANGE (acquisition_date);
+
+-- Create canopy_height_data table
+CREATE TABLE IF NOT EXISTS canopy_height_data (
+    id SERIAL,
+    location GEOMETRY(POLYGON, 4326) NOT NULL,
+    source VARCHAR(255) NOT NULL,
+    acquisition_date DATE NOT NULL,
+    tif_file_path TEXT NOT NULL,
+    native_crs TEXT,
+    native_bounds DOUBLE PRECISION[],
+    PRIMARY KEY (id, acquisition_date)
+) PARTITION BY RANGE (acquisition_date);
+
+-- Catch-all partitions for years without their own partition
+CREATE TABLE IF NOT EXISTS biomass_data_default PARTITION OF biomass_data DEFAULT;
+CREATE TABLE IF NOT EXISTS canopy_height_data_default PARTITION OF canopy_height_data DEFAULT;
+
+-- Create one partition per year, e.g. SELECT create_year_partitions('biomass_data', 2024, 2026);
+CREATE OR REPLACE FUNCTION create_year_partitions(parent TEXT, first_year INT, last_year INT)
+RETURNS void AS $$
+BEGIN
+    FOR y IN first_year..last_year LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            parent || '_' || y, parent, make_date(y, 1, 1), make_date(y + 1, 1, 1)
+        );
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create spatial indexes (created on every partition)
+CREATE INDEX IF NOT EXISTS idx_biomass_data_location
+    ON biomass_data USING GIST(location);
+
+CREATE INDEX IF NOT EXISTS idx_canopy_height_data_location
+    ON canopy_height_data USING GIST(location);
+
+-- Create source indexes for source-filtered queries
+CREATE INDEX IF NOT EXISTS idx_biomass_data_source
+    ON biomass_data (source);
+
+CREATE INDEX IF NOT EXISTS idx_canopy_height_data_source
+    ON canopy_height_data (source);
+"""
+
+# Log of changed footprints, shared by both schemas. Every insert, update or delete on the
+# catalog tables (and on aggregate_data, see AGGREGATE_SCHEMA_SQL) records the affected
+# footprint and the id of the writing transaction, so cached query results and exported
+# items covering it can be refreshed (see query_cache.py). Readers compare transaction ids,
+# not change_id: a change_id is drawn when the row is written, so a transaction that
+# commits late can add ids below a version that was already read.
+CHANGE_LOG_SQL = """
+CREATE TABLE IF NOT EXISTS catalog_changes (
+    change_id BIGSERIAL PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    location GEOMETRY(POLYGON, 4326) NOT NULL,
+    changed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    xact_id BIGINT NOT NULL DEFAULT txid_current()
+);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_changes_location
+    ON catalog_changes USING GIST(location);
+
+CREATE INDEX IF NOT EXISTS idx_catalog_changes_xact_id
+    ON catalog_changes (xact_id);
+
+CREATE OR REPLACE FUNCTION log_catalog_change()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO catalog_changes (table_name, location) VALUES (TG_TABLE_NAME, OLD.location);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO catalog_changes (table_name, location) VALUES (TG_TABLE_NAME, NEW.location);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS biomass_data_changes ON biomass_data;
+CREATE TRIGGER biomass_data_changes
+    AFTER INSERT OR UPDATE OR DELETE ON biomass_data
+    FOR EACH ROW EXECUTE FUNCTION log_catalog_change();
+
+DROP TRIGGER IF EXISTS canopy_height_data_changes ON canopy_height_data;
+CREATE TRIGGER canopy_height_data_changes
+    AFTER INSERT OR UPDATE OR DELETE ON canopy_height_data
+    FOR EACH ROW EXECUTE FUNCTION log_catalog_change();
+"""
+
+# One view over both catalog tables, shared by both schemas. UNION ALL keeps it a plain
+# append, so filters on the view (including the spatial ones) are pushed down into
+# each table and use its GIST index, and table_name tells where a row came from.
+CATALOG_VIEW_SQL = """
+CREATE OR REPLACE VIEW catalog AS
+    SELECT 'biomass_data'::text AS table_name, id, location, source, acquisition_date,
+           tif_file_path, native_crs, native_bounds
+    FROM biomass_data
+    UNION ALL
+    SELECT 'canopy_height_data'::text AS table_name, id, location, source, acquisition_date,
+           tif_file_path, native_crs, native_bounds
+    FROM canopy_height_data;
+"""
+
+# Precomputed aggregate tiles (sum, count and mean of the source pixels) at coarser
+# resolutions, written by build_pyramid.py. Kept apart from the source tables, so
+# aggregates are only used where a query asks for a coarse resolution.
+AGGREGATE_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS aggregate_data (
+    id SERIAL PRIMARY KEY,
+    location GEOMETRY(POLYGON, 4326) NOT NULL,
+    source_table TEXT NOT NULL,
+    source VARCHAR(255) NOT NULL,
+    acquisition_date DATE NOT NULL,
+    resolution_m DOUBLE PRECISION NOT NULL,
+    tif_file_path TEXT NOT NULL,
+    native_crs TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_aggregate_data_location
+    ON aggregate_data USING GIST(location);
+
+CREATE INDEX IF NOT EXISTS idx_aggregate_data_level
+    ON aggregate_data (source_table, source, acquisition_date, resolution_m);
+
+-- Rebuilt aggregate tiles invalidate cached query results like catalog changes
+DROP TRIGGER IF EXISTS aggregate_data_changes ON aggregate_data;
+CREATE TRIGGER aggregate_data_changes
+    AFTER INSERT OR UPDATE OR DELETE ON aggregate_data
+    FOR EACH ROW EXECUTE FUNCTION log_catalog_change();
+"""
+
+GRID_SUMMARY_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS grid_summary (
+    cells_per_degree INTEGER NOT NULL,
+    cell_x INTEGER NOT NULL,
+    cell_y INTEGER NOT NULL,
+    source_table TEXT NOT NULL,
+    source VARCHAR(255) NOT NULL,
+    year INTEGER NOT NULL,
+    pixel_count BIGINT NOT NULL,
+    pixel_sum DOUBLE PRECISION NOT NULL,
+    pixel_min DOUBLE PRECISION NOT NULL,
+    pixel_max DOUBLE PRECISION NOT NULL,
+    pixel_mean DOUBLE PRECISION NOT NULL,
+    cell GEOMETRY(POLYGON, 4326) NOT NULL,
+    PRIMARY KEY (cells_per_degree, cell_x, cell_y, source_table, source, year)
+);
+
+CREATE INDEX IF NOT EXISTS idx_grid_summary_cell
+    ON grid_summary USING GIST(cell);
+
+CREATE INDEX IF NOT EXISTS idx_grid_summary_source
+    ON grid_summary (source_table, source, year);
+"""
+
+# Lineage of the blocks written by compact_tiles.py: every block replaces the catalog rows
+# of its member tiles, which are kept here with their original values.
+COMPACTION_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS compaction_blocks (
+    id SERIAL PRIMARY KEY,
+    source_table TEXT NOT NULL,
+    source VARCHAR(255) NOT NULL,
+    year INTEGER NOT NULL,
+    grid_key TEXT NOT NULL,
+    block_x INTEGER NOT NULL,
+    block_y INTEGER NOT NULL,
+    tif_file_path TEXT NOT NULL,
+    built_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    UNIQUE (source_table, source, year, grid_key, block_x, block_y)
+);
+
+CREATE INDEX IF NOT EXISTS idx_compaction_blocks_path
+    ON compaction_blocks (tif_file_path);
+
+CREATE TABLE IF NOT EXISTS compaction_members (
+    block_id INTEGER NOT NULL REFERENCES compaction_blocks(id) ON DELETE CASCADE,
+    tif_file_path TEXT NOT NULL,
+    location GEOMETRY(POLYGON, 4326) NOT NULL,
+    acquisition_date DATE NOT NULL,
+    native_crs TEXT,
+    native_bounds DOUBLE PRECISION[],
+    file_size BIGINT NOT NULL,
+    file_mtime DOUBLE PRECISION NOT NULL,
+    PRIMARY KEY (block_id, tif_file_path)
+);
+
+CREATE INDEX IF NOT EXISTS idx_compaction_members_path
+    ON compaction_members (tif_file_path);
+"""
+
 def get_db_config():
     """Prompt the user for database connection parameters."""
     dbname = input("Enter the default database name to connect to (leave blank for default: postgres): ") or "postgres"
@@ -70,8 +286,13 @@ def create_database(config, target_db):
     except Exception as e:
         print(f"Error creating database: {e}")
 
-def apply_schema(config, target_db):
-    """Apply the schema to the target database."""
+def apply_schema(config, target_db, partition_years=None):
+    """
+    Apply the schema to the target database.
+
+    If partition_years is given as (first_year, last_year), the partitioned schema is
+    created with one partition per year in that range.
+    """
     try:
         # Update config to connect to the target database
         db_config = config.copy()
@@ -82,7 +303,17 @@ def apply_schema(config, target_db):
         cursor = conn.cursor()
 
         # Execute the schema SQL commands
-        cursor.execute(SCHEMA_SQL)
+        if partition_years is None:
+            cursor.execute(SCHEMA_SQL)
+        else:
+            cursor.execute(PARTITIONED_SCHEMA_SQL)
+            for table_name in ['biomass_data', 'canopy_height_data']:
+                cursor.execute("SELECT create_year_partitions(%s, %s, %s)", (table_name, *partition_years))
+        cursor.execute(CHANGE_LOG_SQL)
+        cursor.execute(CATALOG_VIEW_SQL)
+        cursor.execute(AGGREGATE_SCHEMA_SQL)
+        cursor.execute(GRID_SUMMARY_SCHEMA_SQL)
+        cursor.execute(COMPACTION_SCHEMA_SQL)
         print(f"Schema applied successfully to the database '{target_db}'.")
         
         conn.commit()
@@ -98,8 +329,15 @@ if __name__ == "__main__":
     # Step 2: Prompt for the target database name
     target_db = input("Enter the target database name to create: ")
 
-    # Step 3: Create the database
+    # Step 3: Ask whether the tables should be partitioned by acquisition year
+    partition_years = None
+    if input("Partition the tables by acquisition year? (y/N): ").strip().lower() == 'y':
+        first_year = int(input("Enter the first year to create a partition for (default: 2015): ") or 2015)
+        last_year = int(input("Enter the last year to create a partition for (default: 2030): ") or 2030)
+        partition_years = (first_year, last_year)
+
+    # Step 4: Create the database
     create_database(db_config, target_db)
 
-    # Step 4: Apply the schema
-    apply_schema(db_config, target_db)
+    # Step 5: Apply the schema
+    apply_schema(db_config, target_db, partition_years)
@@ -0,0 +1,118 @@
+# Search of a static STAC catalog written by export_stac.py, without a database. Only
+# needs shapely, so the export can be shared with anyone who can read the directory.
+
+import os
+import json
+import bisect
+
+from shapely.geometry import box, shape
+from shapely.strtree import STRtree
+from shapely.wkt import loads as load_wkt
+
+INDEX_FILE = "index.json"
+
+# Function to read the index of an exported catalog
+def load_index(catalog_dir):
+    """Return the parsed index.json of an export, or None if there is none."""
+    try:
+        with open(os.path.join(catalog_dir, INDEX_FILE), "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+class StacSearch:
+    """
+    Spatial and temporal index over an exported STAC catalog.
+
+    Item bounding boxes go into an STRtree and item dates into a sorted list, both built
+    from index.json only. Item files are read just for the candidates of a search, to test
+    their footprint exactly.
+    """
+
+    def __init__(self, catalog_dir):
+        self.catalog_dir = catalog_dir
+        index = load_index(catalog_dir)
+        if index is None:
+            raise FileNotFoundError(f"No {INDEX_FILE} found in {catalog_dir}")
+        self.entries = list(index["items"].values())
+        self.tree = STRtree([box(*entry["bbox"]) for entry in self.entries])
+        self.by_datetime = sorted((entry["datetime"], i) for i, entry in enumerate(self.entries))
+        self.datetimes = [value for value, _ in self.by_datetime]
+
+    def read_item(self, entry):
+        with open(os.path.join(self.catalog_dir, entry["href"]), "r") as file:
+            return json.load(file)
+
+    def search(self, intersects=None, bbox=None, datetime=None, sources=None, tables=None, limit=None):
+        """
+        Return the items matching all given filters, newest first.
+
+        Args:
+            intersects: Geometry in EPSG:4326, as shapely geometry, WKT or GeoJSON dict.
+            bbox (list): [minx, miny, maxx, maxy] in EPSG:4326.
+            datetime (tuple): (start, end) as ISO dates or datetimes; either may be None for an open range.
+            sources (list): Sources to include.
+            tables (list): Catalog tables to include.
+            limit (int): Maximum number of items.
+
+        Returns:
+            list: STAC items as dicts.
+        """
+        if isinstance(intersects, str):
+            intersects = load_wkt(intersects)
+        elif isinstance(intersects, dict):
+            intersects = shape(intersects)
+        if bbox is not None:
+            intersects = box(*bbox) if intersects is None else intersects.intersection(box(*bbox))
+
+        candidates = None
+        if intersects is not None:
+            candidates = set(self.tree.query(intersects).tolist())
+        if datetime is not None:
+            start, end = datetime
+            lower = bisect.bisect_left(self.datetimes, start) if start else 0
+            # A bare end date includes the whole day
+            upper = bisect.bisect_right(self.datetimes, end + ("T23:59:59Z" if end and len(end) == 10 else "")) if end else len(self.datetimes)
+            in_range = {i for _, i in self.by_datetime[lower:upper]}
+            candidates = in_range if candidates is None else candidates & in_range
+        if candidates is None:
+            candidates = range(len(self.entries))
+
+        entries = [
+            self.entries[i] for i in candidates
+            if (not sources or self.entries[i]["source"] in sources)
+            and (not tables or self.entries[i]["table_name"] in tables)
+        ]
+        entries.sort(key=lambda entry: (entry["datetime"], entry["href"]), reverse=True)
+
+        items = []
+        for entry in entries:
+            item = self.read_item(entry)
+            if intersects is not None and not shape(item["geometry"]).intersects(intersects):
+                continue
+            items.append(item)
+            if limit is not None and len(items) >= limit:
+                break
+        return items
+
+def main():
+    catalog_dir = input("Enter the directory of the exported STAC catalog: ").strip()
+    geom_input = input("Enter the search geometry in WKT format (EPSG:4326, leave blank for everywhere): ").strip()
+    start = input("Enter the first date (YYYY-MM-DD, leave blank for no limit): ").strip() or None
+    end = input("Enter the last date (YYYY-MM-DD, leave blank for no limit): ").strip() or None
+    source_input = input("Enter sources to include separated by commas (leave blank for all): ").strip()
+    sources = [source.strip() for source in source_input.split(',')] if source_input else None
+
+    items = StacSearch(catalog_dir).search(
+        intersects=geom_input or None,
+        datetime=(start, end) if start or end else None,
+        sources=sources,
+    )
+    if not items:
+        print("No items found.")
+        return
+    for item in items:
+        print(f"{item['id']}, {item['properties']['source']}, {item['properties']['datetime'][:10]}: {item['assets']['data']['href']}")
+
+if __name__ == "__main__":
+    main()
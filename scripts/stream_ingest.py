@@ -0,0 +1,274 @@
+import os
+import queue
+import logging
+import threading
+import time
+from multiprocessing import Pool
+
+from reproject_and_load import (
+    connect_to_db, guess_year_from_path, reproject_and_describe,
+    get_loaded_paths, BatchedCatalogWriter
+)
+from embedded_catalog import EmbeddedCatalog
+from instrumentation import setup_logging, profiling
+
+logger = logging.getLogger(__name__)
+
+
+# Function to list the GeoTIFF files that are already complete
+def find_complete_files(base_dir):
+    """Return all .tif files below base_dir (partial downloads end with .part and are ignored)."""
+    paths = []
+    for root, _, files in os.walk(base_dir):
+        for file in files:
+            if file.endswith('.tif'):
+                paths.append(os.path.join(root, file))
+    return sorted(paths)
+
+# Function to watch a download directory for completed files
+def watch_directory(base_dir, file_queue, stop_event, poll_interval=10.0, idle_timeout=None):
+    """
+    Put every .tif below base_dir into file_queue once it looks complete.
+
+    A file counts as complete when its size and modification time did not change
+    between two polls, which also covers downloaders that write in place. A None
+    sentinel is queued when stop_event is set or no new file showed up for
+    idle_timeout seconds.
+    """
+    last_seen = {}
+    queued = set()
+    last_new_file = time.time()
+    while not stop_event.is_set():
+        for path in find_complete_files(base_dir):
+            if path in queued:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if last_seen.get(path) == signature:
+                queued.add(path)
+                file_queue.put(path)
+                last_new_file = time.time()
+            else:
+                last_seen[path] = signature
+                last_new_file = time.time()
+
+        if idle_timeout is not None and time.time() - last_new_file > idle_timeout:
+            print(f"No new files for {idle_timeout:.0f} seconds, stopping the watcher.")
+            break
+        stop_event.wait(poll_interval)
+    file_queue.put(None)
+
+def ingest_stream(conn, table_name, file_queue, base_dir, output_base_dir, source, acquisition_year=None,
+                  target_crs="EPSG:4326", num_workers=4, delete_raw=False, batch_size=100, flush_interval=30.0):
+    """
+    Reproject and catalogue files as soon as they arrive in file_queue.
+
+    Every path taken from the queue is reprojected by a worker process (or only described
+    if target_crs is None), and its record goes through one batched writer. The function
+    returns when a None sentinel was received and all submitted files are done.
+
+    Args:
+        conn: Open psycopg2 connection.
+        table_name (str): Target table (biomass_data or canopy_height_data).
+        file_queue (queue.Queue): Paths of completed files below base_dir, ended by None.
+        base_dir (str): Download directory the queued paths belong to.
+        output_base_dir (str): Directory for the reprojected files (mirrors base_dir).
+        source (str): Source name stored in the catalog.
+        acquisition_year (str): Acquisition year, or None to take it from the path.
+        target_crs (str): CRS to reproject to, or None to catalogue files in their native CRS.
+        num_workers (int): Number of parallel processes to use.
+        delete_raw (bool): Delete each input file once the batch holding its record is committed.
+        batch_size (int): Maximum number of records per insert.
+        flush_interval (float): Maximum number of seconds a record waits before being committed.
+
+    Returns:
+        int: Number of inserted records.
+    """
+    writer = BatchedCatalogWriter(conn, table_name, batch_size, flush_interval)
+    loaded_paths = get_loaded_paths(writer.cursor, table_name)
+    results = queue.Queue()
+    added_paths = set()  # Output paths whose records were written in this run
+    in_flight = set()  # Output paths of the submitted tasks
+    waiting = {}  # Output path -> input paths queued again while their task was running
+    retries = []  # Input paths to submit before reading the queue again
+    pending = 0
+    finished = False
+
+    def remove_raw(input_path, output_path):
+        if delete_raw and target_crs is not None and input_path != output_path:
+            os.remove(input_path)
+            logger.info(f"Deleted raw file {input_path}")
+
+    try:
+        with Pool(num_workers) as pool:
+            while True:
+                # Collect the files the workers finished in the meantime
+                while True:
+                    try:
+                        input_path, output_path, (record, message) = results.get_nowait()
+                    except queue.Empty:
+                        break
+                    pending -= 1
+                    in_flight.discard(output_path)
+                    logger.info(message)
+                    if record is not None:
+                        # Only a written record marks the file as loaded; a crash before the
+                        # commit must leave the raw file for the next run
+                        loaded_paths.add(output_path)
+                        added_paths.add(output_path)
+                        writer.add(record, on_commit=lambda i=input_path, o=output_path: remove_raw(i, o))
+                        waiting.pop(output_path, None)
+                    else:
+                        # A failed file can be queued again; copies queued while it ran are retried
+                        retries.extend(waiting.pop(output_path, []))
+                writer.flush_if_due()
+
+                if finished and pending == 0 and not retries:
+                    break
+
+                if retries:
+                    input_path = retries.pop(0)
+                else:
+                    try:
+                        input_path = file_queue.get(timeout=1.0)
+                    except queue.Empty:
+                        continue
+                    if input_path is None:
+                        finished = True
+                        continue
+
+                relative_path = os.path.relpath(input_path, base_dir)
+                year = acquisition_year or guess_year_from_path(relative_path)
+                if not year:
+                    logger.warning(f"Skipping {input_path}: could not determine the acquisition year.")
+                    continue
+                if target_crs is None:
+                    output_path = input_path
+                else:
+                    output_path = os.path.join(output_base_dir, relative_path)
+                    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                if output_path in loaded_paths:
+                    if output_path not in added_paths:
+                        remove_raw(input_path, output_path)  # Files added in this run are removed once committed
+                    continue
+                if output_path in in_flight:
+                    waiting.setdefault(output_path, []).append(input_path)
+                    continue
+
+                task = (input_path, output_path, target_crs, source, year)
+                pool.apply_async(
+                    reproject_and_describe, (task,),
+                    callback=lambda result, i=input_path, o=output_path: results.put((i, o, result)),
+                    error_callback=lambda e, i=input_path, o=output_path: results.put((i, o, (None, f"Error processing {i}: {e}")))
+                )
+                in_flight.add(output_path)
+                pending += 1
+    finally:
+        writer.close()
+
+    return writer.inserted
+
+# Function to feed the AGB China downloader into the ingest queue
+def start_agb_china_download(file_queue, base_dir, output_base_dir, max_connections):
+    """Download AGB China in a background thread and queue every file once it is verified, including files that were already complete."""
+    from download_AGB_China import read_urls, plan_download, download_all
+
+    # Files that were already converted (and possibly deleted) are not downloaded again
+    urls = []
+    for url in read_urls():
+        task = plan_download(url, base_dir)
+        if task is None:
+            continue
+        if output_base_dir:
+            output_path = os.path.join(output_base_dir, os.path.relpath(task[1], base_dir))
+            if os.path.exists(output_path):
+                continue
+        urls.append(url)
+
+    def run():
+        try:
+            download_all(urls, base_dir, max_connections, on_complete=file_queue.put)
+        finally:
+            file_queue.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+# Main function
+def main():
+    # Get database connection details, or the file of an embedded catalog
+    catalog_path = input("Enter the path of an embedded catalog file to write to (leave blank to use PostgreSQL): ").strip()
+    if not catalog_path:
+        dbname = input("Enter the database name: ")
+        user = input("Enter the database username: ")
+        password = input("Enter the database password (leave blank if not set): ") or None
+        host = input("Enter the database host (default: localhost): ") or "localhost"
+        port = input("Enter the database port (default: 5432): ") or "5432"
+
+    mode = input("Enter 'watch' to watch a download folder or 'agb_china' to download AGB China directly (default: watch): ").strip() or "watch"
+    if mode not in ['watch', 'agb_china']:
+        print("Invalid mode. Please enter 'watch' or 'agb_china'.")
+        return
+
+    base_dir = input("Enter the download folder: ").strip()
+    os.makedirs(base_dir, exist_ok=True)
+    output_base_dir = input("Enter the output folder for reprojected files (leave blank to catalogue the files in their native CRS): ").strip()
+    target_crs = "EPSG:4326" if output_base_dir else None
+    if output_base_dir:
+        os.makedirs(output_base_dir, exist_ok=True)
+
+    # Get table name
+    table_name = input("Enter the target table (biomass_data or canopy_height_data): ").strip()
+    if table_name not in ['biomass_data', 'canopy_height_data']:
+        print("Invalid table name. Please enter 'biomass_data' or 'canopy_height_data'.")
+        return
+
+    # Get source and acquisition year
+    source = input("Enter the source name: ")
+    acquisition_year = input("Enter the acquisition year (leave blank to take it from the folder or file names): ").strip() or None
+    num_workers = int(input("Enter the number of workers (default: 4): ") or 4)
+    delete_raw = False
+    if target_crs is not None:
+        delete_raw = input("Delete raw files after successful conversion? (y/N): ").strip().lower() == 'y'
+
+    # Connect to the database
+    conn = EmbeddedCatalog(catalog_path) if catalog_path else connect_to_db(dbname, user, password, host, port)
+    if not conn:
+        return
+
+    file_queue = queue.Queue()
+    stop_event = threading.Event()
+    if mode == 'watch':
+        idle_minutes = input("Stop after how many minutes without new files? (leave blank to run until Ctrl+C): ").strip()
+        idle_timeout = float(idle_minutes) * 60 if idle_minutes else None
+        threading.Thread(
+            target=watch_directory, args=(base_dir, file_queue, stop_event),
+            kwargs={"idle_timeout": idle_timeout}, daemon=True
+        ).start()
+    else:
+        max_connections = int(input("Enter the number of parallel downloads (default: 8): ") or 8)
+        # The downloader is the only producer: it checks files that are already on disk and
+        # queues them once they are verified or repaired
+        start_agb_china_download(file_queue, base_dir, output_base_dir, max_connections)
+
+    start_time = time.time()
+    try:
+        inserted = ingest_stream(
+            conn, table_name, file_queue, base_dir, output_base_dir, source, acquisition_year,
+            target_crs, num_workers, delete_raw
+        )
+        print(f"Data loading completed. Inserted {inserted} records in {time.time() - start_time:.2f} seconds")
+    except KeyboardInterrupt:
+        print("Interrupted. Records committed so far are kept; re-run the script to continue.")
+    finally:
+        stop_event.set()
+        conn.close()
+
+if __name__ == '__main__':
+    setup_logging()
+    with profiling():
+        main()
@@ -0,0 +1,131 @@
+# Often run once per geometry, and answered from the grid summary without any raster when
+# possible, so numpy, GDAL, shapely and psycopg2 are imported where they are used.
+
+from collections import defaultdict
+
+from catalog_query import query_database, substitute_aggregates, prompt_filters
+from query_geometry import reproject_geometry
+from grid_summary import CELLS_PER_DEGREE, query_geometry_summary
+
+# Function to sum the valid pixels of a raster inside a geometry
+def get_file_sums(file_path, geom_4326, is_aggregate):
+    """
+    Return (sum, count) of the valid pixels of a file whose centers lie inside the geometry.
+
+    For aggregate tiles the sum and count bands are added up, so every source pixel
+    behind a cell is counted once.
+    """
+    import numpy as np
+    from osgeo import gdal
+
+    dataset = gdal.Open(file_path)
+    file_crs = dataset.GetProjection()
+    cutline = reproject_geometry(geom_4326, "EPSG:4326", file_crs)
+    # Cut on the native grid of the file, no resampling
+    clipped_ds = gdal.Warp(
+        '', dataset, format='MEM', cutlineWKT=cutline.wkt, cutlineSRS=file_crs,
+        cropToCutline=True, outputType=gdal.GDT_Float64, dstNodata=np.nan
+    )
+    if clipped_ds is None:
+        return 0.0, 0
+
+    if is_aggregate:
+        return (
+            float(np.nansum(clipped_ds.GetRasterBand(1).ReadAsArray())),
+            int(np.nansum(clipped_ds.GetRasterBand(2).ReadAsArray())),
+        )
+    data = clipped_ds.GetRasterBand(1).ReadAsArray()
+    valid = np.isfinite(data)
+    return float(data[valid].sum()), int(valid.sum())
+
+def get_zonal_stats(cursor, input_geom, input_crs="EPSG:4326", resolution_m=None, filters=None):
+    """
+    Compute sum, valid pixel count and mean of band 1 inside a geometry, per source and acquisition date.
+
+    If resolution_m is given, the coarsest aggregate level not coarser than resolution_m is
+    used instead of the full resolution files where one exists. Pixels are included if their
+    center lies inside the geometry, so a coarser level gives a coarser boundary.
+
+    Returns:
+        list: Dicts with table_name, source, acquisition_date, sum, count, mean and aggregated.
+    """
+    filters = filters or {}
+    geom_4326 = reproject_geometry(input_geom, input_crs, "EPSG:4326")
+    results = query_database(cursor, geom_4326.wkt, **filters)
+    aggregate_paths = set()
+    if resolution_m is not None and results:
+        results, aggregate_paths = substitute_aggregates(cursor, results, geom_4326.wkt, resolution_m, **filters)
+
+    totals = defaultdict(lambda: [0.0, 0])
+    aggregated = set()
+    for file_path, _, _, table_name, source, acquisition_date in results:
+        key = (table_name, source, acquisition_date)
+        file_sum, file_count = get_file_sums(file_path, geom_4326, file_path in aggregate_paths)
+        totals[key][0] += file_sum
+        totals[key][1] += file_count
+        if file_path in aggregate_paths:
+            aggregated.add(key)
+
+    return [
+        {
+            "table_name": table_name, "source": source, "acquisition_date": acquisition_date,
+            "sum": total, "count": count, "mean": total / count if count else float("nan"),
+            "aggregated": (table_name, source, acquisition_date) in aggregated,
+        }
+        for (table_name, source, acquisition_date), (total, count) in totals.items()
+    ]
+
+def main():
+    import psycopg2
+    from shapely.wkt import loads as load_wkt
+
+    dbname = input("Enter the database name: ") or "bmdata"
+    user = input("Enter the database username: ") or "nkreyenkamp"
+    password = input("Enter the database password (leave blank if not set): ") or None
+    host = input("Enter the database host (leave blank for default: localhost): ") or "localhost"
+    port = input("Enter the database port (leave blank for default: 5432): ") or "5432"
+
+    input_geom = load_wkt(input("Enter the geometry in WKT format: "))
+    input_crs = input("Enter the CRS for the input geometry (default: EPSG:4326): ") or "EPSG:4326"
+    use_summary = input("Answer from the precomputed grid summary if available? (y/N): ").strip().lower() == 'y'
+    cells_per_degree = None
+    if use_summary:
+        level_input = input(f"Enter the summary level in cells per degree ({', '.join(map(str, CELLS_PER_DEGREE))}, leave blank to choose automatically): ").strip()
+        cells_per_degree = int(level_input) if level_input else None
+    else:
+        resolution_input = input("Enter the resolution in meters the statistics may be computed at (leave blank for full resolution): ")
+        resolution_m = float(resolution_input) if resolution_input else None
+    filters = prompt_filters()
+
+    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host=host, port=port)
+    cursor = conn.cursor()
+    if use_summary:
+        geom_wkt = reproject_geometry(input_geom, input_crs, "EPSG:4326").wkt
+        summary = query_geometry_summary(cursor, geom_wkt, cells_per_degree, **filters)
+        if summary:
+            cursor.close()
+            conn.close()
+            for row in summary:
+                print(
+                    f"{row['table_name']}, {row['source']}, {row['year']}: sum {row['sum']:.6g}, valid pixels {row['count']}, "
+                    f"mean {row['mean']:.6g}, min {row['min']:.6g}, max {row['max']:.6g} ({row['cells']} cells of {row['cell_size_deg']:g}°)"
+                )
+            return
+        print("No grid summary found, reading the rasters.")
+        resolution_m = None
+    stats = get_zonal_stats(cursor, input_geom, input_crs, resolution_m, filters)
+    cursor.close()
+    conn.close()
+
+    if not stats:
+        print("No intersecting files found.")
+        return
+    for row in stats:
+        level = "aggregates" if row["aggregated"] else "full resolution"
+        print(
+            f"{row['table_name']}, {row['source']}, {row['acquisition_date']:%Y}: "
+            f"sum {row['sum']:.6g}, valid pixels {row['count']}, mean {row['mean']:.6g} ({level})"
+        )
+
+if __name__ == "__main__":
+    main()